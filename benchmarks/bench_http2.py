@@ -0,0 +1,161 @@
+"""HTTP/1.1 vs HTTP/2 throughput of default_async_client
+
+Starts a local stand-in server speaking HTTP/1.1 and h2c (prior knowledge)
+on the same port, with a fixed per-response latency to mimic a remote API,
+then sends the same batch of requests through both transports.
+
+    uv run --group http2 python benchmarks/bench_http2.py -n 2000 -c 100
+"""
+
+import argparse
+import asyncio
+import threading
+import time
+
+import h2.config
+import h2.connection
+import h2.events
+from loguru import logger
+
+from pypaladin import httpclient
+from pypaladin.table import DataTable
+
+_H2_PREFACE = b"PRI * HTTP/2.0\r\n\r\nSM\r\n\r\n"
+_BODY = b'{"status": 0, "message": "ok"}'
+
+
+class StandInServer:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.port = 0
+        self.connections = 0
+        self._loop = asyncio.new_event_loop()
+        self._ready = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+        self._ready.wait()
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        server = self._loop.run_until_complete(
+            asyncio.start_server(self._handle, "127.0.0.1", 0)
+        )
+        self.port = server.sockets[0].getsockname()[1]
+        self._ready.set()
+        self._loop.run_forever()
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        data = await reader.read(len(_H2_PREFACE))
+        try:
+            if data == _H2_PREFACE:
+                await self._serve_h2(data, reader, writer)
+            else:
+                await self._serve_http11(data, reader, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _serve_http11(self, data: bytes, reader, writer):
+        buffer = data
+        while True:
+            while b"\r\n\r\n" not in buffer:
+                chunk = await reader.read(65536)
+                if not chunk:
+                    return
+                buffer += chunk
+            _, buffer = buffer.split(b"\r\n\r\n", 1)
+            await asyncio.sleep(self.latency)
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                b"Content-Length: %d\r\n\r\n%s" % (len(_BODY), _BODY)
+            )
+            await writer.drain()
+
+    async def _serve_h2(self, data: bytes, reader, writer):
+        conn = h2.connection.H2Connection(
+            config=h2.config.H2Configuration(client_side=False)
+        )
+        conn.initiate_connection()
+
+        async def _respond(stream_id: int):
+            await asyncio.sleep(self.latency)
+            conn.send_headers(
+                stream_id,
+                [
+                    (":status", "200"),
+                    ("content-type", "application/json"),
+                    ("content-length", str(len(_BODY))),
+                ],
+            )
+            conn.send_data(stream_id, _BODY, end_stream=True)
+            writer.write(conn.data_to_send())
+
+        while data:
+            for event in conn.receive_data(data):
+                if isinstance(event, h2.events.RequestReceived):
+                    asyncio.ensure_future(_respond(event.stream_id))
+                elif isinstance(event, h2.events.ConnectionTerminated):
+                    return
+            writer.write(conn.data_to_send())
+            await writer.drain()
+            data = await reader.read(65536)
+
+
+async def _run_batch(base_url: str, requests: int, concurrency: int) -> float:
+    client = httpclient.default_async_client(base_url=base_url)
+    async with client:
+        started = time.perf_counter()
+        errors = 0
+        async for result in httpclient.gather_requests(
+            ("/weather" for _ in range(requests)),
+            concurrency=concurrency,
+            ordered=False,
+            client=client,
+        ):
+            errors += 0 if result.ok else 1
+        elapsed = time.perf_counter() - started
+    if errors:
+        logger.warning("{} requests failed", errors)
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--requests", type=int, default=2000)
+    parser.add_argument("-c", "--concurrency", type=int, default=100)
+    parser.add_argument("-l", "--latency", type=float, default=0.02)
+    parser.add_argument("--max-connections", type=int, default=20)
+    args = parser.parse_args()
+
+    logger.remove()
+    server = StandInServer(args.latency)
+    server.start()
+    base_url = f"http://127.0.0.1:{server.port}"
+
+    table = DataTable(["transport", "connections", "elapsed", "req/s"])
+    for name, http2 in (("HTTP/1.1", False), ("HTTP/2 (h2c)", True)):
+        httpclient._DEFAULT_CONF = httpclient.HTTPClientConfig(
+            log_response_detail=False,
+            trace_timings=False,
+            max_connections=args.max_connections,
+            http2=http2,
+            http1=not http2,
+        )
+        connections = server.connections
+        elapsed = asyncio.run(_run_batch(base_url, args.requests, args.concurrency))
+        table.add_row(
+            [
+                name,
+                server.connections - connections,
+                f"{elapsed:.2f}s",
+                f"{args.requests / elapsed:.0f}",
+            ]
+        )
+    print(table)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""Throughput of the pypaladin_map APIs against a local stand-in server
+
+Replays a cassette through `httpcassette.CassetteServer` with a fixed
+latency and optional error injection, then drives QQMapAPI,
+HefengWeatherApi and the location APIs at high concurrency. Without
+--cassette a synthetic cassette is recorded from canned responses; record
+a real one with HTTP_CLIENT__CASSETTE__MODE=record.
+
+    uv run python benchmarks/bench_map_apis.py -n 2000 -c 100 -l 0.05 -e 0.01
+"""
+
+import argparse
+import asyncio
+from concurrent import futures
+import statistics
+import tempfile
+import time
+from typing import Callable, List, Optional
+
+import httpx
+from loguru import logger
+
+from pypaladin import httpcassette, httpclient
+from pypaladin.table import DataTable
+from pypaladin_map import cache, location, qqmap, weather
+
+_CITIES = ["北京", "上海", "广州", "深圳", "杭州", "成都", "武汉", "西安"]
+
+
+def _ips(count: int) -> List[str]:
+    return [f"10.0.{i // 250}.{i % 250 + 1}" for i in range(count)]
+
+
+def _canned(request: httpx.Request) -> httpx.Response:
+    path = request.url.path
+    if path == "/ws/location/v1/ip":
+        return httpx.Response(
+            200,
+            json={
+                "status": 0,
+                "result": {
+                    "ip": request.url.params.get("ip"),
+                    "location": {"lat": 39.9, "lng": 116.4},
+                    "ad_info": {
+                        "nation": "中国",
+                        "province": "北京市",
+                        "adcode": 110101,
+                    },
+                },
+            },
+        )
+    if path == "/ws/weather/v1":
+        infos = {"weather": "晴", "temperature": 20, "wind_direction": "北风"}
+        return httpx.Response(
+            200,
+            json={
+                "status": 0,
+                "result": {"realtime": [{"update_time": "", "infos": infos}]},
+            },
+        )
+    if path == "/geo/v2/city/lookup":
+        name = request.url.params.get("location")
+        city = {"id": "101010100", "name": name, "adm1": name, "adm2": name}
+        return httpx.Response(200, json={"code": "200", "location": [city]})
+    if path == "/v7/weather/now":
+        now = {"temp": "20", "text": "晴", "windDir": "北风", "humidity": "40"}
+        return httpx.Response(200, json={"code": "200", "updateTime": "", "now": now})
+    ip = request.url.params.get("ip") or request.content.decode().partition("=")[2]
+    data = {"ip": ip, "country": "中国", "province": "北京", "city": "北京"}
+    return httpx.Response(200, json={"status": 1, "data": data})
+
+
+def _record_synthetic(path: str, ips: List[str]) -> httpcassette.Cassette:
+    cassette = httpcassette.Cassette(path, ignore_params=["sig"])
+    transport = httpcassette.RecordTransport(httpx.MockTransport(_canned), cassette)
+
+    def _client(base_url: str):
+        return httpx.Client(base_url=base_url, transport=transport)
+
+    qq_api = qqmap.QQMapAPI()
+    qq_api.client = _client(qqmap.BASE_URL)
+    hefeng_api = weather.HefengWeatherApi()
+    hefeng_api.client = _client(weather.HEFENG_BASE_URL)
+    ip77_api, uutool_api = location.IP77Api(), location.UUToolApi()
+    ip77_api.client = _client("https://api.ip77.net")
+    uutool_api.client = _client("https://api.uutool.cn")
+    for ip in ips:
+        qq_api.get_location(ip)
+        ip77_api.get_location(ip)
+        uutool_api.get_location(ip)
+    for city in _CITIES:
+        hefeng_location = hefeng_api.lookup_city(city)[0]
+        hefeng_api.get_weather(hefeng_location)
+        qq_api.get_weather(location.Location(area_code=hefeng_location.area_code))
+    return httpcassette.Cassette.load(path, ["sig"])
+
+
+def _run(
+    name: str, call: Callable[[int], object], requests: int, concurrency: int
+) -> list:
+    durations: List[float] = []
+    errors = 0
+
+    def _timed(i: int) -> Optional[float]:
+        started = time.perf_counter()
+        try:
+            call(i)
+        except Exception as e:
+            logger.debug("{} failed: {}", name, e)
+            return None
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for duration in executor.map(_timed, range(requests)):
+            if duration is None:
+                errors += 1
+            else:
+                durations.append(duration)
+    return _row(name, requests, errors, time.perf_counter() - started, durations)
+
+
+async def _arun(name: str, call, requests: int, concurrency: int) -> list:
+    semaphore = asyncio.Semaphore(concurrency)
+    durations: List[float] = []
+
+    async def _timed(i: int) -> bool:
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await call(i)
+            except Exception as e:
+                logger.debug("{} failed: {}", name, e)
+                return False
+            durations.append(time.perf_counter() - started)
+            return True
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(_timed(i) for i in range(requests)))
+    elapsed = time.perf_counter() - started
+    return _row(name, requests, results.count(False), elapsed, durations)
+
+
+def _row(name, requests, errors, elapsed, durations) -> list:
+    quantiles = statistics.quantiles(durations, n=100) if len(durations) > 1 else []
+    return [
+        name,
+        requests,
+        errors,
+        f"{elapsed:.2f}s",
+        f"{requests / elapsed:.0f}",
+        f"{quantiles[49] * 1000:.1f}ms" if quantiles else "-",
+        f"{quantiles[98] * 1000:.1f}ms" if quantiles else "-",
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--requests", type=int, default=2000)
+    parser.add_argument("-c", "--concurrency", type=int, default=100)
+    parser.add_argument("-l", "--latency", type=float, default=0.05)
+    parser.add_argument("-j", "--jitter", type=float, default=0.0)
+    parser.add_argument("-e", "--error-rate", type=float, default=0.0)
+    parser.add_argument("--cassette", help="recorded cassette, default: synthetic")
+    args = parser.parse_args()
+
+    logger.remove()
+    cache.setup(cache.MapCacheConfig(enabled=False))
+    ips = _ips(500)
+    if args.cassette:
+        cassette = httpcassette.Cassette.load(args.cassette, ["sig"])
+    else:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cassette = _record_synthetic(f"{tmpdir}/synthetic.jsonl.gz", ips)
+
+    server = httpcassette.CassetteServer(
+        cassette,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+    ).start()
+    httpclient._DEFAULT_CONF = httpclient.HTTPClientConfig(
+        log_response_detail=False,
+        trace_timings=False,
+        max_connections=args.concurrency,
+        max_keepalive_connections=args.concurrency,
+        cassette=httpcassette.CassetteConfig(mode="replay", server=server.url),
+    )
+
+    qq_api, hefeng_api = qqmap.QQMapAPI(), weather.HefengWeatherApi()
+    ip77_api, uutool_api = location.IP77Api(), location.UUToolApi()
+    async_qq_api = qqmap.AsyncQQMapAPI()
+    hefeng_location = location.Location(area_code="101010100")
+
+    table = DataTable(["api", "requests", "errors", "elapsed", "req/s", "p50", "p99"])
+    scenarios = [
+        ("QQMapAPI.get_location", lambda i: qq_api.get_location(ips[i % len(ips)])),
+        (
+            "HefengWeatherApi.lookup_city",
+            lambda i: hefeng_api.lookup_city(_CITIES[i % len(_CITIES)]),
+        ),
+        (
+            "HefengWeatherApi.get_weather",
+            lambda i: hefeng_api.get_weather(hefeng_location),
+        ),
+        ("IP77Api.get_location", lambda i: ip77_api.get_location(ips[i % len(ips)])),
+        (
+            "UUToolApi.get_location",
+            lambda i: uutool_api.get_location(ips[i % len(ips)]),
+        ),
+    ]
+    for name, call in scenarios:
+        table.add_row(_run(name, call, args.requests, args.concurrency))
+    table.add_row(
+        asyncio.run(
+            _arun(
+                "AsyncQQMapAPI.get_location",
+                lambda i: async_qq_api.get_location(ips[i % len(ips)]),
+                args.requests,
+                args.concurrency,
+            )
+        )
+    )
+    print(table)
+    print(f"server: {dict(server.stats)}")
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
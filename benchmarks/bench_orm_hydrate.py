@@ -0,0 +1,90 @@
+"""Row-to-object hydration of BaseObject.query on SQLite
+
+Loads N rows with bulk_create, then reads them back three ways: the former
+`model_validate(x, from_attributes=True)` over peewee Model instances,
+`query(validate=True)` and the default compiled fast path.
+
+    uv run --group orm python benchmarks/bench_orm_hydrate.py -n 1000000
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from typing import Optional
+
+from loguru import logger
+from peewee import CharField, FloatField, IntegerField
+
+from pypaladin.table import DataTable
+from pypaladin_orm import objects
+from pypaladin_orm.dbmodel import BaseDBModel
+
+
+class RecordDB(BaseDBModel):
+    name = CharField(max_length=32)
+    email = CharField(max_length=64)
+    age = IntegerField()
+    score = FloatField()
+
+    class Meta:  # type: ignore
+        table_name = "bench_records"
+
+
+class Record(objects.BaseObject):
+    __dbmodel__ = RecordDB
+
+    name: str = ""
+    email: str = ""
+    age: int = 0
+    score: Optional[float] = None
+
+
+def _legacy_query():
+    return [Record.model_validate(x, from_attributes=True) for x in RecordDB.select()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--rows", type=int, default=1000000)
+    args = parser.parse_args()
+
+    logger.remove()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        objects.setup_db(
+            objects.DBConfig(
+                database=os.path.join(tmpdir, "bench.db"), auto_create_tables=True
+            )
+        )
+        started = time.perf_counter()
+        Record.bulk_create(
+            Record(name=f"user{i}", email=f"user{i}@example.com", age=i % 100, score=i)
+            for i in range(args.rows)
+        )
+        print(f"loaded {args.rows} rows in {time.perf_counter() - started:.2f}s")
+
+        table = DataTable(["method", "rows", "elapsed", "rows/s", "speedup"])
+        baseline = None
+        for name, func in [
+            ("model_validate(from_attributes)", _legacy_query),
+            ("query(validate=True)", lambda: Record.query(validate=True)),
+            ("query()", Record.query),
+        ]:
+            started = time.perf_counter()
+            count = len(func())
+            elapsed = time.perf_counter() - started
+            baseline = baseline or elapsed
+            table.add_row(
+                [
+                    name,
+                    count,
+                    f"{elapsed:.2f}s",
+                    f"{count / elapsed:.0f}",
+                    f"{baseline / elapsed:.2f}x",
+                ]
+            )
+        print(table)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Per-request signing overhead of QQMapAPI
+
+Compares the former `_get_req_params` (list-wrapped params, re-sorting and
+hashing the whole string every call) with `QQMapSigner.sign` and
+`QQMapSigner.sign_many`.
+
+    uv run python benchmarks/bench_qqmap_sign.py -n 100000
+"""
+
+import argparse
+import hashlib
+import time
+from urllib import parse
+
+from pypaladin.table import DataTable
+from pypaladin_map import qqmap
+
+_KEY = "RKABZ-DCAEB-5VPUG-N4XPP-HGE4K-VXBL6"
+_SECRET = "gB38imb0E05bQV8f4aYA2uQVHFfYUFbR"
+
+
+def _legacy_sign(url, params=None) -> dict:
+    params = params or {}
+    for k, v in params.items() or {}:
+        params[k] = v if isinstance(v, list) else [v]
+    params["key"] = [_KEY]
+    sorted_params = {}
+    for k in sorted(params.keys()):
+        sorted_params[k] = params[k]
+
+    query = parse.urlencode(sorted_params, doseq=True)
+    sig = hashlib.md5(f"{url}?{query}{_SECRET}".encode("utf-8")).hexdigest()
+    sorted_params["sig"] = [sig]
+    return sorted_params
+
+
+def _timeit(func, count: int) -> float:
+    started = time.perf_counter()
+    func()
+    return (time.perf_counter() - started) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--requests", type=int, default=100000)
+    args = parser.parse_args()
+
+    signer = qqmap.QQMapSigner(_KEY, _SECRET)
+    ips = [
+        f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}"
+        for i in range(args.requests)
+    ]
+    path = qqmap.LOCATION_PATH
+    cases = [
+        (
+            "_get_req_params",
+            lambda: [_legacy_sign(f"{path}?ip={ip}", {"ip": ip}) for ip in ips],
+        ),
+        ("QQMapSigner.sign", lambda: [signer.sign(path, {"ip": ip}) for ip in ips]),
+        (
+            "QQMapSigner.sign_many",
+            lambda: signer.sign_many(path, ({"ip": ip} for ip in ips)),
+        ),
+    ]
+    table = DataTable(["method", "requests", "per request", "speedup"])
+    baseline = None
+    for name, func in cases:
+        cost = _timeit(func, args.requests)
+        baseline = baseline or cost
+        table.add_row(
+            [name, args.requests, f"{cost * 1e6:.2f}us", f"{baseline / cost:.2f}x"]
+        )
+    print(table)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
 import subprocess
 
-sources = ["src", "tests", "scripts"]
+sources = ["src", "tests", "scripts", "benchmarks"]
 
 print("====== remove unused import =====")
 subprocess.run(["ruff", "check", "--fix", "--select", "F401"] + sources, check=True)
@@ -0,0 +1,154 @@
+"""Hedged calls across redundant providers
+
+The first call starts immediately. Each following one starts when the
+previous has not answered within `hedge_delay` seconds, or right away when
+it fails. The first successful result wins and the other calls are
+cancelled.
+
+Sync calls run on a shared, bounded thread pool. Losing calls that are
+still queued are cancelled; a thread blocked in a request cannot be
+interrupted, so losers already running finish on the pool and their
+results are discarded.
+"""
+
+import asyncio
+from concurrent import futures
+import threading
+import time
+from typing import Awaitable, Callable, List, Optional, Sequence, TypeVar
+
+from loguru import logger
+
+T = TypeVar("T")
+
+DEFAULT_HEDGE_DELAY = 0.3
+# 共享线程池的大小, 限制同时执行的同步调用数量
+DEFAULT_MAX_WORKERS = 16
+
+_executor: Optional[futures.ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> futures.ThreadPoolExecutor:
+    """所有 race 共用的线程池"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = futures.ThreadPoolExecutor(
+                max_workers=DEFAULT_MAX_WORKERS, thread_name_prefix="hedge"
+            )
+        return _executor
+
+
+def _name(call) -> str:
+    call = getattr(call, "func", call)
+    return getattr(call, "__qualname__", None) or repr(call)
+
+
+def _failed(errors: List[BaseException]) -> IOError:
+    return IOError(f"all {len(errors)} calls failed, last error: {errors[-1]}")
+
+
+def race(
+    calls: Sequence[Callable[[], T]],
+    hedge_delay: float = DEFAULT_HEDGE_DELAY,
+    timeout: Optional[float] = None,
+    executor: Optional[futures.Executor] = None,
+) -> T:
+    """Return the first successful result of `calls`
+
+    Args:
+        executor: 执行调用的线程池, 默认使用 `get_executor()`
+    """
+    if not calls:
+        raise ValueError("no calls to race")
+    deadline = None if timeout is None else time.monotonic() + timeout
+    executor = executor or get_executor()
+    pending = {}
+    errors: List[BaseException] = []
+
+    def _launch():
+        call = calls[len(pending) + len(errors)]
+        logger.debug("hedge: start {}", _name(call))
+        pending[executor.submit(call)] = call
+
+    try:
+        _launch()
+        while pending:
+            started = len(pending) + len(errors)
+            wait = None if deadline is None else max(0, deadline - time.monotonic())
+            if started < len(calls):
+                wait = hedge_delay if wait is None else min(wait, hedge_delay)
+            done, _ = futures.wait(
+                pending, timeout=wait, return_when=futures.FIRST_COMPLETED
+            )
+            if not done:
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise TimeoutError(f"no call finished in {timeout}s")
+                _launch()
+                continue
+            for task in done:
+                call = pending.pop(task)
+                error = task.exception()
+                if error is None:
+                    logger.debug("hedge: {} won", _name(call))
+                    return task.result()
+                logger.debug("hedge: {} failed: {}", _name(call), error)
+                errors.append(error)
+            # 失败时立即启动下一个, 不再等待 hedge_delay
+            if len(pending) + len(errors) < len(calls):
+                _launch()
+        raise _failed(errors)
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def async_race(
+    calls: Sequence[Callable[[], Awaitable[T]]],
+    hedge_delay: float = DEFAULT_HEDGE_DELAY,
+    timeout: Optional[float] = None,
+) -> T:
+    """Async version of `race`, losing calls are cancelled"""
+    if not calls:
+        raise ValueError("no calls to race")
+    loop = asyncio.get_running_loop()
+    deadline = None if timeout is None else loop.time() + timeout
+    pending = {}
+    errors: List[BaseException] = []
+
+    def _launch():
+        call = calls[len(pending) + len(errors)]
+        logger.debug("hedge: start {}", _name(call))
+        pending[asyncio.ensure_future(call())] = call
+
+    try:
+        _launch()
+        while pending:
+            started = len(pending) + len(errors)
+            wait = None if deadline is None else max(0, deadline - loop.time())
+            if started < len(calls):
+                wait = hedge_delay if wait is None else min(wait, hedge_delay)
+            done, _ = await asyncio.wait(
+                pending, timeout=wait, return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                if deadline is not None and loop.time() >= deadline:
+                    raise TimeoutError(f"no call finished in {timeout}s")
+                _launch()
+                continue
+            for task in done:
+                call = pending.pop(task)
+                error = task.exception()
+                if error is None:
+                    logger.debug("hedge: {} won", _name(call))
+                    return task.result()
+                logger.debug("hedge: {} failed: {}", _name(call), error)
+                errors.append(error)
+            # 失败时立即启动下一个, 不再等待 hedge_delay
+            if len(pending) + len(errors) < len(calls):
+                _launch()
+        raise _failed(errors)
+    finally:
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,477 @@
+"""HTTP response cache transport
+
+`CacheTransport` / `AsyncCacheTransport` wrap another httpx transport and
+keep GET responses according to Cache-Control / Expires. Stale entries with
+an ETag or Last-Modified are revalidated with a conditional request, a 304
+answer is served from the cache. Bodies are stored while the caller reads
+them; Range requests bypass the cache.
+"""
+
+import abc
+import calendar
+import collections
+import dataclasses
+import email.utils
+import hashlib
+import json
+import os
+from pathlib import Path
+import struct
+import threading
+import time
+from typing import (
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Literal,
+    Optional,
+    Tuple,
+)
+
+import httpx
+from loguru import logger
+from pydantic import BaseModel
+
+# RFC 9111 4.2.2, 允许启发式缓存的状态码
+_HEURISTIC_STATUS = (200, 203, 204, 300, 301, 308, 404, 405, 410, 414, 501)
+# 启发式有效期上限(秒)
+_HEURISTIC_MAX_AGE = 24 * 3600
+
+
+class HTTPCacheConfig(BaseModel):
+    enabled: bool = False
+    backend: Literal["memory", "file"] = "memory"
+    # file 后端的缓存目录
+    directory: str = "~/.cache/pypaladin/http"
+    # 缓存总大小上限(字节), 超出时按最近最少使用淘汰
+    max_size: int = 64 * 1024 * 1024
+    # 单个响应大小上限(字节)
+    max_entry_size: int = 8 * 1024 * 1024
+
+
+@dataclasses.dataclass
+class CacheEntry:
+    status_code: int
+    headers: List[Tuple[str, str]]
+    content: bytes
+    stored_at: float
+    # 请求中被 Vary 引用的头部
+    vary: Dict[str, str] = dataclasses.field(default_factory=dict)
+
+    @property
+    def size(self) -> int:
+        return len(self.content)
+
+    def header(self, name: str) -> Optional[str]:
+        return httpx.Headers(self.headers).get(name)
+
+    def cache_control(self) -> Dict[str, Optional[str]]:
+        return parse_cache_control(self.header("Cache-Control"))
+
+    def freshness_lifetime(self) -> float:
+        cache_control = self.cache_control()
+        if "max-age" in cache_control:
+            return _to_seconds(cache_control["max-age"])
+        date = parse_http_date(self.header("Date")) or self.stored_at
+        if self.header("Expires") is not None:
+            expires = parse_http_date(self.header("Expires"))
+            return max(expires - date, 0) if expires else 0
+        last_modified = parse_http_date(self.header("Last-Modified"))
+        if last_modified and self.status_code in _HEURISTIC_STATUS:
+            return min(max(date - last_modified, 0) / 10, _HEURISTIC_MAX_AGE)
+        return 0
+
+    def is_fresh(self) -> bool:
+        cache_control = self.cache_control()
+        if "no-cache" in cache_control:
+            return False
+        return time.time() - self.stored_at < self.freshness_lifetime()
+
+    def has_validators(self) -> bool:
+        return bool(self.header("ETag") or self.header("Last-Modified"))
+
+    def to_response(self, request: httpx.Request) -> httpx.Response:
+        return httpx.Response(
+            self.status_code,
+            headers=self.headers,
+            stream=httpx.ByteStream(self.content),
+            request=request,
+            extensions={"from_cache": True},
+        )
+
+    def dumps(self) -> bytes:
+        meta = json.dumps(
+            {
+                "status_code": self.status_code,
+                "headers": self.headers,
+                "stored_at": self.stored_at,
+                "vary": self.vary,
+            }
+        ).encode()
+        return struct.pack(">I", len(meta)) + meta + self.content
+
+    @classmethod
+    def loads(cls, data: bytes) -> "CacheEntry":
+        (meta_len,) = struct.unpack_from(">I", data)
+        meta = json.loads(data[4 : 4 + meta_len])
+        return cls(
+            status_code=meta["status_code"],
+            headers=[tuple(x) for x in meta["headers"]],  # type: ignore
+            content=data[4 + meta_len :],
+            stored_at=meta["stored_at"],
+            vary=meta["vary"],
+        )
+
+
+def parse_cache_control(value: Optional[str]) -> Dict[str, Optional[str]]:
+    directives: Dict[str, Optional[str]] = {}
+    for item in (value or "").split(","):
+        name, _, arg = item.strip().partition("=")
+        if name:
+            directives[name.lower()] = arg.strip('"') if arg else None
+    return directives
+
+
+def _to_seconds(value: Optional[str]) -> float:
+    try:
+        return max(int(value or 0), 0)
+    except ValueError:
+        return 0
+
+
+def parse_http_date(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    parsed = email.utils.parsedate(value)
+    return calendar.timegm(parsed) if parsed else None
+
+
+class CacheStorage(abc.ABC):
+    @abc.abstractmethod
+    def get(self, key: str) -> Optional[CacheEntry]: ...
+
+    @abc.abstractmethod
+    def set(self, key: str, entry: CacheEntry): ...
+
+    @abc.abstractmethod
+    def delete(self, key: str): ...
+
+
+class MemoryCacheStorage(CacheStorage):
+    """LRU storage bounded by the total size of the cached bodies"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._size = 0
+        self._entries: collections.OrderedDict[str, CacheEntry] = (
+            collections.OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key: str, entry: CacheEntry):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old.size
+            self._entries[key] = entry
+            self._size += entry.size
+            while self._size > self.max_size and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= evicted.size
+
+    def delete(self, key: str):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._size -= entry.size
+
+
+class FileCacheStorage(CacheStorage):
+    """One file per entry, oldest accessed files are removed beyond max_size"""
+
+    def __init__(self, directory: str, max_size: int):
+        self.directory = Path(directory).expanduser()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._size = sum(x.stat().st_size for x in self.directory.glob("*.cache"))
+
+    def _path(self, key: str) -> Path:
+        return self.directory.joinpath(
+            hashlib.sha256(key.encode()).hexdigest() + ".cache"
+        )
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        try:
+            return CacheEntry.loads(data)
+        except (ValueError, KeyError, struct.error):
+            logger.warning("invalid cache file {}", path)
+            self.delete(key)
+            return None
+
+    def set(self, key: str, entry: CacheEntry):
+        path = self._path(key)
+        data = entry.dumps()
+        tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+        tmp_path.write_bytes(data)
+        with self._lock:
+            self._size -= path.stat().st_size if path.exists() else 0
+            os.replace(tmp_path, path)
+            self._size += len(data)
+            if self._size > self.max_size:
+                self._evict()
+
+    def delete(self, key: str):
+        path = self._path(key)
+        with self._lock:
+            try:
+                size = path.stat().st_size
+                path.unlink()
+            except FileNotFoundError:
+                return
+            self._size -= size
+
+    def _evict(self):
+        files = []
+        for path in self.directory.glob("*.cache"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        self._size = sum(x[1] for x in files)
+        for _, size, path in sorted(files):
+            if self._size <= self.max_size:
+                break
+            path.unlink(missing_ok=True)
+            self._size -= size
+
+
+def create_storage(config: HTTPCacheConfig) -> CacheStorage:
+    if config.backend == "file":
+        return FileCacheStorage(config.directory, config.max_size)
+    return MemoryCacheStorage(config.max_size)
+
+
+class _CacheLogic:
+    def __init__(self, storage: CacheStorage, max_entry_size: int):
+        self.storage = storage
+        self.max_entry_size = max_entry_size
+
+    @staticmethod
+    def _key(request: httpx.Request) -> str:
+        return f"{request.method} {request.url}"
+
+    @staticmethod
+    def _cacheable_request(request: httpx.Request) -> bool:
+        # 缓存只保存完整响应, 范围请求直接转发
+        return (
+            request.method == "GET"
+            and "Range" not in request.headers
+            and "If-Range" not in request.headers
+        )
+
+    def lookup(
+        self, request: httpx.Request
+    ) -> Tuple[Optional[CacheEntry], Optional[httpx.Response]]:
+        """Return the usable entry and, if it is fresh, the cached response.
+
+        Conditional headers are added to the request for stale entries.
+        """
+        if not self._cacheable_request(request):
+            return None, None
+        req_cache_control = parse_cache_control(request.headers.get("Cache-Control"))
+        if "no-store" in req_cache_control:
+            return None, None
+        entry = self.storage.get(self._key(request))
+        if entry is None:
+            return None, None
+        if any(request.headers.get(k, "") != v for k, v in entry.vary.items()):
+            return None, None
+        if entry.is_fresh() and "no-cache" not in req_cache_control:
+            logger.debug("Cache hit: {} {}", request.method, request.url)
+            return entry, entry.to_response(request)
+        if not entry.has_validators():
+            return None, None
+        if entry.header("ETag"):
+            request.headers["If-None-Match"] = entry.header("ETag")  # type: ignore
+        if entry.header("Last-Modified"):
+            request.headers["If-Modified-Since"] = entry.header("Last-Modified")  # type: ignore
+        return entry, None
+
+    def revalidated(
+        self, request: httpx.Request, entry: CacheEntry, response: httpx.Response
+    ) -> httpx.Response:
+        logger.debug("Cache revalidated: {} {}", request.method, request.url)
+        headers = httpx.Headers(entry.headers)
+        for k, v in response.headers.items():
+            if k.lower() not in ("content-length", "content-encoding"):
+                headers[k] = v
+        entry = dataclasses.replace(
+            entry, headers=list(headers.items()), stored_at=time.time()
+        )
+        self.storage.set(self._key(request), entry)
+        return entry.to_response(request)
+
+    def should_store(self, request: httpx.Request, response: httpx.Response) -> bool:
+        if not self._cacheable_request(request):
+            return False
+        if "no-store" in parse_cache_control(request.headers.get("Cache-Control")):
+            return False
+        cache_control = parse_cache_control(response.headers.get("Cache-Control"))
+        if "no-store" in cache_control or response.headers.get("Vary") == "*":
+            return False
+        if response.status_code not in _HEURISTIC_STATUS:
+            return False
+        content_length = response.headers.get("Content-Length")
+        if content_length and int(content_length) > self.max_entry_size:
+            return False
+        return (
+            "max-age" in cache_control
+            or "Expires" in response.headers
+            or "ETag" in response.headers
+            or "Last-Modified" in response.headers
+        )
+
+    def record(self, request: httpx.Request, response: httpx.Response):
+        """边读取边保存响应内容, 读取完成后写入缓存"""
+        if response.is_stream_consumed:
+            if len(response.content) <= self.max_entry_size:
+                self.store(request, response, response.content)
+            return
+        response.stream = _RecordingStream(
+            response.stream,  # type: ignore
+            self.max_entry_size,
+            lambda content: self.store(request, response, content),
+        )
+
+    def store(self, request: httpx.Request, response: httpx.Response, content: bytes):
+        entry = CacheEntry(
+            status_code=response.status_code,
+            headers=list(response.headers.multi_items()),
+            content=content,
+            stored_at=time.time(),
+            vary={
+                k.strip(): request.headers.get(k.strip(), "")
+                for k in response.headers.get("Vary", "").split(",")
+                if k.strip()
+            },
+        )
+        self.storage.set(self._key(request), entry)
+
+
+class _RecordingStream(httpx.SyncByteStream, httpx.AsyncByteStream):
+    """转发响应内容并保存副本, 超过 max_size 后放弃保存"""
+
+    def __init__(self, stream, max_size: int, on_complete: Callable[[bytes], None]):
+        self._stream = stream
+        self._max_size = max_size
+        self._on_complete = on_complete
+        self._chunks: Optional[List[bytes]] = []
+        self._size = 0
+        self._complete = False
+
+    def _add(self, chunk: bytes):
+        if self._chunks is None:
+            return
+        self._size += len(chunk)
+        if self._size > self._max_size:
+            self._chunks = None
+        else:
+            self._chunks.append(chunk)
+
+    def _finish(self):
+        if self._complete and self._chunks is not None:
+            self._on_complete(b"".join(self._chunks))
+        self._chunks = None
+
+    def __iter__(self) -> Iterator[bytes]:
+        for chunk in self._stream:
+            self._add(chunk)
+            yield chunk
+        self._complete = True
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self._stream:
+            self._add(chunk)
+            yield chunk
+        self._complete = True
+
+    def close(self) -> None:
+        try:
+            self._stream.close()
+        finally:
+            self._finish()
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            self._finish()
+
+
+class CacheTransport(httpx.BaseTransport):
+    def __init__(
+        self,
+        transport: httpx.BaseTransport,
+        storage: CacheStorage,
+        max_entry_size: int = HTTPCacheConfig().max_entry_size,
+    ):
+        self.transport = transport
+        self._cache = _CacheLogic(storage, max_entry_size)
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        entry, cached = self._cache.lookup(request)
+        if cached is not None:
+            return cached
+        response = self.transport.handle_request(request)
+        if entry is not None and response.status_code == 304:
+            response.close()
+            return self._cache.revalidated(request, entry, response)
+        if self._cache.should_store(request, response):
+            self._cache.record(request, response)
+        return response
+
+    def close(self) -> None:
+        self.transport.close()
+
+
+class AsyncCacheTransport(httpx.AsyncBaseTransport):
+    def __init__(
+        self,
+        transport: httpx.AsyncBaseTransport,
+        storage: CacheStorage,
+        max_entry_size: int = HTTPCacheConfig().max_entry_size,
+    ):
+        self.transport = transport
+        self._cache = _CacheLogic(storage, max_entry_size)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        entry, cached = self._cache.lookup(request)
+        if cached is not None:
+            return cached
+        response = await self.transport.handle_async_request(request)
+        if entry is not None and response.status_code == 304:
+            await response.aclose()
+            return self._cache.revalidated(request, entry, response)
+        if self._cache.should_store(request, response):
+            self._cache.record(request, response)
+        return response
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
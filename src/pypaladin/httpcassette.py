@@ -0,0 +1,422 @@
+"""Record and replay HTTP traffic
+
+In `record` mode the clients built by `default_client` save every
+request/response pair into a cassette, a gzip compressed JSON lines file.
+In `replay` mode the responses come from the cassette instead of the
+network, or, when `server` is set, from a `CassetteServer` listening there.
+The server adds latency and injected errors, which makes it usable as a
+stand-in for third-party APIs in benchmarks.
+
+Requests are matched on method, Host, path, query and body. Query
+parameters listed in `ignore_params` (e.g. signatures) are left out.
+Repeated requests replay their recorded responses in turn.
+"""
+
+import asyncio
+import base64
+import collections
+import gzip
+import hashlib
+import json
+from pathlib import Path
+import random
+import threading
+from typing import Deque, Dict, Iterable, List, Literal, Optional, Set, Tuple, Union
+from urllib import parse
+
+import httpx
+from loguru import logger
+from pydantic import BaseModel
+
+# 不保存的响应头, 回放时重新生成
+_SKIP_HEADERS = {"content-length", "transfer-encoding", "connection", "date"}
+
+
+class CassetteConfig(BaseModel):
+    mode: Literal["off", "record", "replay"] = "off"
+    path: str = "cassette.jsonl.gz"
+    # replay 模式下把请求转发到替身服务器, 如 http://127.0.0.1:8080
+    server: Optional[str] = None
+    # 匹配请求时忽略的查询参数
+    ignore_params: List[str] = ["sig"]
+
+
+class CassetteMissError(httpx.TransportError):
+    pass
+
+
+def request_key(
+    method: str,
+    host: str,
+    target: Union[str, bytes],
+    body: bytes = b"",
+    ignore_params: Iterable[str] = (),
+) -> str:
+    """请求的匹配 key, target 为 path 和 query"""
+    if isinstance(target, bytes):
+        target = target.decode()
+    path, _, query = target.partition("?")
+    ignored = set(ignore_params)
+    params = sorted(
+        (k, v)
+        for k, v in parse.parse_qsl(query, keep_blank_values=True)
+        if k not in ignored
+    )
+    key = f"{method.upper()} {host}{path}"
+    if params:
+        key += "?" + parse.urlencode(params)
+    if body:
+        key += " " + hashlib.sha1(body).hexdigest()[:16]
+    return key
+
+
+def _key(request: httpx.Request, ignore_params: Iterable[str]) -> str:
+    return request_key(
+        request.method,
+        request.headers.get("host", request.url.netloc.decode()),
+        request.url.raw_path,
+        request.content,
+        ignore_params,
+    )
+
+
+class Cassette:
+    def __init__(self, path: Union[Path, str], ignore_params: Iterable[str] = ()):
+        self.path = Path(path).expanduser()
+        self.ignore_params = list(ignore_params)
+        self._entries: Dict[str, List[dict]] = collections.defaultdict(list)
+        self._cursors: Dict[str, int] = collections.defaultdict(int)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(
+        cls, path: Union[Path, str], ignore_params: Iterable[str] = ()
+    ) -> "Cassette":
+        cassette = cls(path, ignore_params)
+        with gzip.open(cassette.path, "rt", encoding="utf-8") as fp:
+            for line in fp:
+                if line.strip():
+                    entry = json.loads(line)
+                    cassette._entries[entry["key"]].append(entry)
+        logger.debug("loaded {} requests from {}", len(cassette), cassette.path)
+        return cassette
+
+    def __len__(self) -> int:
+        return sum(len(x) for x in self._entries.values())
+
+    def record(self, request: httpx.Request, response: httpx.Response, content: bytes):
+        try:
+            body = {"text": content.decode()}
+        except UnicodeDecodeError:
+            body = {"base64": base64.b64encode(content).decode()}
+        entry = {
+            "key": _key(request, self.ignore_params),
+            "url": str(request.url),
+            "status": response.status_code,
+            "headers": [
+                [k, v]
+                for k, v in response.headers.multi_items()
+                if k.lower() not in _SKIP_HEADERS
+            ],
+            **body,
+        }
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._entries[entry["key"]].append(entry)
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # 每次追加一个 gzip member, 读取时自动拼接
+            with gzip.open(self.path, "at", encoding="utf-8") as fp:
+                fp.write(line)
+
+    def find(self, key: str) -> Optional[Tuple[int, List[Tuple[str, str]], bytes]]:
+        """按录制顺序轮流返回 (status, headers, content)"""
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                return None
+            entry = entries[self._cursors[key] % len(entries)]
+            self._cursors[key] += 1
+        if "base64" in entry:
+            content = base64.b64decode(entry["base64"])
+        else:
+            content = entry["text"].encode()
+        return entry["status"], [tuple(x) for x in entry["headers"]], content
+
+    def response(self, request: httpx.Request) -> httpx.Response:
+        key = _key(request, self.ignore_params)
+        found = self.find(key)
+        if found is None:
+            raise CassetteMissError(f"no recorded response for {key}", request=request)
+        status, headers, content = found
+        return httpx.Response(
+            status,
+            headers=headers,
+            stream=httpx.ByteStream(content),
+            request=request,
+            extensions={"from_cassette": True},
+        )
+
+
+class RecordTransport(httpx.BaseTransport):
+    def __init__(self, transport: httpx.BaseTransport, cassette: Cassette):
+        self.transport = transport
+        self.cassette = cassette
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        response = self.transport.handle_request(request)
+        try:
+            content = b"".join(response.stream)  # type: ignore
+        finally:
+            response.close()
+        self.cassette.record(request, response, content)
+        return httpx.Response(
+            response.status_code,
+            headers=response.headers,
+            stream=httpx.ByteStream(content),
+            request=request,
+            extensions=response.extensions,
+        )
+
+    def close(self) -> None:
+        self.transport.close()
+
+
+class AsyncRecordTransport(httpx.AsyncBaseTransport):
+    def __init__(self, transport: httpx.AsyncBaseTransport, cassette: Cassette):
+        self.transport = transport
+        self.cassette = cassette
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        response = await self.transport.handle_async_request(request)
+        try:
+            content = b"".join([x async for x in response.stream])  # type: ignore
+        finally:
+            await response.aclose()
+        self.cassette.record(request, response, content)
+        return httpx.Response(
+            response.status_code,
+            headers=response.headers,
+            stream=httpx.ByteStream(content),
+            request=request,
+            extensions=response.extensions,
+        )
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+class ReplayTransport(httpx.BaseTransport):
+    def __init__(self, cassette: Cassette):
+        self.cassette = cassette
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        request.read()
+        return self.cassette.response(request)
+
+
+class AsyncReplayTransport(httpx.AsyncBaseTransport):
+    def __init__(self, cassette: Cassette):
+        self.cassette = cassette
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await request.aread()
+        return self.cassette.response(request)
+
+
+def _reroute(request: httpx.Request, server: httpx.URL):
+    # Host 头保持不变, 替身服务器据此匹配录制的请求
+    request.url = request.url.copy_with(
+        scheme=server.scheme, host=server.host, port=server.port
+    )
+
+
+class RerouteTransport(httpx.BaseTransport):
+    """Send every request to `server`, keeping the original Host header"""
+
+    def __init__(self, transport: httpx.BaseTransport, server: str):
+        self.transport = transport
+        self.server = httpx.URL(server)
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        _reroute(request, self.server)
+        return self.transport.handle_request(request)
+
+    def close(self) -> None:
+        self.transport.close()
+
+
+class AsyncRerouteTransport(httpx.AsyncBaseTransport):
+    def __init__(self, transport: httpx.AsyncBaseTransport, server: str):
+        self.transport = transport
+        self.server = httpx.URL(server)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        _reroute(request, self.server)
+        return await self.transport.handle_async_request(request)
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+_cassettes: Dict[str, Cassette] = {}
+_cassettes_lock = threading.Lock()
+
+
+def get_cassette(config: CassetteConfig) -> Cassette:
+    """Cassette shared by all clients using the same config"""
+    with _cassettes_lock:
+        key = config.model_dump_json()
+        if key not in _cassettes:
+            path = Path(config.path).expanduser()
+            if config.mode == "replay":
+                _cassettes[key] = Cassette.load(path, config.ignore_params)
+            else:
+                _cassettes[key] = Cassette(path, config.ignore_params)
+        return _cassettes[key]
+
+
+def wrap_transport(transport: httpx.BaseTransport, config: CassetteConfig):
+    if config.mode == "record":
+        return RecordTransport(transport, get_cassette(config))
+    if config.mode == "replay":
+        if config.server:
+            return RerouteTransport(transport, config.server)
+        return ReplayTransport(get_cassette(config))
+    return transport
+
+
+def wrap_async_transport(transport: httpx.AsyncBaseTransport, config: CassetteConfig):
+    if config.mode == "record":
+        return AsyncRecordTransport(transport, get_cassette(config))
+    if config.mode == "replay":
+        if config.server:
+            return AsyncRerouteTransport(transport, config.server)
+        return AsyncReplayTransport(get_cassette(config))
+    return transport
+
+
+class CassetteServer:
+    """Local HTTP/1.1 server answering with the responses of a cassette
+
+    Args:
+        latency: 每个响应的固定延迟(秒)
+        jitter: 额外的随机延迟上限(秒)
+        error_rate: 返回 error_status 的请求比例
+    """
+
+    def __init__(
+        self,
+        cassette: Cassette,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0,
+        jitter: float = 0,
+        error_rate: float = 0,
+        error_status: int = 503,
+    ):
+        self.cassette = cassette
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.stats: Dict[str, int] = collections.Counter()
+        self._loop = asyncio.new_event_loop()
+        self._ready = threading.Event()
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._thread: Optional[threading.Thread] = None
+        self._writers: Set[asyncio.StreamWriter] = set()
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def start(self) -> "CassetteServer":
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def stop(self):
+        if self._thread is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._thread = None
+        self._loop.close()
+
+    async def _shutdown(self):
+        if self._server is not None:
+            self._server.close()
+        # 断开仍保持的 keep-alive 连接, 让请求处理正常退出
+        for writer in list(self._writers):
+            writer.close()
+        tasks = [x for x in asyncio.all_tasks() if x is not asyncio.current_task()]
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._server = self._loop.run_until_complete(
+            asyncio.start_server(self._handle, self.host, self.port)
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        self._loop.run_forever()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer):
+        self._writers.add(writer)
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                lines = head.decode("latin-1").split("\r\n")
+                method, target, _ = lines[0].split(" ", 2)
+                headers = httpx.Headers(
+                    [tuple(x.split(":", 1)) for x in lines[1:] if ":" in x]  # type: ignore
+                )
+                length = int(headers.get("content-length", 0))
+                body = await reader.readexactly(length) if length else b""
+                status, resp_headers, content = await self._respond(
+                    method, headers.get("host", "").strip(), target, body
+                )
+                writer.write(self._encode(status, resp_headers, content))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _respond(
+        self, method: str, host: str, target: str, body: bytes
+    ) -> Tuple[int, List[Tuple[str, str]], bytes]:
+        delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            await asyncio.sleep(delay)
+        self.stats["requests"] += 1
+        if self.error_rate and random.random() < self.error_rate:
+            self.stats["errors"] += 1
+            return self.error_status, [], b"injected error"
+        key = request_key(method, host, target, body, self.cassette.ignore_params)
+        found = self.cassette.find(key)
+        if found is None:
+            self.stats["misses"] += 1
+            logger.warning("no recorded response for {}", key)
+            return 404, [], f"no recorded response for {key}".encode()
+        return found
+
+    @staticmethod
+    def _encode(status: int, headers: List[Tuple[str, str]], content: bytes) -> bytes:
+        lines: Deque[str] = collections.deque(
+            f"{k}: {v}" for k, v in headers if k.lower() not in _SKIP_HEADERS
+        )
+        lines.appendleft(f"HTTP/1.1 {status} {httpx.codes.get_reason_phrase(status)}")
+        lines.append(f"Content-Length: {len(content)}")
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + content
@@ -1,10 +1,32 @@
+import asyncio
+import atexit
+import collections
+from concurrent import futures
+import dataclasses
 import re
-from typing import Dict, List, Optional
+import threading
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+import weakref
+import zlib
 
 import httpx
 from loguru import logger
 from pydantic import BaseModel
 
+from pypaladin import httpcache, httpcassette, httpretry, httptrace, ratelimit
+
 
 TYPE_WWW_FORM = "application/x-www-form-urlencoded"
 TYPE_JSON = "application/json"
@@ -26,11 +48,47 @@ _resp_detail = """
 
 class HTTPClientConfig(BaseModel):
     log_response_detail: bool = True
+    # 详情日志中响应体的最大长度(字节)
+    log_response_detail_max_bytes: int = 4096
     timeout: int = 60
     retries: int = 0
+    # connection pool
+    max_connections: Optional[int] = 100
+    max_keepalive_connections: Optional[int] = 20
+    keepalive_expiry: Optional[float] = 5.0
+    # 启用 HTTP/2 (需要安装 h2), 同一 host 的并发请求复用一个多路复用连接
+    http2: bool = False
+    # 为 False 时以 prior knowledge 方式直接使用 h2c, 仅用于明文 HTTP/2 服务
+    http1: bool = True
+    # 启用 HTTP/2 时每个连接池的最大连接数, 默认与 max_connections 相同
+    http2_max_connections: Optional[int] = None
+    cache: httpcache.HTTPCacheConfig = httpcache.HTTPCacheConfig()
+    # 重试策略, 重试次数由 retries 指定
+    retry: httpretry.RetryConfig = httpretry.RetryConfig()
+    circuit_breaker: httpretry.CircuitBreakerConfig = httpretry.CircuitBreakerConfig()
+    # 记录连接/TLS/首字节等各阶段耗时, 见 httptrace
+    trace_timings: bool = True
+    # 替换 httpcore 的 network backend, 先解析域名以单独记录 DNS 耗时;
+    # 关闭时 DNS 耗时计入 connect
+    trace_dns: bool = False
+    # 按 base_url 或 host 限流, 同一 host 的所有 client 共享令牌桶
+    rate_limits: Dict[str, ratelimit.RateLimitConfig] = {}
+    # 录制/回放请求, 用于离线测试和基准测试, 见 httpcassette
+    cassette: httpcassette.CassetteConfig = httpcassette.CassetteConfig()
 
 
 _DEFAULT_CONF: HTTPClientConfig = HTTPClientConfig()
+# (配置对象, 序列化结果), 配置对象被替换后重新计算
+_conf_key: Tuple[Optional[HTTPClientConfig], str] = (None, "")
+
+
+def _config_key() -> str:
+    global _conf_key
+    conf, key = _conf_key
+    if conf is not _DEFAULT_CONF:
+        key = _DEFAULT_CONF.model_dump_json()
+        _conf_key = (_DEFAULT_CONF, key)
+    return key
 
 
 def format_headers(headers: httpx.Headers):
@@ -59,32 +117,251 @@ def _log_response(resp: httpx.Response) -> None:
     )
 
 
-def _log_response_detail(resp: httpx.Response):
-    if _text_regex.match(resp.headers.get("Content-Type", "")):
-        resp.read()
-        content = resp.text
-        elapsed = resp.elapsed.total_seconds()
-    else:
-        content = "<omitted>"
-        elapsed = ""
-    logger.trace(
+def _emit_response_detail(resp: httpx.Response, content: Callable[[], str]):
+    """Log the details lazily, nothing is formatted unless a sink accepts TRACE"""
+
+    def _elapsed():
+        try:
+            return resp.elapsed.total_seconds()
+        except RuntimeError:
+            return ""
+
+    logger.opt(lazy=True).trace(
         _resp_detail,
-        method=resp.request.method,
-        url=resp.request.url,
-        headers=format_headers(resp.request.headers),
-        status_code=resp.status_code,
-        reason_phrase=resp.reason_phrase,
-        resp_headers=format_headers(resp.headers),
-        elapsed=elapsed,
+        method=lambda: resp.request.method,
+        url=lambda: resp.request.url,
+        headers=lambda: format_headers(resp.request.headers),
+        status_code=lambda: resp.status_code,
+        reason_phrase=lambda: resp.reason_phrase,
+        resp_headers=lambda: format_headers(resp.headers),
+        elapsed=_elapsed,
         content=content,
     )
 
 
+class _BodyPreview:
+    """Keep the first bytes of a response body while it is being consumed"""
+
+    def __init__(self, resp: httpx.Response, max_bytes: int):
+        self.resp = resp
+        self.max_bytes = max_bytes
+        self.chunks: List[bytes] = []
+        self.captured = 0
+        self.total = 0
+
+    def feed(self, chunk: bytes):
+        self.total += len(chunk)
+        if self.captured < self.max_bytes:
+            chunk = chunk[: self.max_bytes - self.captured]
+            self.chunks.append(chunk)
+            self.captured += len(chunk)
+
+    def _decode(self) -> bytes:
+        raw = b"".join(self.chunks)
+        encoding = self.resp.headers.get("Content-Encoding", "identity").lower()
+        if encoding in ("", "identity"):
+            return raw
+        if encoding in ("gzip", "deflate"):
+            # 32 + MAX_WBITS 自动识别 gzip/zlib 头, 截断的数据也能部分解压
+            wbits = zlib.MAX_WBITS | 32
+            try:
+                return zlib.decompressobj(wbits).decompress(raw, self.max_bytes)
+            except zlib.error:
+                return zlib.decompressobj(-zlib.MAX_WBITS).decompress(raw)
+        raise ValueError(encoding)
+
+    def content(self) -> str:
+        try:
+            content = self._decode()[: self.max_bytes].decode(
+                self.resp.encoding or "utf-8", errors="replace"
+            )
+        except (ValueError, zlib.error):
+            content = f"<{self.resp.headers.get('Content-Encoding')} encoded>"
+        if self.total > self.captured:
+            content += f"\n... <truncated, {self.total} bytes received>"
+        return content
+
+    def emit(self):
+        _emit_response_detail(self.resp, self.content)
+
+
+class _PreviewStream(httpx.SyncByteStream):
+    def __init__(self, stream: httpx.SyncByteStream, preview: _BodyPreview):
+        self._stream = stream
+        self._preview = preview
+
+    def __iter__(self):
+        for chunk in self._stream:
+            self._preview.feed(chunk)
+            yield chunk
+
+    def close(self):
+        self._stream.close()
+        self._preview.emit()
+
+
+class _AsyncPreviewStream(httpx.AsyncByteStream):
+    def __init__(self, stream: httpx.AsyncByteStream, preview: _BodyPreview):
+        self._stream = stream
+        self._preview = preview
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            self._preview.feed(chunk)
+            yield chunk
+
+    async def aclose(self):
+        await self._stream.aclose()
+        self._preview.emit()
+
+
+def _log_response_detail(resp: httpx.Response):
+    """Log response details once the body is consumed by the caller.
+
+    The body is never read here, only the first
+    `log_response_detail_max_bytes` bytes are kept while the caller consumes
+    it, so streaming responses stay streaming. The record is formatted lazily,
+    decoding and formatting only happen when a sink accepts TRACE.
+    """
+    if not _text_regex.match(resp.headers.get("Content-Type", "")):
+        _emit_response_detail(resp, lambda: "<omitted>")
+        return
+    preview = _BodyPreview(resp, _DEFAULT_CONF.log_response_detail_max_bytes)
+    if isinstance(resp.stream, httpx.AsyncByteStream):
+        resp.stream = _AsyncPreviewStream(resp.stream, preview)
+    else:
+        resp.stream = _PreviewStream(resp.stream, preview)  # type: ignore
+
+
 def _raise_for_status(resp: httpx.Response):
     """Log request details."""
     resp.raise_for_status()
 
 
+async def _alog_request(request: httpx.Request) -> None:
+    _log_request(request)
+
+
+async def _alog_response(resp: httpx.Response) -> None:
+    _log_response(resp)
+
+
+async def _alog_response_detail(resp: httpx.Response):
+    _log_response_detail(resp)
+
+
+async def _araise_for_status(resp: httpx.Response):
+    resp.raise_for_status()
+
+
+def _limits(http2: bool = False) -> httpx.Limits:
+    max_connections = _DEFAULT_CONF.max_connections
+    if http2 and _DEFAULT_CONF.http2_max_connections:
+        max_connections = _DEFAULT_CONF.http2_max_connections
+    return httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=_DEFAULT_CONF.max_keepalive_connections,
+        keepalive_expiry=_DEFAULT_CONF.keepalive_expiry,
+    )
+
+
+_cache_storages: Dict[str, httpcache.CacheStorage] = {}
+_cache_storages_lock = threading.Lock()
+
+
+def _cache_storage(config: httpcache.HTTPCacheConfig) -> httpcache.CacheStorage:
+    """Cache storages are shared by all clients with the same cache config"""
+    key = config.model_dump_json()
+    with _cache_storages_lock:
+        if key not in _cache_storages:
+            _cache_storages[key] = httpcache.create_storage(config)
+        return _cache_storages[key]
+
+
+def _retry_policy(retries: Optional[int] = None) -> Optional[httpretry.RetryPolicy]:
+    retries = retries or _DEFAULT_CONF.retries
+    if not retries and not _DEFAULT_CONF.circuit_breaker.enabled:
+        return None
+    return httpretry.RetryPolicy(retries, _DEFAULT_CONF.retry)
+
+
+def _check_http2(http2: bool):
+    # httpcore 在协商到 HTTP/2 时才导入 h2, 提前检查以免请求中途报错
+    if not http2:
+        return
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        raise ImportError(
+            "Using http2=True, but the 'h2' package is not installed, "
+            "install it with: pip install pypaladin[http2]"
+        ) from None
+
+
+def _build_transport(
+    retries: Optional[int] = None, http2: Optional[bool] = None
+) -> httpx.BaseTransport:
+    http2 = _DEFAULT_CONF.http2 if http2 is None else http2
+    _check_http2(http2)
+    transport: httpx.BaseTransport = httpx.HTTPTransport(
+        http1=_DEFAULT_CONF.http1 or not http2, http2=http2, limits=_limits(http2)
+    )
+    if _DEFAULT_CONF.trace_timings and _DEFAULT_CONF.trace_dns:
+        httptrace.instrument_transport(transport)
+    transport = httpcassette.wrap_transport(transport, _DEFAULT_CONF.cassette)
+    if _DEFAULT_CONF.rate_limits:
+        transport = ratelimit.RateLimitTransport(transport, _DEFAULT_CONF.rate_limits)
+    policy = _retry_policy(retries)
+    if policy:
+        transport = httpretry.RetryTransport(
+            transport, policy, _DEFAULT_CONF.circuit_breaker
+        )
+    if _DEFAULT_CONF.cache.enabled:
+        transport = httpcache.CacheTransport(
+            transport,
+            _cache_storage(_DEFAULT_CONF.cache),
+            max_entry_size=_DEFAULT_CONF.cache.max_entry_size,
+        )
+    return transport
+
+
+def _build_async_transport(
+    retries: Optional[int] = None, http2: Optional[bool] = None
+) -> httpx.AsyncBaseTransport:
+    http2 = _DEFAULT_CONF.http2 if http2 is None else http2
+    _check_http2(http2)
+    transport: httpx.AsyncBaseTransport = httpx.AsyncHTTPTransport(
+        http1=_DEFAULT_CONF.http1 or not http2, http2=http2, limits=_limits(http2)
+    )
+    if _DEFAULT_CONF.trace_timings and _DEFAULT_CONF.trace_dns:
+        httptrace.instrument_transport(transport)
+    transport = httpcassette.wrap_async_transport(transport, _DEFAULT_CONF.cassette)
+    if _DEFAULT_CONF.rate_limits:
+        transport = ratelimit.AsyncRateLimitTransport(
+            transport, _DEFAULT_CONF.rate_limits
+        )
+    policy = _retry_policy(retries)
+    if policy:
+        transport = httpretry.AsyncRetryTransport(
+            transport, policy, _DEFAULT_CONF.circuit_breaker
+        )
+    if _DEFAULT_CONF.cache.enabled:
+        transport = httpcache.AsyncCacheTransport(
+            transport,
+            _cache_storage(_DEFAULT_CONF.cache),
+            max_entry_size=_DEFAULT_CONF.cache.max_entry_size,
+        )
+    return transport
+
+
+def _client_kwargs(timeout: Optional[int] = None) -> Dict:
+    timeout = timeout or _DEFAULT_CONF.timeout
+    kwargs = {}
+    if timeout:
+        kwargs["timeout"] = timeout
+    return kwargs
+
+
 def default_client(
     base_url: str = "",
     auth=None,
@@ -92,25 +369,347 @@ def default_client(
     headers: Optional[Dict] = None,
     retries: Optional[int] = None,
     timeout: Optional[int] = None,
+    http2: Optional[bool] = None,
 ) -> httpx.Client:
     event_hooks: Dict[str, List] = {
         "request": [_log_request],
         "response": [_log_response],
     }
+    if _DEFAULT_CONF.trace_timings:
+        event_hooks["request"].append(httptrace.trace_request)
     if _DEFAULT_CONF.log_response_detail:
         event_hooks["response"].append(_log_response_detail)
     if raise_for_status:
         event_hooks["response"].append(_raise_for_status)
-    timeout = timeout or _DEFAULT_CONF.timeout
-    retries = retries or _DEFAULT_CONF.retries
-    kwargs = {}
-    if timeout:
-        kwargs["timeout"] = timeout
     return httpx.Client(
         base_url=base_url,
         auth=auth,
         headers=headers,
         event_hooks=event_hooks,
-        transport=httpx.HTTPTransport(retries=retries),
-        **kwargs,
+        transport=_build_transport(retries=retries, http2=http2),
+        **_client_kwargs(timeout=timeout),
     )
+
+
+def default_async_client(
+    base_url: str = "",
+    auth=None,
+    raise_for_status=False,
+    headers: Optional[Dict] = None,
+    retries: Optional[int] = None,
+    timeout: Optional[int] = None,
+    http2: Optional[bool] = None,
+) -> httpx.AsyncClient:
+    """Async counterpart of `default_client`"""
+    event_hooks: Dict[str, List] = {
+        "request": [_alog_request],
+        "response": [_alog_response],
+    }
+    if _DEFAULT_CONF.trace_timings:
+        event_hooks["request"].append(httptrace.atrace_request)
+    if _DEFAULT_CONF.log_response_detail:
+        event_hooks["response"].append(_alog_response_detail)
+    if raise_for_status:
+        event_hooks["response"].append(_araise_for_status)
+    return httpx.AsyncClient(
+        base_url=base_url,
+        auth=auth,
+        headers=headers,
+        event_hooks=event_hooks,
+        transport=_build_async_transport(retries=retries, http2=http2),
+        **_client_kwargs(timeout=timeout),
+    )
+
+
+class ClientRegistry:
+    """Process wide registry of pooled, keep-alive clients
+
+    Clients are keyed by base_url, client options and the current
+    `HTTPClientConfig`, so every caller asking for the same endpoint reuses
+    one connection pool. The config is serialized once per config object,
+    replace `_DEFAULT_CONF` instead of modifying it in place. Async clients are
+    additionally bound to the event loop they were created in. Shared clients
+    must not be closed by callers.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients: Dict[Tuple, httpx.Client] = {}
+        self._async_clients: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+    @staticmethod
+    def _key(base_url, raise_for_status, headers, retries, timeout) -> Tuple:
+        return (
+            base_url,
+            raise_for_status,
+            tuple(sorted((headers or {}).items())),
+            retries,
+            timeout,
+            _config_key(),
+        )
+
+    def get_client(
+        self,
+        base_url: str = "",
+        raise_for_status=False,
+        headers: Optional[Dict] = None,
+        retries: Optional[int] = None,
+        timeout: Optional[int] = None,
+    ) -> httpx.Client:
+        key = self._key(base_url, raise_for_status, headers, retries, timeout)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None or client.is_closed:
+                client = default_client(
+                    base_url=base_url,
+                    raise_for_status=raise_for_status,
+                    headers=headers,
+                    retries=retries,
+                    timeout=timeout,
+                )
+                self._clients[key] = client
+            return client
+
+    def get_async_client(
+        self,
+        base_url: str = "",
+        raise_for_status=False,
+        headers: Optional[Dict] = None,
+        retries: Optional[int] = None,
+        timeout: Optional[int] = None,
+    ) -> httpx.AsyncClient:
+        key = self._key(base_url, raise_for_status, headers, retries, timeout)
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if loop not in self._async_clients:
+                self._drop_closed_loops()
+            clients = self._async_clients.setdefault(loop, {})
+            client = clients.get(key)
+            if client is None or client.is_closed:
+                client = default_async_client(
+                    base_url=base_url,
+                    raise_for_status=raise_for_status,
+                    headers=headers,
+                    retries=retries,
+                    timeout=timeout,
+                )
+                clients[key] = client
+            return client
+
+    def _drop_closed_loops(self):
+        """移除事件循环已关闭的客户端, 调用方需持有锁"""
+        for loop in [x for x in self._async_clients if x.is_closed()]:
+            clients = self._async_clients.pop(loop)
+            logger.debug("drop {} async clients of closed event loop", len(clients))
+
+    def close(self):
+        """Close all sync clients
+
+        Async clients can only be closed in their own event loop with
+        `aclose`, they are dropped from the registry here.
+        """
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+            async_clients = sum(len(x) for x in self._async_clients.values())
+            self._async_clients.clear()
+        for client in clients:
+            client.close()
+        if async_clients:
+            logger.debug(
+                "skip closing {} async clients outside their event loop", async_clients
+            )
+
+    async def aclose(self):
+        """Close async clients bound to the running event loop"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            clients = self._async_clients.pop(loop, {})
+        for client in clients.values():
+            await client.aclose()
+
+
+_REGISTRY = ClientRegistry()
+atexit.register(_REGISTRY.close)
+
+
+def shared_client(
+    base_url: str = "",
+    raise_for_status=False,
+    headers: Optional[Dict] = None,
+    retries: Optional[int] = None,
+    timeout: Optional[int] = None,
+) -> httpx.Client:
+    """Get a pooled client from the process wide registry"""
+    return _REGISTRY.get_client(
+        base_url=base_url,
+        raise_for_status=raise_for_status,
+        headers=headers,
+        retries=retries,
+        timeout=timeout,
+    )
+
+
+def shared_async_client(
+    base_url: str = "",
+    raise_for_status=False,
+    headers: Optional[Dict] = None,
+    retries: Optional[int] = None,
+    timeout: Optional[int] = None,
+) -> httpx.AsyncClient:
+    """Get a pooled async client bound to the running event loop"""
+    return _REGISTRY.get_async_client(
+        base_url=base_url,
+        raise_for_status=raise_for_status,
+        headers=headers,
+        retries=retries,
+        timeout=timeout,
+    )
+
+
+def close_shared_clients():
+    _REGISTRY.close()
+
+
+async def aclose_shared_clients():
+    """Close the shared async clients of the running event loop"""
+    await _REGISTRY.aclose()
+
+
+@dataclasses.dataclass
+class RequestSpec:
+    url: str
+    method: str = "GET"
+    params: Optional[Dict] = None
+    headers: Optional[Dict] = None
+    json: Any = None
+    data: Optional[Dict] = None
+    content: Optional[Union[str, bytes]] = None
+
+    def request_kwargs(self) -> Dict:
+        return {k: v for k, v in dataclasses.asdict(self).items() if v is not None}
+
+
+@dataclasses.dataclass
+class RequestResult:
+    index: int
+    spec: RequestSpec
+    response: Optional[httpx.Response] = None
+    error: Optional[Exception] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+RequestLike = Union[RequestSpec, Dict, str]
+
+
+def _to_spec(item: RequestLike) -> RequestSpec:
+    if isinstance(item, RequestSpec):
+        return item
+    if isinstance(item, str):
+        return RequestSpec(url=item)
+    return RequestSpec(**item)
+
+
+def _send(client: httpx.Client, index: int, spec: RequestSpec) -> RequestResult:
+    try:
+        return RequestResult(
+            index, spec, response=client.request(**spec.request_kwargs())
+        )
+    except Exception as e:
+        return RequestResult(index, spec, error=e)
+
+
+async def _asend(
+    client: httpx.AsyncClient, index: int, spec: RequestSpec
+) -> RequestResult:
+    try:
+        response = await client.request(**spec.request_kwargs())
+        return RequestResult(index, spec, response=response)
+    except Exception as e:
+        return RequestResult(index, spec, error=e)
+
+
+def fetch_many(
+    requests: Iterable[RequestLike],
+    base_url: str = "",
+    concurrency: int = 10,
+    ordered: bool = True,
+    raise_for_status: bool = False,
+    client: Optional[httpx.Client] = None,
+) -> Iterator[RequestResult]:
+    """Send requests from a thread pool over one pooled client
+
+    At most `concurrency` requests are in flight, the input iterable is
+    consumed lazily. Results are yielded in input order, or as they complete
+    if `ordered` is False. Errors are returned in `RequestResult.error`
+    instead of aborting the batch.
+    """
+    client = client or shared_client(base_url, raise_for_status=raise_for_status)
+    specs = enumerate(_to_spec(x) for x in requests)
+    with futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending: Deque[futures.Future] = collections.deque()
+
+        def _submit(count: int):
+            for index, spec in specs:
+                pending.append(executor.submit(_send, client, index, spec))
+                count -= 1
+                if count <= 0:
+                    break
+
+        _submit(concurrency)
+        while pending:
+            if ordered:
+                done = [pending.popleft()]
+            else:
+                done, _ = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    pending.remove(future)
+            for future in done:
+                yield future.result()
+            _submit(len(done))
+
+
+async def gather_requests(
+    requests: Iterable[RequestLike],
+    base_url: str = "",
+    concurrency: int = 10,
+    ordered: bool = True,
+    raise_for_status: bool = False,
+    client: Optional[httpx.AsyncClient] = None,
+) -> AsyncIterator[RequestResult]:
+    """Async counterpart of `fetch_many`"""
+    client = client or shared_async_client(base_url, raise_for_status=raise_for_status)
+    specs = enumerate(_to_spec(x) for x in requests)
+    pending: Deque[asyncio.Task] = collections.deque()
+
+    def _submit(count: int):
+        for index, spec in specs:
+            pending.append(asyncio.ensure_future(_asend(client, index, spec)))
+            count -= 1
+            if count <= 0:
+                break
+
+    try:
+        _submit(concurrency)
+        while pending:
+            if ordered:
+                done = [pending.popleft()]
+                await done[0]
+            else:
+                done, _ = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    pending.remove(task)
+            for task in done:
+                yield task.result()
+            _submit(len(done))
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            # 等待取消完成, 释放占用的连接
+            await asyncio.gather(*pending, return_exceptions=True)
@@ -0,0 +1,279 @@
+"""Retry and circuit breaker transports
+
+`RetryTransport` / `AsyncRetryTransport` retry connection errors for any
+method, and read errors or retryable status codes (429, 5xx) for idempotent
+requests, with exponential backoff, jitter and Retry-After support.
+
+A per-host `CircuitBreaker` opens after consecutive failures so calls to a
+degraded provider fail fast with `CircuitOpenError` instead of waiting for
+the timeout, and lets a single trial request through after the recovery
+timeout.
+"""
+
+import asyncio
+import random
+import threading
+import time
+from typing import Dict, List, Optional
+
+import httpx
+from loguru import logger
+from pydantic import BaseModel
+
+from pypaladin.httpcache import parse_http_date
+
+IDEMPOTENT_METHODS = ["GET", "HEAD", "OPTIONS", "PUT", "DELETE", "TRACE"]
+# 请求未发送到服务端, 任何方法都可以安全重试
+_CONNECT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class RetryConfig(BaseModel):
+    # 第 n 次重试前等待 backoff_factor * 2^(n-1) 秒, 最多 backoff_max 秒
+    backoff_factor: float = 0.5
+    backoff_max: float = 30
+    jitter: bool = True
+    status_forcelist: List[int] = [429, 500, 502, 503, 504]
+    methods: List[str] = IDEMPOTENT_METHODS
+    respect_retry_after: bool = True
+    # Retry-After 超过该值时不再重试, 直接返回响应
+    retry_after_max: float = 60
+
+
+class CircuitBreakerConfig(BaseModel):
+    enabled: bool = False
+    # 连续失败次数达到该值时熔断
+    failure_threshold: int = 5
+    # 熔断后经过该时间(秒)允许一次试探请求
+    recovery_timeout: float = 30
+
+
+class CircuitOpenError(httpx.TransportError):
+    """Raised without sending the request while the host circuit is open"""
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, host: str, config: CircuitBreakerConfig):
+        self.host = host
+        self.config = config
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if time.monotonic() - self.opened_at < self.config.recovery_timeout:
+                return False
+            # 每个恢复周期只放行一个试探请求
+            if self.state == self.OPEN:
+                logger.info("circuit half open: {}", self.host)
+            self.state = self.HALF_OPEN
+            self.opened_at = time.monotonic()
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info("circuit closed: {}", self.host)
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if (
+                self.state == self.HALF_OPEN
+                or self.failures >= self.config.failure_threshold
+            ):
+                if self.state != self.OPEN:
+                    logger.warning(
+                        "circuit open: {}, failures: {}", self.host, self.failures
+                    )
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(host: str, config: CircuitBreakerConfig) -> CircuitBreaker:
+    """Circuit breakers are shared by all clients in the process"""
+    with _breakers_lock:
+        if host not in _breakers:
+            _breakers[host] = CircuitBreaker(host, config)
+        return _breakers[host]
+
+
+class RetryPolicy:
+    def __init__(self, retries: int, config: Optional[RetryConfig] = None):
+        self.retries = retries
+        self.config = config or RetryConfig()
+
+    def is_idempotent(self, request: httpx.Request) -> bool:
+        return (
+            request.method in self.config.methods
+            or "Idempotency-Key" in request.headers
+        )
+
+    def should_retry_error(
+        self, request: httpx.Request, exc: Exception, attempt: int
+    ) -> bool:
+        if attempt >= self.retries or isinstance(exc, CircuitOpenError):
+            return False
+        return isinstance(exc, _CONNECT_ERRORS) or self.is_idempotent(request)
+
+    def retry_delay(
+        self, request: httpx.Request, response: httpx.Response, attempt: int
+    ) -> Optional[float]:
+        """Delay before retrying the response, None if it must be returned"""
+        if attempt >= self.retries:
+            return None
+        if response.status_code not in self.config.status_forcelist:
+            return None
+        if not self.is_idempotent(request):
+            return None
+        retry_after = self.retry_after(response)
+        if retry_after is None:
+            return self.backoff(attempt)
+        if retry_after > self.config.retry_after_max:
+            return None
+        return retry_after
+
+    def retry_after(self, response: httpx.Response) -> Optional[float]:
+        value = response.headers.get("Retry-After")
+        if not self.config.respect_retry_after or not value:
+            return None
+        try:
+            return max(float(value), 0)
+        except ValueError:
+            date = parse_http_date(value)
+            return max(date - time.time(), 0) if date else None
+
+    def backoff(self, attempt: int) -> float:
+        delay = min(self.config.backoff_factor * 2**attempt, self.config.backoff_max)
+        if self.config.jitter:
+            delay = random.uniform(delay / 2, delay)
+        return delay
+
+
+def _is_failure(response: httpx.Response) -> bool:
+    return response.status_code >= 500
+
+
+class RetryTransport(httpx.BaseTransport):
+    def __init__(
+        self,
+        transport: httpx.BaseTransport,
+        policy: RetryPolicy,
+        breaker_config: Optional[CircuitBreakerConfig] = None,
+    ):
+        self.transport = transport
+        self.policy = policy
+        self.breaker_config = breaker_config
+
+    def _breaker(self, request: httpx.Request) -> Optional[CircuitBreaker]:
+        if not self.breaker_config or not self.breaker_config.enabled:
+            return None
+        return get_circuit_breaker(request.url.netloc.decode(), self.breaker_config)
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        breaker = self._breaker(request)
+        attempt = 0
+        while True:
+            if breaker and not breaker.allow():
+                raise CircuitOpenError(f"circuit open: {breaker.host}", request=request)
+            try:
+                response = self.transport.handle_request(request)
+            except httpx.TransportError as e:
+                if breaker:
+                    breaker.record_failure()
+                if not self.policy.should_retry_error(request, e, attempt):
+                    raise
+                delay = self.policy.backoff(attempt)
+                logger.warning("{} {} failed: {}", request.method, request.url, e)
+            else:
+                if breaker and _is_failure(response):
+                    breaker.record_failure()
+                elif breaker:
+                    breaker.record_success()
+                retry_delay = self.policy.retry_delay(request, response, attempt)
+                if retry_delay is None:
+                    return response
+                delay = retry_delay
+                response.close()
+            attempt += 1
+            logger.debug(
+                "retry {} {} in {:.2f}s ({}/{})",
+                request.method,
+                request.url,
+                delay,
+                attempt,
+                self.policy.retries,
+            )
+            time.sleep(delay)
+
+    def close(self) -> None:
+        self.transport.close()
+
+
+class AsyncRetryTransport(httpx.AsyncBaseTransport):
+    def __init__(
+        self,
+        transport: httpx.AsyncBaseTransport,
+        policy: RetryPolicy,
+        breaker_config: Optional[CircuitBreakerConfig] = None,
+    ):
+        self.transport = transport
+        self.policy = policy
+        self.breaker_config = breaker_config
+
+    def _breaker(self, request: httpx.Request) -> Optional[CircuitBreaker]:
+        if not self.breaker_config or not self.breaker_config.enabled:
+            return None
+        return get_circuit_breaker(request.url.netloc.decode(), self.breaker_config)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        breaker = self._breaker(request)
+        attempt = 0
+        while True:
+            if breaker and not breaker.allow():
+                raise CircuitOpenError(f"circuit open: {breaker.host}", request=request)
+            try:
+                response = await self.transport.handle_async_request(request)
+            except httpx.TransportError as e:
+                if breaker:
+                    breaker.record_failure()
+                if not self.policy.should_retry_error(request, e, attempt):
+                    raise
+                delay = self.policy.backoff(attempt)
+                logger.warning("{} {} failed: {}", request.method, request.url, e)
+            else:
+                if breaker and _is_failure(response):
+                    breaker.record_failure()
+                elif breaker:
+                    breaker.record_success()
+                retry_delay = self.policy.retry_delay(request, response, attempt)
+                if retry_delay is None:
+                    return response
+                delay = retry_delay
+                await response.aclose()
+            attempt += 1
+            logger.debug(
+                "retry {} {} in {:.2f}s ({}/{})",
+                request.method,
+                request.url,
+                delay,
+                attempt,
+                self.policy.retries,
+            )
+            await asyncio.sleep(delay)
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
@@ -0,0 +1,276 @@
+"""Per-phase HTTP timings
+
+Timings are collected from httpcore's `trace` request extension. httpcore
+resolves host names inside `connect_tcp`, so DNS time is part of `connect`.
+With `trace_dns` enabled the pool's network backend is wrapped to resolve
+first and report DNS separately; this replaces httpcore's own connect logic
+and is therefore off by default.
+
+Every finished request produces a `RequestTimings` tagged with the `trace`
+value of `pypaladin.context`; it is logged at DEBUG and passed to the
+listeners registered with `add_listener`, e.g. to feed histograms.
+"""
+
+import contextvars
+import dataclasses
+import socket
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import anyio
+import httpcore
+import httpx
+from loguru import logger
+
+from pypaladin import context
+
+# httpcore 事件名(去掉 http11/http2 前缀) -> 计时字段
+_PHASES = {
+    "connect_tcp": "connect",
+    "start_tls": "tls",
+    "send_request_headers": "request_write",
+    "send_request_body": "request_write",
+    "receive_response_headers": "ttfb",
+    "receive_response_body": "body_read",
+}
+
+
+@dataclasses.dataclass
+class RequestTimings:
+    method: str
+    url: str
+    trace: Optional[str] = None
+    status_code: Optional[int] = None
+    http_version: Optional[str] = None
+    # 各阶段耗时(秒), 复用连接时 dns/connect/tls 为 None
+    # pool_wait: 从发起请求到开始建立连接或发送请求, 即等待连接池的时间
+    pool_wait: Optional[float] = None
+    dns: Optional[float] = None
+    connect: Optional[float] = None
+    tls: Optional[float] = None
+    request_write: Optional[float] = None
+    ttfb: Optional[float] = None
+    body_read: Optional[float] = None
+    total: Optional[float] = None
+    error: Optional[str] = None
+
+    @property
+    def reused_connection(self) -> bool:
+        return self.connect is None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dataclasses.asdict(self)
+
+
+TimingListener = Callable[[RequestTimings], None]
+
+_listeners: List[TimingListener] = []
+# 正在建立连接的请求, 供 network backend 记录 DNS 耗时
+_connecting: contextvars.ContextVar[Optional[RequestTimings]] = contextvars.ContextVar(
+    "connecting_request", default=None
+)
+
+
+def add_listener(listener: TimingListener):
+    if listener not in _listeners:
+        _listeners.append(listener)
+
+
+def remove_listener(listener: TimingListener):
+    if listener in _listeners:
+        _listeners.remove(listener)
+
+
+def _format(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value * 1000:.1f}ms"
+
+
+def _emit(timings: RequestTimings):
+    logger.debug(
+        "Timing: {} {} -> {} pool={} dns={} connect={} tls={} write={} ttfb={} "
+        "body={} total={}",
+        timings.method,
+        timings.url,
+        timings.error or timings.status_code,
+        _format(timings.pool_wait),
+        _format(timings.dns),
+        _format(timings.connect),
+        _format(timings.tls),
+        _format(timings.request_write),
+        _format(timings.ttfb),
+        _format(timings.body_read),
+        _format(timings.total),
+    )
+    for listener in _listeners:
+        try:
+            listener(timings)
+        except Exception as e:
+            logger.warning("timing listener {} failed: {}", listener, e)
+
+
+class RequestTracer:
+    """httpcore trace callback collecting the timings of one request"""
+
+    def __init__(self, request: httpx.Request):
+        self.request = request
+        self.trace_id = context.get_var("trace")
+        self._reset()
+
+    def _reset(self):
+        self.timings = RequestTimings(
+            method=self.request.method, url=str(self.request.url), trace=self.trace_id
+        )
+        self._started: Dict[str, float] = {}
+        self._begin = time.perf_counter()
+        self._active = False
+
+    def __call__(self, event_name: str, info: Dict[str, Any]) -> None:
+        now = time.perf_counter()
+        prefix, _, event = event_name.partition(".")
+        name, _, state = event.rpartition(".")
+        if state == "started":
+            if not self._active:
+                self._active = True
+                self.timings.pool_wait = now - self._begin
+            if name == "connect_tcp":
+                _connecting.set(self.timings)
+            self._started[name] = now
+        elif name in _PHASES and name in self._started:
+            field = _PHASES[name]
+            elapsed = now - self._started.pop(name)
+            if name == "connect_tcp":
+                # connect_tcp 包含了 network backend 记录的 DNS 耗时
+                elapsed -= self.timings.dns or 0
+            setattr(self.timings, field, (getattr(self.timings, field) or 0) + elapsed)
+        if name == "receive_response_headers" and state == "complete":
+            self._set_status(prefix, info["return_value"])
+        if state == "failed" and name in _PHASES:
+            self.timings.error = type(info.get("exception")).__name__
+            self._finish(now)
+        elif name == "response_closed" and state != "started":
+            self._finish(now)
+
+    def _set_status(self, prefix: str, return_value):
+        if prefix == "http2":
+            self.timings.http_version = "HTTP/2"
+            self.timings.status_code = return_value[0]
+        else:
+            version, self.timings.status_code = return_value[:2]
+            self.timings.http_version = version.decode()
+
+    def _finish(self, now: float):
+        if not self._active:
+            return
+        self.timings.total = now - self._begin
+        _emit(self.timings)
+        # 重试时同一个 request 会再次发送
+        self._reset()
+
+
+class AsyncRequestTracer(RequestTracer):
+    async def __call__(self, event_name: str, info: Dict[str, Any]) -> None:  # type: ignore
+        super().__call__(event_name, info)
+
+
+def _record_dns(started: float):
+    timings = _connecting.get()
+    if timings is not None:
+        timings.dns = time.perf_counter() - started
+
+
+def _resolve_error(host: str, e: Exception) -> httpcore.ConnectError:
+    return httpcore.ConnectError(f"resolve {host} failed: {e}")
+
+
+class TimingNetworkBackend(httpcore.NetworkBackend):
+    """Resolve host names before connecting so DNS time is measured apart"""
+
+    def __init__(self, backend: httpcore.NetworkBackend):
+        self.backend = backend
+
+    def connect_tcp(
+        self,
+        host: str,
+        port: int,
+        timeout: Optional[float] = None,
+        local_address: Optional[str] = None,
+        socket_options=None,
+    ) -> httpcore.NetworkStream:
+        started = time.perf_counter()
+        try:
+            addresses = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        except OSError as e:
+            raise _resolve_error(host, e) from e
+        finally:
+            _record_dns(started)
+        for i, address in enumerate(addresses):
+            try:
+                return self.backend.connect_tcp(
+                    address[4][0], port, timeout, local_address, socket_options
+                )
+            except httpcore.ConnectError:
+                if i == len(addresses) - 1:
+                    raise
+        raise httpcore.ConnectError(f"no address found for {host}")
+
+    def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        return self.backend.connect_unix_socket(path, timeout, socket_options)
+
+    def sleep(self, seconds: float) -> None:
+        self.backend.sleep(seconds)
+
+
+class AsyncTimingNetworkBackend(httpcore.AsyncNetworkBackend):
+    def __init__(self, backend: httpcore.AsyncNetworkBackend):
+        self.backend = backend
+
+    async def connect_tcp(
+        self,
+        host: str,
+        port: int,
+        timeout: Optional[float] = None,
+        local_address: Optional[str] = None,
+        socket_options=None,
+    ) -> httpcore.AsyncNetworkStream:
+        started = time.perf_counter()
+        try:
+            addresses = await anyio.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        except OSError as e:
+            raise _resolve_error(host, e) from e
+        finally:
+            _record_dns(started)
+        for i, address in enumerate(addresses):
+            try:
+                return await self.backend.connect_tcp(
+                    str(address[4][0]), port, timeout, local_address, socket_options
+                )
+            except httpcore.ConnectError:
+                if i == len(addresses) - 1:
+                    raise
+        raise httpcore.ConnectError(f"no address found for {host}")
+
+    async def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        return await self.backend.connect_unix_socket(path, timeout, socket_options)
+
+    async def sleep(self, seconds: float) -> None:
+        await self.backend.sleep(seconds)
+
+
+def instrument_transport(transport):
+    """Wrap the network backend of an httpx HTTPTransport/AsyncHTTPTransport"""
+    pool = getattr(transport, "_pool", None)
+    backend = getattr(pool, "_network_backend", None)
+    if isinstance(backend, httpcore.NetworkBackend):
+        pool._network_backend = TimingNetworkBackend(backend)  # type: ignore
+    elif isinstance(backend, httpcore.AsyncNetworkBackend):
+        pool._network_backend = AsyncTimingNetworkBackend(backend)  # type: ignore
+    return transport
+
+
+def trace_request(request: httpx.Request) -> None:
+    """Request event hook installing the timing tracer"""
+    request.extensions["trace"] = RequestTracer(request)
+
+
+async def atrace_request(request: httpx.Request) -> None:
+    request.extensions["trace"] = AsyncRequestTracer(request)
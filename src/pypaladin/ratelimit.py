@@ -0,0 +1,125 @@
+"""Client side token bucket rate limiting
+
+Buckets are shared by host across all clients in the process, sync and
+async alike. A request reserves a token up front and sleeps until its turn,
+so bursts are spread evenly at the configured rate.
+"""
+
+import asyncio
+import threading
+import time
+from typing import Dict, Optional
+
+import httpx
+from loguru import logger
+from pydantic import BaseModel
+
+
+class RateLimitConfig(BaseModel):
+    # 每秒请求数
+    rate: float
+    # 允许的突发请求数, 默认为 max(1, rate)
+    burst: Optional[int] = None
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: Optional[int] = None):
+        if rate <= 0:
+            raise ValueError("rate must be greater than 0")
+        self.rate = rate
+        self.burst = burst
+        self.capacity = float(burst or max(1, int(rate)))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens: float = 1) -> float:
+        """Take tokens and return how long the caller has to wait for them"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            # 令牌可以透支, 后来者排在已预约的请求之后
+            self._tokens -= tokens
+            return 0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def acquire(self, tokens: float = 1):
+        delay = self.reserve(tokens)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def async_acquire(self, tokens: float = 1):
+        delay = self.reserve(tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+_buckets: Dict[str, TokenBucket] = {}
+_buckets_lock = threading.Lock()
+
+
+def _host(key: str) -> str:
+    return httpx.URL(key).host if "://" in key else key
+
+
+def get_bucket(host: str, config: RateLimitConfig) -> TokenBucket:
+    with _buckets_lock:
+        bucket = _buckets.get(host)
+        if bucket is None or (bucket.rate, bucket.burst) != (config.rate, config.burst):
+            bucket = TokenBucket(config.rate, config.burst)
+            _buckets[host] = bucket
+        return bucket
+
+
+class _Limiter:
+    def __init__(self, limits: Dict[str, RateLimitConfig]):
+        # 配置的 key 可以是 base_url 或 host
+        self.limits = {_host(k): v for k, v in limits.items()}
+
+    def bucket(self, request: httpx.Request) -> Optional[TokenBucket]:
+        config = self.limits.get(request.url.host)
+        if config is None:
+            return None
+        return get_bucket(request.url.host, config)
+
+
+class RateLimitTransport(httpx.BaseTransport):
+    def __init__(
+        self, transport: httpx.BaseTransport, limits: Dict[str, RateLimitConfig]
+    ):
+        self.transport = transport
+        self._limiter = _Limiter(limits)
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        bucket = self._limiter.bucket(request)
+        if bucket:
+            delay = bucket.reserve()
+            if delay > 0:
+                logger.trace("rate limited {}, wait {:.3f}s", request.url.host, delay)
+                time.sleep(delay)
+        return self.transport.handle_request(request)
+
+    def close(self) -> None:
+        self.transport.close()
+
+
+class AsyncRateLimitTransport(httpx.AsyncBaseTransport):
+    def __init__(
+        self, transport: httpx.AsyncBaseTransport, limits: Dict[str, RateLimitConfig]
+    ):
+        self.transport = transport
+        self._limiter = _Limiter(limits)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        bucket = self._limiter.bucket(request)
+        if bucket:
+            delay = bucket.reserve()
+            if delay > 0:
+                logger.trace("rate limited {}, wait {:.3f}s", request.url.host, delay)
+                await asyncio.sleep(delay)
+        return await self.transport.handle_async_request(request)
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
@@ -0,0 +1,314 @@
+"""流式下载, 支持断点续传和分段并行下载
+
+下载过程中数据写入 `<output>.part`, 完成后重命名为目标文件。分段下载的进度
+定期保存在 `<output>.part.json`, 中断后再次下载时从已完成的位置继续。
+"""
+
+import json
+import os
+from concurrent import futures
+from pathlib import Path
+import re
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Union
+
+import httpx
+from loguru import logger
+
+ProgressCallback = Callable[[int], None]
+
+_CONTENT_RANGE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+# 分段下载时每段的最小大小
+MIN_PART_SIZE = 8 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+# 分段下载时每下载这么多字节或经过这么多秒保存一次进度
+SAVE_BYTES = 4 * 1024 * 1024
+SAVE_INTERVAL = 1.0
+
+
+class DownloadError(IOError):
+    pass
+
+
+def _part_paths(output: Path):
+    return output.with_name(output.name + ".part"), output.with_name(
+        output.name + ".part.json"
+    )
+
+
+def _validator(resp: httpx.Response) -> Optional[str]:
+    return resp.headers.get("ETag") or resp.headers.get("Last-Modified")
+
+
+def probe(
+    client: httpx.Client, url: str, headers: Optional[Dict] = None
+) -> Dict[str, Union[int, str, None]]:
+    """请求第一个字节, 获取文件大小以及是否支持 Range"""
+    headers = dict(headers or {}, Range="bytes=0-0")
+    with client.stream("GET", url, headers=headers) as resp:
+        resp.raise_for_status()
+        matched = _CONTENT_RANGE.match(resp.headers.get("Content-Range", ""))
+        if resp.status_code == 206 and matched and matched.group(3) != "*":
+            return {
+                "size": int(matched.group(3)),
+                "ranges": 1,
+                "validator": _validator(resp),
+            }
+        size = resp.headers.get("Content-Length")
+        return {
+            "size": int(size) if size else None,
+            "ranges": 0,
+            "validator": _validator(resp),
+        }
+
+
+def _stream_to(
+    resp: httpx.Response, fp, progress: Optional[ProgressCallback], on_chunk=None
+) -> int:
+    written = 0
+    for chunk in resp.iter_bytes(CHUNK_SIZE):
+        fp.write(chunk)
+        written += len(chunk)
+        if on_chunk:
+            # 先写入文件再记录进度, 保存的进度不会超过文件中的内容
+            fp.flush()
+            on_chunk(len(chunk))
+        if progress:
+            progress(len(chunk))
+    return written
+
+
+def _range_start(resp: httpx.Response) -> Optional[int]:
+    matched = _CONTENT_RANGE.match(resp.headers.get("Content-Range", ""))
+    return int(matched.group(1)) if matched else None
+
+
+def _download_single(
+    client: httpx.Client,
+    url: str,
+    part: Path,
+    state_path: Path,
+    headers: Dict,
+    resume: bool,
+    progress: Optional[ProgressCallback],
+):
+    offset = part.stat().st_size if resume and part.exists() else 0
+    req_headers = dict(headers)
+    if offset:
+        req_headers["Range"] = f"bytes={offset}-"
+        try:
+            state = json.loads(state_path.read_text())
+        except (OSError, ValueError):
+            state = {}
+        if state.get("url") == url and state.get("validator"):
+            # 文件已变化时服务端返回 200 和完整内容
+            req_headers["If-Range"] = state["validator"]
+    with client.stream("GET", url, headers=req_headers) as resp:
+        if resp.status_code == 416 and offset:
+            logger.info("{} is already downloaded", part)
+            return
+        resp.raise_for_status()
+        if resp.status_code == 206 and _range_start(resp) != offset:
+            if not offset:
+                raise DownloadError(
+                    f"unexpected Content-Range {resp.headers.get('Content-Range')}"
+                )
+            # 返回的范围与请求的不一致, 无法续传
+            logger.warning(
+                "unexpected Content-Range {}, restart download",
+                resp.headers.get("Content-Range"),
+            )
+        else:
+            if resp.status_code == 206:
+                logger.info("resume download from {} bytes", offset)
+                if progress:
+                    progress(offset)
+                mode = "ab"
+            else:
+                mode = "wb"
+            state_path.write_text(
+                json.dumps({"url": url, "validator": _validator(resp)})
+            )
+            with part.open(mode) as fp:
+                _stream_to(resp, fp, progress)
+            return
+    _download_single(client, url, part, state_path, headers, False, progress)
+
+
+class _PartState:
+    """分段下载进度: 每段为 [start, end, downloaded]"""
+
+    def __init__(self, path: Path, url: str, size: int, validator: Optional[str]):
+        self.path = path
+        self.url = url
+        self.size = size
+        self.validator = validator
+        self.parts: List[List[int]] = []
+        self._lock = threading.Lock()
+        self._unsaved = 0
+        self._saved_at = time.monotonic()
+
+    def load(self) -> bool:
+        try:
+            data = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return False
+        if (data.get("url"), data.get("size"), data.get("validator")) != (
+            self.url,
+            self.size,
+            self.validator,
+        ):
+            return False
+        self.parts = data["parts"]
+        return True
+
+    def split(self, parallel: int, min_part_size: int):
+        count = max(1, min(parallel, self.size // min_part_size))
+        part_size = -(-self.size // count)
+        self.parts = [
+            [start, min(start + part_size, self.size) - 1, 0]
+            for start in range(0, self.size, part_size)
+        ]
+
+    def advance(self, index: int, length: int):
+        with self._lock:
+            self.parts[index][2] += length
+            self._unsaved += length
+            if (
+                self._unsaved >= SAVE_BYTES
+                or time.monotonic() - self._saved_at >= SAVE_INTERVAL
+            ):
+                self._save()
+
+    def save(self):
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        data = {
+            "url": self.url,
+            "size": self.size,
+            "validator": self.validator,
+            "parts": self.parts,
+        }
+        # 先写临时文件再替换, 中断时不会留下不完整的进度
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps(data))
+        os.replace(tmp, self.path)
+        self._unsaved = 0
+        self._saved_at = time.monotonic()
+
+    @property
+    def downloaded(self) -> int:
+        return sum(x[2] for x in self.parts)
+
+
+def _download_range(
+    client: httpx.Client,
+    url: str,
+    part: Path,
+    headers: Dict,
+    state: _PartState,
+    index: int,
+    progress: Optional[ProgressCallback],
+):
+    start, end, done = state.parts[index]
+    if start + done > end:
+        return
+    req_headers = dict(headers, Range=f"bytes={start + done}-{end}")
+    if state.validator:
+        req_headers["If-Range"] = state.validator
+    with client.stream("GET", url, headers=req_headers) as resp:
+        resp.raise_for_status()
+        if resp.status_code != 206:
+            raise DownloadError(f"server ignored range request for part {index}")
+        if _range_start(resp) != start + done:
+            raise DownloadError(
+                f"unexpected Content-Range {resp.headers.get('Content-Range')} "
+                f"for part {index}"
+            )
+        with part.open("r+b") as fp:
+            fp.seek(start + done)
+            _stream_to(resp, fp, progress, on_chunk=lambda n: state.advance(index, n))
+    if state.parts[index][2] != end - start + 1:
+        raise DownloadError(f"part {index} is incomplete")
+
+
+def _download_parallel(
+    client: httpx.Client,
+    url: str,
+    part: Path,
+    state_path: Path,
+    headers: Dict,
+    info: Dict,
+    parallel: int,
+    min_part_size: int,
+    resume: bool,
+    progress: Optional[ProgressCallback],
+):
+    state = _PartState(state_path, url, info["size"], info["validator"])  # type: ignore
+    if not (resume and part.exists() and state.load()):
+        state.split(parallel, min_part_size)
+        with part.open("wb") as fp:
+            fp.truncate(state.size)
+    else:
+        logger.info("resume download from {} bytes", state.downloaded)
+        if progress:
+            progress(state.downloaded)
+    logger.debug("download {} in {} parts", url, len(state.parts))
+    try:
+        with futures.ThreadPoolExecutor(max_workers=len(state.parts)) as executor:
+            tasks = [
+                executor.submit(
+                    _download_range, client, url, part, headers, state, i, progress
+                )
+                for i in range(len(state.parts))
+            ]
+            for task in futures.as_completed(tasks):
+                task.result()
+    finally:
+        state.save()
+
+
+def download(
+    client: httpx.Client,
+    url: str,
+    output: Union[Path, str],
+    headers: Optional[Dict] = None,
+    parallel: int = 1,
+    resume: bool = True,
+    min_part_size: int = MIN_PART_SIZE,
+    progress: Optional[ProgressCallback] = None,
+) -> Path:
+    """下载文件到 output
+
+    Args:
+        parallel: 分段并行下载的段数, 服务端不支持 Range 时退化为单线程
+        resume: 存在未完成的下载时是否断点续传
+        progress: 进度回调, 参数为新下载的字节数
+    """
+    output = Path(output)
+    part, state_path = _part_paths(output)
+    # 断点续传需要按原始字节计算偏移
+    headers = dict(headers or {}, **{"Accept-Encoding": "identity"})
+
+    info = probe(client, url, headers) if parallel > 1 else {}
+    if info.get("ranges") and (info["size"] or 0) >= min_part_size * 2:  # type: ignore
+        _download_parallel(
+            client,
+            url,
+            part,
+            state_path,
+            headers,
+            info,
+            parallel=parallel,
+            min_part_size=min_part_size,
+            resume=resume,
+            progress=progress,
+        )
+    else:
+        _download_single(client, url, part, state_path, headers, resume, progress)
+    os.replace(part, output)
+    state_path.unlink(missing_ok=True)
+    return output
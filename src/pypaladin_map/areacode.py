@@ -1,20 +1,237 @@
-from functools import lru_cache
+import difflib
+import mmap
+import os
+from pathlib import Path
+import struct
+import threading
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple, Union
 
-from pypaladin.httpclient import default_client
+from loguru import logger
+
+from pypaladin.httpclient import shared_client
+
+from pypaladin_map import cache
+
+DEFAULT_INDEX_PATH = "~/.cache/pypaladin/areacode.idx"
+
+# 索引文件格式:
+#   header: magic, 记录数
+#   records: 按编码排序, 每条为 (编码偏移, 编码长度, 名称偏移, 名称长度)
+#   name_order: 按名称(utf-8 字节序)排序的记录下标
+#   strings: 编码和名称的 utf-8 字节
+_MAGIC = b"PAC1"
+_HEADER = struct.Struct("<4sI")
+_RECORD = struct.Struct("<IBIH")
+_INDEX = struct.Struct("<I")
+# 行政区划编码各级的有效位数: 省/市/区县/乡镇/村
+_LEVELS = (2, 4, 6, 9, 12)
+
+
+class AreaCodeIndex:
+    """行政区划编码索引
+
+    索引保存为紧凑的二进制文件, 通过 mmap 加载, 按编码和名称的查找均为二分查找。
+    """
+
+    def __init__(self, buffer: Union[bytes, mmap.mmap]):
+        magic, self._count = _HEADER.unpack_from(buffer, 0)
+        if magic != _MAGIC:
+            raise ValueError("invalid area code index")
+        self._buffer = buffer
+        self._records = _HEADER.size
+        self._name_order = self._records + self._count * _RECORD.size
+        self._names: Optional[List[str]] = None
+
+    @staticmethod
+    def build(mapping: Mapping[str, str]) -> bytes:
+        items = sorted((str(k), str(v).strip()) for k, v in mapping.items())
+        strings = bytearray()
+        records = []
+        for code, name in items:
+            code_bytes, name_bytes = code.encode(), name.encode()
+            name_off = len(strings) + len(code_bytes)
+            records.append((len(strings), len(code_bytes), name_off, len(name_bytes)))
+            strings += code_bytes + name_bytes
+        name_order = sorted(range(len(items)), key=lambda i: items[i][1].encode())
+        header_size = _HEADER.size + len(items) * (_RECORD.size + _INDEX.size)
+        data = bytearray(_HEADER.pack(_MAGIC, len(items)))
+        for code_off, code_len, name_off, name_len in records:
+            data += _RECORD.pack(
+                header_size + code_off, code_len, header_size + name_off, name_len
+            )
+        for i in name_order:
+            data += _INDEX.pack(i)
+        return bytes(data + strings)
+
+    @classmethod
+    def save(cls, mapping: Mapping[str, str], path: Union[Path, str]):
+        path = Path(path).expanduser()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_bytes(cls.build(mapping))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Union[Path, str]) -> "AreaCodeIndex":
+        with Path(path).expanduser().open("rb") as fp:
+            return cls(mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _record(self, i: int) -> Tuple[str, str]:
+        code_off, code_len, name_off, name_len = _RECORD.unpack_from(
+            self._buffer, self._records + i * _RECORD.size
+        )
+        return (
+            self._buffer[code_off : code_off + code_len].decode(),
+            self._buffer[name_off : name_off + name_len].decode(),
+        )
+
+    def _code(self, i: int) -> str:
+        return self._record(i)[0]
+
+    def _name_record(self, pos: int) -> int:
+        return _INDEX.unpack_from(self._buffer, self._name_order + pos * _INDEX.size)[0]
+
+    def _name_bytes(self, pos: int) -> bytes:
+        _, _, name_off, name_len = _RECORD.unpack_from(
+            self._buffer, self._records + self._name_record(pos) * _RECORD.size
+        )
+        return self._buffer[name_off : name_off + name_len]
+
+    def _bisect(self, key, target, lo=0, right=False) -> int:
+        hi = self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            value = key(mid)
+            if value < target or (right and value == target):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def items(self) -> Iterable[Tuple[str, str]]:
+        for i in range(self._count):
+            yield self._record(i)
+
+    def get_name(self, code: str) -> Optional[str]:
+        i = self._bisect(self._code, code)
+        if i < self._count:
+            found, name = self._record(i)
+            if found == code:
+                return name
+        return None
+
+    def get_codes(self, name: str) -> List[str]:
+        """名称完全匹配的编码, 同名时按编码排序"""
+        target = name.strip().encode()
+        start = self._bisect(self._name_bytes, target)
+        end = self._bisect(self._name_bytes, target, lo=start, right=True)
+        return sorted(self._code(self._name_record(p)) for p in range(start, end))
+
+    def search_prefix(self, prefix: str, limit: int = 10) -> List[Tuple[str, str]]:
+        """名称前缀匹配, 如 `北京` 匹配 `北京市`"""
+        target = prefix.strip().encode()
+        result = []
+        pos = self._bisect(self._name_bytes, target)
+        while pos < self._count and len(result) < limit:
+            if not self._name_bytes(pos).startswith(target):
+                break
+            result.append(self._record(self._name_record(pos)))
+            pos += 1
+        return result
+
+    def search_fuzzy(
+        self, name: str, limit: int = 5, cutoff: float = 0.6
+    ) -> List[Tuple[str, str]]:
+        """模糊匹配, 按相似度排序"""
+        if self._names is None:
+            self._names = sorted({name for _, name in self.items()})
+        matched = difflib.get_close_matches(name.strip(), self._names, limit, cutoff)
+        return [(code, x) for x in matched for code in self.get_codes(x)][:limit]
+
+    def get_parent(self, code: str) -> Optional[str]:
+        """上一级区划编码, 跳过不存在的层级(如省直辖县)"""
+        levels = [x for x in _LEVELS if x < len(code)]
+        significant = len(code.rstrip("0"))
+        for level in reversed(levels):
+            if level >= significant:
+                continue
+            parent = code[:level].ljust(len(code), "0")
+            if self.get_name(parent) is not None:
+                return parent
+        return None
+
+    def get_children(self, code: str) -> List[Tuple[str, str]]:
+        significant = len(code.rstrip("0"))
+        prefix = code[: min(x for x in _LEVELS if x >= significant)]
+        result = []
+        i = self._bisect(self._code, prefix)
+        while i < self._count:
+            child, name = self._record(i)
+            if not child.startswith(prefix):
+                break
+            if child != code and self.get_parent(child) == code:
+                result.append((child, name))
+            i += 1
+        return result
+
+    def get_path(self, code: str) -> List[Tuple[str, str]]:
+        """从省级到当前区划的 (编码, 名称) 列表"""
+        path = []
+        current: Optional[str] = code
+        while current is not None:
+            name = self.get_name(current)
+            if name is None:
+                break
+            path.insert(0, (current, name))
+            current = self.get_parent(current)
+        return path
+
+
+_indexes: Dict[Path, AreaCodeIndex] = {}
+_indexes_lock = threading.Lock()
 
 
 class WenyisoAAPI:
-    def __init__(self):
-        self.client = default_client(base_url="https://www.wenyiso.com")
+    def __init__(self, index_path: Union[Path, str] = DEFAULT_INDEX_PATH):
+        self.client = shared_client(base_url="https://www.wenyiso.com")
+        self.index_path = Path(index_path).expanduser()
 
-    @lru_cache()
+    @cache.cached("wenyiso.areacode_list", ttl=86400)
     def get_areacode_list(self) -> dict:
         resp = self.client.get("/jres/json/quhuadaima/list.json")
         return resp.json()
 
+    def get_index(self, refresh: bool = False) -> AreaCodeIndex:
+        """加载本地索引, 不存在时下载编码列表并生成索引
+
+        索引在进程内共享, 不会为每个实例重复下载。
+        """
+        with _indexes_lock:
+            index = _indexes.get(self.index_path)
+            if index is not None and not refresh:
+                return index
+            if refresh or not self.index_path.exists():
+                logger.info("build area code index {}", self.index_path)
+                AreaCodeIndex.save(self.get_areacode_list(), self.index_path)
+            index = AreaCodeIndex.load(self.index_path)
+            _indexes[self.index_path] = index
+            return index
+
     def get_areacode(self, area) -> str:
-        arearcodes = self.get_areacode_list()
-        code = [k for k, v in arearcodes.items() if v == area]
-        if not code:
+        codes = self.get_index().get_codes(area)
+        if not codes:
             raise ValueError(f"area code is not found for {area}")
-        return code[0]
+        return codes[0]
+
+    def get_areacodes(self, areas: Iterable[str]) -> Dict[str, Optional[str]]:
+        """批量查询, 找不到的区划编码为 None"""
+        index = self.get_index()
+        result = {}
+        for area in areas:
+            if area not in result:
+                codes = index.get_codes(area)
+                result[area] = codes[0] if codes else None
+        return result
@@ -0,0 +1,286 @@
+"""Result cache shared by the pypaladin_map APIs
+
+Decorated methods are cached by name, arguments and the instance's
+credentials/base URL (`cache_identity`), so API objects with the same
+account reuse the same entries. Empty results are never cached. The memory
+backend is a bounded LRU that hands out copies; the sqlite backend stores
+entries in a file so that several worker processes can share them.
+
+    from pypaladin_map import cache
+
+    cache.setup(cache.MapCacheConfig(backend="sqlite", ttls={"hefeng.weather": 60}))
+"""
+
+import abc
+import asyncio
+import collections
+import copy
+import dataclasses
+import functools
+import json
+from pathlib import Path
+import pickle
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Literal, Optional, Tuple, Union
+
+from loguru import logger
+from pydantic import BaseModel
+
+
+class MapCacheConfig(BaseModel):
+    enabled: bool = True
+    backend: Literal["memory", "sqlite"] = "memory"
+    path: str = "~/.cache/pypaladin/map_cache.db"
+    # 最大缓存条数, 超过时淘汰最久未使用的
+    max_size: int = 1024
+    # 缓存名称 -> 缓存时间(秒), 覆盖方法的默认值, <=0 表示不缓存
+    ttls: Dict[str, float] = {}
+
+
+@dataclasses.dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+_MISSING = object()
+
+
+class Cache(abc.ABC):
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.stats: Dict[str, CacheStats] = collections.defaultdict(CacheStats)
+        self._lock = threading.Lock()
+
+    def get(self, namespace: str, key: str) -> Any:
+        """Return the cached value or `_MISSING`"""
+        with self._lock:
+            value = self._get(f"{namespace}:{key}", time.time())
+            stats = self.stats[namespace]
+            if value is _MISSING:
+                stats.misses += 1
+            else:
+                stats.hits += 1
+            return value
+
+    def set(self, namespace: str, key: str, value: Any, ttl: float):
+        with self._lock:
+            for evicted in self._set(f"{namespace}:{key}", value, time.time() + ttl):
+                self.stats[evicted.partition(":")[0]].evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    @abc.abstractmethod
+    def _get(self, key: str, now: float) -> Any: ...
+
+    @abc.abstractmethod
+    def _set(self, key: str, value: Any, expires: float) -> list:
+        """Store the value and return the evicted keys"""
+
+    @abc.abstractmethod
+    def _clear(self): ...
+
+
+class MemoryCache(Cache):
+    def __init__(self, max_size: int):
+        super().__init__(max_size)
+        self._entries: collections.OrderedDict[str, Tuple[float, Any]] = (
+            collections.OrderedDict()
+        )
+
+    def _get(self, key: str, now: float) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return _MISSING
+        if entry[0] <= now:
+            del self._entries[key]
+            return _MISSING
+        self._entries.move_to_end(key)
+        # 返回副本, 调用方修改结果不会影响缓存
+        return copy.deepcopy(entry[1])
+
+    def _set(self, key: str, value: Any, expires: float) -> list:
+        self._entries[key] = (expires, copy.deepcopy(value))
+        self._entries.move_to_end(key)
+        evicted = []
+        while len(self._entries) > self.max_size:
+            evicted.append(self._entries.popitem(last=False)[0])
+        return evicted
+
+    def _clear(self):
+        self._entries.clear()
+
+
+class SqliteCache(Cache):
+    def __init__(self, max_size: int, path: str):
+        super().__init__(max_size)
+        self.path = Path(path).expanduser()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(
+            self.path, check_same_thread=False, isolation_level=None, timeout=10
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, "
+            "value BLOB, expires REAL, accessed REAL)"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)"
+        )
+
+    def _get(self, key: str, now: float) -> Any:
+        row = self._db.execute(
+            "SELECT value FROM entries WHERE key = ? AND expires > ?", (key, now)
+        ).fetchone()
+        if row is None:
+            return _MISSING
+        self._db.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+        return pickle.loads(row[0])
+
+    def _set(self, key: str, value: Any, expires: float) -> list:
+        now = time.time()
+        with self._db:
+            self._db.execute("BEGIN IMMEDIATE")
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                (key, pickle.dumps(value), expires, now),
+            )
+            self._db.execute("DELETE FROM entries WHERE expires <= ?", (now,))
+            evicted = [
+                row[0]
+                for row in self._db.execute(
+                    "SELECT key FROM entries ORDER BY accessed DESC LIMIT -1 OFFSET ?",
+                    (self.max_size,),
+                )
+            ]
+            self._db.executemany(
+                "DELETE FROM entries WHERE key = ?", [(x,) for x in evicted]
+            )
+        return evicted
+
+    def _clear(self):
+        self._db.execute("DELETE FROM entries")
+
+
+_config = MapCacheConfig()
+_cache: Optional[Cache] = None
+_cache_lock = threading.Lock()
+
+
+def setup(config: MapCacheConfig):
+    global _config, _cache
+    with _cache_lock:
+        _config, _cache = config, None
+
+
+def get_cache() -> Cache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            if _config.backend == "sqlite":
+                _cache = SqliteCache(_config.max_size, _config.path)
+            else:
+                _cache = MemoryCache(_config.max_size)
+        return _cache
+
+
+def stats() -> Dict[str, CacheStats]:
+    return dict(get_cache().stats)
+
+
+def _make_key(args: tuple, kwargs: dict) -> str:
+    return json.dumps([args, sorted(kwargs.items())], default=repr, ensure_ascii=False)
+
+
+def _identity(obj: Any) -> str:
+    """实例的凭据或服务地址, 不同账号或地址的实例不共享缓存"""
+    identity = getattr(obj, "cache_identity", None)
+    if identity is None:
+        identity = str(getattr(getattr(obj, "client", None), "base_url", ""))
+    return identity
+
+
+def _is_empty(value: Any) -> bool:
+    return value is None or (isinstance(value, (list, tuple, dict)) and not value)
+
+
+def cached(
+    name: str,
+    ttl: Union[float, Callable[[Any], float]],
+    key: Optional[Callable[..., Any]] = None,
+):
+    """Cache the results of an API method for `ttl` seconds
+
+    Args:
+        name: 缓存名称, 同名的同步和异步方法共用缓存
+        ttl: 缓存时间, 也可以是根据返回值计算缓存时间的函数
+        key: 由方法参数(不含 self)生成缓存 key, 默认使用全部参数
+
+    实例可以通过 `cache_identity` 属性指定凭据等区分缓存的标识, 默认使用
+    `client.base_url`。
+    """
+
+    def _key(obj: Any, args: tuple, kwargs: dict) -> str:
+        if key:
+            args, kwargs = (key(*args, **kwargs),), {}
+        return _make_key((_identity(obj), *args), kwargs)
+
+    def _enabled() -> bool:
+        return _config.enabled and _config.ttls.get(name, 1) > 0
+
+    def _ttl(value: Any) -> float:
+        if name in _config.ttls:
+            return _config.ttls[name]
+        return ttl(value) if callable(ttl) else ttl
+
+    def _store(cache_key: str, value: Any):
+        if _is_empty(value):
+            return
+        expire = _ttl(value)
+        if expire > 0:
+            get_cache().set(name, cache_key, value, expire)
+
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(self, *args, **kwargs):
+                if not _enabled():
+                    return await func(self, *args, **kwargs)
+                cache_key = _key(self, args, kwargs)
+                value = get_cache().get(name, cache_key)
+                if value is _MISSING:
+                    value = await func(self, *args, **kwargs)
+                    _store(cache_key, value)
+                else:
+                    logger.debug("cache hit {} {}", name, cache_key)
+                return value
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            if not _enabled():
+                return func(self, *args, **kwargs)
+            cache_key = _key(self, args, kwargs)
+            value = get_cache().get(name, cache_key)
+            if value is _MISSING:
+                value = func(self, *args, **kwargs)
+                _store(cache_key, value)
+            else:
+                logger.debug("cache hit {} {}", name, cache_key)
+            return value
+
+        return wrapper
+
+    return decorator
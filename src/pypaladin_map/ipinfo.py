@@ -1,30 +1,59 @@
-from pypaladin.httpclient import default_client
+from pypaladin import hedge
+from pypaladin.httpclient import shared_async_client, shared_client
 
 
 class IPinfoAPI:
     def __init__(self):
-        self.client = default_client(base_url="https://ipinfo.io")
+        self.client = shared_client(base_url="https://ipinfo.io")
 
     def get_public_ip(self) -> str:
         resp = self.client.get("/json")
         return resp.json().get("ip")
 
 
+class AsyncIPinfoAPI:
+    @property
+    def client(self):
+        return shared_async_client(base_url="https://ipinfo.io")
+
+    async def get_public_ip(self) -> str:
+        resp = await self.client.get("/json")
+        return resp.json().get("ip")
+
+
 class IPAPI:
     def __init__(self):
-        self.client = default_client(base_url="http://ip-api.com")
+        self.client = shared_client(base_url="http://ip-api.com")
 
     def get_public_ip(self) -> str:
         resp = self.client.get("/json")
         return resp.json().get("query")
 
 
-def get_public_ip() -> str:
-    for api in [IPinfoAPI(), IPAPI()]:
-        if not isinstance(api, (IPinfoAPI, IPAPI)):
-            raise Exception()
-        try:
-            return api.get_public_ip()
-        except IOError:
-            continue
-    raise IOError("get public ip failed")
+class AsyncIPAPI:
+    @property
+    def client(self):
+        return shared_async_client(base_url="http://ip-api.com")
+
+    async def get_public_ip(self) -> str:
+        resp = await self.client.get("/json")
+        return resp.json().get("query")
+
+
+def get_public_ip(hedge_delay: float = hedge.DEFAULT_HEDGE_DELAY) -> str:
+    """同时向多个接口查询, 备用接口在 hedge_delay 秒后仍未返回时启动"""
+    apis = [IPinfoAPI(), IPAPI()]
+    try:
+        return hedge.race([x.get_public_ip for x in apis], hedge_delay=hedge_delay)
+    except IOError as e:
+        raise IOError(f"get public ip failed: {e}") from e
+
+
+async def async_get_public_ip(hedge_delay: float = hedge.DEFAULT_HEDGE_DELAY) -> str:
+    apis = [AsyncIPinfoAPI(), AsyncIPAPI()]
+    try:
+        return await hedge.async_race(
+            [x.get_public_ip for x in apis], hedge_delay=hedge_delay
+        )
+    except IOError as e:
+        raise IOError(f"get public ip failed: {e}") from e
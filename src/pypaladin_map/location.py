@@ -1,8 +1,29 @@
+import array
+import bisect
+from concurrent import futures
+import csv
 import dataclasses
-from typing import Optional
+import functools
+import ipaddress
+import mmap
+import os
+from pathlib import Path
+import re
+import struct
+import sys
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
-from pypaladin import httpclient
-from pypaladin.httpclient import default_client
+import httpx
+from loguru import logger
+
+from pypaladin import hedge, httpclient
+from pypaladin.httpclient import shared_async_client, shared_client
+from pypaladin.utils import strutil
+
+from pypaladin_map import cache
+
+_IPV4 = re.compile(r"(?<![\d.])(?:\d{1,3}\.){3}\d{1,3}(?![\d.])")
 
 
 @dataclasses.dataclass
@@ -39,34 +60,330 @@ class Location:
         return dataclasses.asdict(self)
 
 
+def _parse_uutool(body: dict) -> Location:
+    data = body.get("data")
+    if not isinstance(data, dict):
+        raise IOError(f"request failed {body}")
+    return Location(**data)
+
+
+def _parse_ip77(body: dict) -> Location:
+    if body.get("error"):
+        raise IOError(f"request failed {body.get('error')}")
+    data = body.get("data")
+    if not isinstance(data, dict):
+        raise IOError(f"request failed {body}")
+    for k in ["risk"]:
+        if k not in data:
+            continue
+        del data[k]
+    return Location(**data)
+
+
 class UUToolApi:
     def __init__(self):
-        self.client = default_client("https://api.uutool.cn")
+        self.client = shared_client("https://api.uutool.cn")
 
+    @cache.cached("uutool.location", ttl=86400)
     def get_location(self, ipaddr) -> Location:
         resp = self.client.get(
             f"/ip/location/?ip={ipaddr}", headers={"accept-language": "zh-CN"}
         )
-        data = resp.json()
-        return Location(**data.get("data"))
+        resp.raise_for_status()
+        return _parse_uutool(resp.json())
+
+
+class AsyncUUToolApi:
+    @property
+    def client(self):
+        return shared_async_client("https://api.uutool.cn")
+
+    @cache.cached("uutool.location", ttl=86400)
+    async def get_location(self, ipaddr) -> Location:
+        resp = await self.client.get(
+            f"/ip/location/?ip={ipaddr}", headers={"accept-language": "zh-CN"}
+        )
+        resp.raise_for_status()
+        return _parse_uutool(resp.json())
 
 
 class IP77Api:
     def __init__(self):
-        self.client = default_client("https://api.ip77.net")
+        self.client = shared_client("https://api.ip77.net")
 
+    @cache.cached("ip77.location", ttl=86400)
     def get_location(self, ipaddr) -> Location:
         resp = self.client.post(
             "/ip2/v4",
             data=f"ip={ipaddr}",
             headers={"content-type": httpclient.TYPE_WWW_FORM},
         )
-        body = resp.json()
-        if body.get("error"):
-            raise IOError(f"request failed {body.get('error')}")
-        data = body.get("data", {})
-        for k in ["risk"]:
-            if k not in data:
-                continue
-            del data[k]
-        return Location(**data)
+        resp.raise_for_status()
+        return _parse_ip77(resp.json())
+
+
+class AsyncIP77Api:
+    @property
+    def client(self):
+        return shared_async_client("https://api.ip77.net")
+
+    @cache.cached("ip77.location", ttl=86400)
+    async def get_location(self, ipaddr) -> Location:
+        resp = await self.client.post(
+            "/ip2/v4",
+            data=f"ip={ipaddr}",
+            headers={"content-type": httpclient.TYPE_WWW_FORM},
+        )
+        resp.raise_for_status()
+        return _parse_ip77(resp.json())
+
+
+DEFAULT_IPDB_PATH = "~/.cache/pypaladin/ipdb.bin"
+
+# 离线数据库文件格式:
+#   header: magic, 字节序, 记录数, 字段名长度
+#   fields: 以 \t 分隔的字段名
+#   starts/ends/infos: 各 count 个 uint32 (本机字节序), 按起始地址排序
+#   info: 每条为 uint16 长度 + 以 \t 分隔的字段值, 相同的值只保存一次
+_IPDB_MAGIC = b"PIPD"
+_IPDB_HEADER = struct.Struct("<4sBxxxII")
+_IPDB_INFO_LEN = struct.Struct("<H")
+# 缓存解码后的字段值的条数, 相同的字段值在文件中只保存一次
+IPDB_INFO_CACHE_SIZE = 65536
+_IPDB_FIELDS = {f.name for f in dataclasses.fields(Location)} - {
+    "ip",
+    "ip_int",
+    "street_history",
+}
+
+
+def _ip_int(value: str) -> int:
+    value = value.strip()
+    return int(value) if value.isdigit() else int(ipaddress.IPv4Address(value))
+
+
+class OfflineIPDatabase:
+    """IP 段离线数据库, mmap 加载后二分查找
+
+    由 CSV 编译而来, CSV 需要包含 start, end 两列(点分格式或整数), 其他列
+    为 Location 的字段, 如 country, province, city, isp。
+    """
+
+    def __init__(self, buffer: Union[bytes, mmap.mmap]):
+        magic, little, count, fields_len = _IPDB_HEADER.unpack_from(buffer, 0)
+        if magic != _IPDB_MAGIC:
+            raise ValueError("invalid ip database")
+        if little != (sys.byteorder == "little"):
+            raise ValueError("ip database is compiled on a different byte order")
+        offset = _IPDB_HEADER.size
+        fields = bytes(buffer[offset : offset + fields_len]).decode()
+        self.fields = [x for x in fields.split("\t") if x]
+        offset += fields_len
+        view = memoryview(buffer)
+        size = count * 4
+        self._starts = view[offset : offset + size].cast("I")
+        self._ends = view[offset + size : offset + size * 2].cast("I")
+        self._infos = view[offset + size * 2 : offset + size * 3].cast("I")
+        self._buffer = buffer
+        self._info = functools.lru_cache(maxsize=IPDB_INFO_CACHE_SIZE)(
+            self._decode_info
+        )
+
+    @staticmethod
+    def compile(
+        rows: Iterable[Dict[str, str]], output: Union[Path, str]
+    ) -> "OfflineIPDatabase":
+        records: List[Tuple[int, int, str]] = []
+        fields: List[str] = []
+        for row in rows:
+            if not fields:
+                fields = [k for k in row if k in _IPDB_FIELDS]
+            info = "\t".join((row.get(k) or "").replace("\t", " ") for k in fields)
+            records.append((_ip_int(row["start"]), _ip_int(row["end"]), info))
+        records.sort()
+        for prev, cur in zip(records, records[1:], strict=False):
+            if cur[0] <= prev[1]:
+                raise ValueError(f"ip range {cur[0]} overlaps with {prev[0]}-{prev[1]}")
+
+        infos, info_offsets = bytearray(), {}
+        for _, _, info in records:
+            if info not in info_offsets:
+                data = info.encode()
+                info_offsets[info] = len(infos)
+                infos += _IPDB_INFO_LEN.pack(len(data)) + data
+        field_bytes = "\t".join(fields).encode()
+        # 对齐到 4 字节, 便于按 uint32 数组读取
+        field_bytes += b"\t" * (-len(field_bytes) % 4)
+        base = _IPDB_HEADER.size + len(field_bytes) + len(records) * 12
+        output = Path(output).expanduser()
+        output.parent.mkdir(parents=True, exist_ok=True)
+        tmp = output.with_name(output.name + ".tmp")
+        with tmp.open("wb") as fp:
+            fp.write(
+                _IPDB_HEADER.pack(
+                    _IPDB_MAGIC,
+                    sys.byteorder == "little",
+                    len(records),
+                    len(field_bytes),
+                )
+            )
+            fp.write(field_bytes)
+            for column in (
+                (x[0] for x in records),
+                (x[1] for x in records),
+                (base + info_offsets[x[2]] for x in records),
+            ):
+                array.array("I", column).tofile(fp)
+            fp.write(infos)
+        os.replace(tmp, output)
+        return OfflineIPDatabase.load(output)
+
+    @classmethod
+    def compile_csv(
+        cls, csv_path: Union[Path, str], output: Union[Path, str] = DEFAULT_IPDB_PATH
+    ) -> "OfflineIPDatabase":
+        with Path(csv_path).open(newline="", encoding="utf-8") as fp:
+            return cls.compile(csv.DictReader(fp), output)
+
+    @classmethod
+    def load(cls, path: Union[Path, str] = DEFAULT_IPDB_PATH) -> "OfflineIPDatabase":
+        with Path(path).expanduser().open("rb") as fp:
+            return cls(mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    def lookup(self, ipaddr: str) -> Optional[Location]:
+        ip_int = int(ipaddress.IPv4Address(ipaddr))
+        i = bisect.bisect_right(self._starts, ip_int) - 1
+        if i < 0 or self._ends[i] < ip_int:
+            return None
+        return Location(ip=ipaddr, ip_int=ip_int, **self._info(self._infos[i]))
+
+    def _decode_info(self, offset: int) -> Dict[str, str]:
+        if not self.fields:
+            return {}
+        (length,) = _IPDB_INFO_LEN.unpack_from(self._buffer, offset)
+        offset += _IPDB_INFO_LEN.size
+        values = self._buffer[offset : offset + length].decode().split("\t")
+        return dict(zip(self.fields, values, strict=True))
+
+    def get_location(self, ipaddr) -> Location:
+        found = self.lookup(ipaddr)
+        if found is None:
+            raise IOError(f"{ipaddr} is not found in offline database")
+        return found
+
+
+_offline_db: Dict[Path, OfflineIPDatabase] = {}
+_offline_db_lock = threading.Lock()
+
+
+def get_offline_db(
+    path: Union[Path, str] = DEFAULT_IPDB_PATH,
+) -> Optional[OfflineIPDatabase]:
+    """加载离线数据库, 文件不存在时返回 None"""
+    path = Path(path).expanduser()
+    with _offline_db_lock:
+        if path not in _offline_db:
+            if not path.exists():
+                return None
+            _offline_db[path] = OfflineIPDatabase.load(path)
+        return _offline_db[path]
+
+
+def default_apis() -> list:
+    """优先使用离线数据库, 远程接口作为备选"""
+    offline_db = get_offline_db()
+    remote = [IP77Api(), UUToolApi()]
+    return [offline_db] + remote if offline_db else remote
+
+
+def get_location(
+    ipaddr: str, apis: Optional[list] = None, hedge_delay: Optional[float] = None
+) -> Location:
+    """按顺序尝试各个接口, 返回第一个成功的结果
+
+    Args:
+        hedge_delay: 指定时并发竞速, 前一个接口 hedge_delay 秒内未返回时启动下一个
+    """
+    if hedge_delay is not None:
+        calls = [
+            functools.partial(x.get_location, ipaddr) for x in apis or default_apis()
+        ]
+        try:
+            return hedge.race(calls, hedge_delay=hedge_delay)
+        except IOError as e:
+            raise IOError(f"get location of {ipaddr} failed: {e}") from e
+    error: Optional[Exception] = None
+    for api in apis or default_apis():
+        try:
+            return api.get_location(ipaddr)
+        except (IOError, httpx.HTTPError, ValueError) as e:
+            logger.debug(
+                "{} get location of {} failed: {}", type(api).__name__, ipaddr, e
+            )
+            error = e
+    raise IOError(f"get location of {ipaddr} failed: {error}")
+
+
+def extract_ips(lines: Iterable[str], column: Optional[int] = None) -> Iterator[str]:
+    """从文本行中提取 IPv4 地址并去重
+
+    Args:
+        column: 按空白分隔的列号(从1开始), 默认取每行的第一个 IPv4 地址
+    """
+    seen = set()
+    for line in lines:
+        if column:
+            fields = line.split()
+            value = fields[column - 1] if len(fields) >= column else ""
+        else:
+            matched = _IPV4.search(line)
+            value = matched.group(0) if matched else ""
+        if not value or value in seen:
+            continue
+        is_ip, ip_type = strutil.is_valid_ip(value)
+        if not is_ip or ip_type != strutil.V4:
+            logger.debug("skip invalid ipv4 address {}", value)
+            continue
+        seen.add(value)
+        yield value
+
+
+def locate_many(
+    ips: Iterable[str],
+    apis: Optional[list] = None,
+    concurrency: int = 8,
+    hedge_delay: Optional[float] = None,
+) -> Iterator[Tuple[str, Optional[Location], Optional[Exception]]]:
+    """并发查询多个 IP 的位置, 按完成顺序返回 (ip, location, error)
+
+    最多同时提交 2 * concurrency 个任务, 输入可以是很大的迭代器。默认不竞速,
+    指定 hedge_delay 时每个 IP 可能同时请求多个接口, 会消耗更多的接口配额。
+    """
+    apis = apis or default_apis()
+    ips = iter(ips)
+    with futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = {}
+
+        def _submit() -> bool:
+            ip = next(ips, None)
+            if ip is None:
+                return False
+            pending[executor.submit(get_location, ip, apis, hedge_delay)] = ip
+            return True
+
+        while len(pending) < concurrency * 2 and _submit():
+            pass
+        while pending:
+            done, _ = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+            for task in done:
+                ip = pending.pop(task)
+                try:
+                    result = ip, task.result(), None
+                except Exception as e:
+                    # 单个 IP 失败不影响其他 IP
+                    result = ip, None, e
+                yield result
+                _submit()
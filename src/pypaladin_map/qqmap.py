@@ -1,81 +1,256 @@
 """腾讯位置服务 api"""
 
+import asyncio
+from concurrent import futures
 import hashlib
-from typing import Optional
+import re
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 from urllib import parse
 
+import httpx
 from loguru import logger
 
 from pypaladin import httpclient
 from pypaladin_map import location, weather
 
+BASE_URL = "https://apis.map.qq.com"
+LOCATION_PATH = "/ws/location/v1/ip"
+WEATHER_PATH = "/ws/weather/v1"
 
-class QQMapAPI:
-    """腾讯位置服务 api"""
 
-    def __init__(self, key: Optional[str] = None, signature: Optional[str] = None):
-        self.client = httpclient.default_client(
-            base_url="https://apis.map.qq.com",
-            raise_for_status=True,
+def _parse_location(result: dict) -> location.Location:
+    return location.Location(
+        ip=result.get("ip", ""),
+        latitude=result.get("location", {}).get("lat", ""),
+        longitude=result.get("location", {}).get("lng", ""),
+        country=result.get("ad_info", {}).get("nation", ""),
+        province=result.get("ad_info", {}).get("province", ""),
+        city=result.get("ad_info", {}).get("city", ""),
+        district=result.get("ad_info", {}).get("district", ""),
+        area_code=result.get("ad_info", {}).get("adcode", ""),
+    )
+
+
+def _parse_weather(city: location.Location, result: dict) -> weather.Weather:
+    realtime = result.get("realtime", [])
+    if not realtime:
+        raise ValueError("no realtime weather data found")
+    realtime = realtime[0]
+    return weather.Weather(
+        location=city,
+        weather=realtime.get("infos", {}).get("weather", ""),
+        temperature=realtime.get("infos", {}).get("temperature", ""),
+        winddirection=realtime.get("infos", {}).get("wind_direction", ""),
+        windpower=realtime.get("infos", {}).get("wind_power", ""),
+        humidity=realtime.get("infos", {}).get("humidity", ""),
+        reporttime=realtime.get("update_time", ""),
+    )
+
+
+_UNRESERVED = re.compile(r"[A-Za-z0-9_.~-]*")
+
+
+def _quote(value) -> str:
+    # 与 urlencode 结果一致, IP, adcode 等常见取值无需编码
+    value = str(value)
+    return value if _UNRESERVED.fullmatch(value) else parse.quote_plus(value)
+
+
+class QQMapSigner:
+    """腾讯位置服务请求签名
+
+    sig = md5(path + "?" + 按参数名排序的 query + secret), 每个 path 的
+    md5 前缀和 secret 只计算一次, 签名时不修改传入的参数。
+    """
+
+    def __init__(self, key: str, secret: str):
+        self.key = key
+        self._secret = secret.encode("utf-8")
+        self._prefixes: Dict[str, "hashlib._Hash"] = {}
+
+    def _prefix(self, path: str):
+        prefix = self._prefixes.get(path)
+        if prefix is None:
+            prefix = self._prefixes[path] = hashlib.md5(f"{path}?".encode("utf-8"))
+        return prefix
+
+    def _sign(self, prefix, params: Optional[dict]) -> Dict[str, Any]:
+        signed = {k: v for k, v in (params or {}).items() if v is not None}
+        signed["key"] = self.key
+        signed = dict(sorted(signed.items()))
+        query = "&".join(
+            f"{_quote(k)}={_quote(x)}"
+            for k, v in signed.items()
+            for x in (v if isinstance(v, (list, tuple)) else (v,))
         )
+        digest = prefix.copy()
+        digest.update(query.encode("utf-8"))
+        digest.update(self._secret)
+        signed["sig"] = digest.hexdigest()
+        return signed
+
+    def sign(self, path: str, params: Optional[dict] = None) -> Dict[str, Any]:
+        """返回带 key 和 sig 的有序请求参数"""
+        return self._sign(self._prefix(path), params)
+
+    def sign_many(
+        self, path: str, params_list: Iterable[Optional[dict]]
+    ) -> List[Dict[str, Any]]:
+        """批量签名同一个 path 的多个请求"""
+        prefix = self._prefix(path)
+        return [self._sign(prefix, params) for params in params_list]
+
+
+class _QQMapBase:
+    def __init__(self, key: Optional[str] = None, signature: Optional[str] = None):
         self.key = key or "RKABZ-DCAEB-5VPUG-N4XPP-HGE4K-VXBL6"
         self.signature = signature or "gB38imb0E05bQV8f4aYA2uQVHFfYUFbR"
+        self.signer = QQMapSigner(self.key, self.signature)
 
-    def _get_req_params(self, url, params=None) -> dict:
-        params = params or {}
-        for k, v in params.items() or {}:
-            params[k] = v if isinstance(v, list) else [v]
-        params["key"] = [self.key]
-        # 必须对请求参数进行排序
-        sorted_params = {}
-        for k in sorted(params.keys()):
-            sorted_params[k] = params[k]
-
-        query = parse.urlencode(sorted_params, doseq=True)
-        sig = hashlib.md5(f"{url}?{query}{self.signature}".encode("utf-8")).hexdigest()
-        sorted_params["sig"] = [sig]
-        return sorted_params
+    def _location_req(self, ip: Optional[str] = None):
+        params = self.signer.sign(LOCATION_PATH, {"ip": ip or None})
+        logger.debug("req params : {}", params)
+        return LOCATION_PATH, params
 
-    def get_location(self, ip: Optional[str] = None):
-        req_url = "/ws/location/v1/ip"
-        if ip:
-            req_url += f"?ip={ip}"
-        params = {"ip": ip} if ip else {}
-        params = self._get_req_params(req_url, params)
+    def _location_reqs(self, ips: Iterable[str]):
+        return self.signer.sign_many(LOCATION_PATH, ({"ip": ip} for ip in ips))
+
+    def _weather_req(self, city: location.Location, query_type: str = "now"):
+        params = {"adcode": city.area_code, "type": query_type}
+        params = self.signer.sign(WEATHER_PATH, params)
         logger.debug("req params : {}", params)
-        resp = self.client.get(req_url, params=params)
-        result = resp.json().get("result", {})
-        return location.Location(
-            ip=result.get("ip", ""),
-            latitude=result.get("location", {}).get("lat", ""),
-            longitude=result.get("location", {}).get("lng", ""),
-            country=result.get("ad_info", {}).get("nation", ""),
-            province=result.get("ad_info", {}).get("province", ""),
-            city=result.get("ad_info", {}).get("city", ""),
-            district=result.get("ad_info", {}).get("district", ""),
-            area_code=result.get("ad_info", {}).get("adcode", ""),
+        return WEATHER_PATH, params
+
+    def _weather_reqs(self, cities: Iterable[location.Location], query_type: str):
+        return self.signer.sign_many(
+            WEATHER_PATH,
+            ({"adcode": city.area_code, "type": query_type} for city in cities),
         )
 
+
+class QQMapAPI(_QQMapBase):
+    """腾讯位置服务 api"""
+
+    def __init__(self, key: Optional[str] = None, signature: Optional[str] = None):
+        super().__init__(key=key, signature=signature)
+        self.client = httpclient.shared_client(
+            base_url=BASE_URL,
+            raise_for_status=True,
+        )
+
+    def get_location(self, ip: Optional[str] = None):
+        req_url, params = self._location_req(ip)
+        resp = self.client.get(req_url, params=params)
+        return _parse_location(resp.json().get("result", {}))
+
     def get_weather(
         self, city: location.Location, query_type: str = "now"
     ) -> weather.Weather:
-        req_url = "/ws/weather/v1"
-        adcode = city.area_code
-        params = {"adcode": adcode, "type": query_type}
-        params = self._get_req_params(req_url, params)
-        logger.debug("req params : {}", params)
+        req_url, params = self._weather_req(city, query_type)
         resp = self.client.get(req_url, params=params)
-        result = resp.json().get("result", {})
-        realtime = result.get("realtime", [])
-        if not realtime:
-            raise ValueError("no realtime weather data found")
-        realtime = realtime[0]
-        return weather.Weather(
-            location=city,
-            weather=realtime.get("infos", {}).get("weather", ""),
-            temperature=realtime.get("infos", {}).get("temperature", ""),
-            winddirection=realtime.get("infos", {}).get("wind_direction", ""),
-            windpower=realtime.get("infos", {}).get("wind_power", ""),
-            humidity=realtime.get("infos", {}).get("humidity", ""),
-            reporttime=realtime.get("update_time", ""),
+        return _parse_weather(city, resp.json().get("result", {}))
+
+    def _get_many(self, path: str, params_list: List[dict], parse_result, concurrency):
+        def _get(args):
+            params, item = args
+            try:
+                resp = self.client.get(path, params=params)
+                return item, parse_result(item, resp.json().get("result", {})), None
+            except (httpx.HTTPError, ValueError) as e:
+                logger.debug("request {} failed: {}", path, e)
+                return item, None, e
+
+        with futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return list(executor.map(_get, params_list))
+
+    def get_locations(
+        self, ips: Iterable[str], concurrency: int = 8
+    ) -> List[Tuple[str, Optional[location.Location], Optional[Exception]]]:
+        """并发查询多个 IP 的位置, 按输入顺序返回 (ip, location, error)"""
+        ips = list(ips)
+        return self._get_many(
+            LOCATION_PATH,
+            list(zip(self._location_reqs(ips), ips, strict=True)),
+            lambda _, result: _parse_location(result),
+            concurrency,
+        )
+
+    def get_weathers(
+        self,
+        cities: Iterable[location.Location],
+        query_type: str = "now",
+        concurrency: int = 8,
+    ) -> List[Tuple[location.Location, Optional[weather.Weather], Optional[Exception]]]:
+        """并发查询多个地区的天气, 按输入顺序返回 (location, weather, error)"""
+        cities = list(cities)
+        return self._get_many(
+            WEATHER_PATH,
+            list(zip(self._weather_reqs(cities, query_type), cities, strict=True)),
+            _parse_weather,
+            concurrency,
+        )
+
+
+class AsyncQQMapAPI(_QQMapBase):
+    """腾讯位置服务 api (async)"""
+
+    @property
+    def client(self):
+        return httpclient.shared_async_client(
+            base_url=BASE_URL,
+            raise_for_status=True,
+        )
+
+    async def get_location(self, ip: Optional[str] = None):
+        req_url, params = self._location_req(ip)
+        resp = await self.client.get(req_url, params=params)
+        return _parse_location(resp.json().get("result", {}))
+
+    async def get_weather(
+        self, city: location.Location, query_type: str = "now"
+    ) -> weather.Weather:
+        req_url, params = self._weather_req(city, query_type)
+        resp = await self.client.get(req_url, params=params)
+        return _parse_weather(city, resp.json().get("result", {}))
+
+    async def _get_many(self, path, params_list, parse_result, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def _get(params, item):
+            async with semaphore:
+                try:
+                    resp = await self.client.get(path, params=params)
+                    result = resp.json().get("result", {})
+                    return item, parse_result(item, result), None
+                except (httpx.HTTPError, ValueError) as e:
+                    logger.debug("request {} failed: {}", path, e)
+                    return item, None, e
+
+        return list(await asyncio.gather(*(_get(*x) for x in params_list)))
+
+    async def get_locations(
+        self, ips: Iterable[str], concurrency: int = 8
+    ) -> List[Tuple[str, Optional[location.Location], Optional[Exception]]]:
+        """并发查询多个 IP 的位置, 按输入顺序返回 (ip, location, error)"""
+        ips = list(ips)
+        return await self._get_many(
+            LOCATION_PATH,
+            list(zip(self._location_reqs(ips), ips, strict=True)),
+            lambda _, result: _parse_location(result),
+            concurrency,
+        )
+
+    async def get_weathers(
+        self,
+        cities: Iterable[location.Location],
+        query_type: str = "now",
+        concurrency: int = 8,
+    ) -> List[Tuple[location.Location, Optional[weather.Weather], Optional[Exception]]]:
+        """并发查询多个地区的天气, 按输入顺序返回 (location, weather, error)"""
+        cities = list(cities)
+        return await self._get_many(
+            WEATHER_PATH,
+            list(zip(self._weather_reqs(cities, query_type), cities, strict=True)),
+            _parse_weather,
+            concurrency,
         )
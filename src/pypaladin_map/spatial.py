@@ -0,0 +1,168 @@
+"""Offline nearest-location index
+
+Locations are bucketed into a latitude/longitude grid of `cell_size`
+degrees, with coordinates held in flat float arrays. A query scans rings of
+cells around its own cell and stops once no unscanned cell can hold a point
+closer than the best one found so far.
+
+    index = NearestLocationIndex.from_csv("districts.csv")
+    found, distance_km = index.nearest(39.91, 116.40)
+"""
+
+import array
+import bisect
+import collections
+import csv
+import dataclasses
+import math
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from loguru import logger
+
+from pypaladin_map.location import Location
+
+EARTH_RADIUS_KM = 6371.0088
+_KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+_FIELDS = {f.name for f in dataclasses.fields(Location)} - {"street_history"}
+
+
+def haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """两点间的球面距离(公里)"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class NearestLocationIndex:
+    def __init__(self, locations: Iterable[Location], cell_size: float = 0.5):
+        self.cell_size = cell_size
+        self.locations: List[Location] = []
+        self.lats = array.array("d")
+        self.lons = array.array("d")
+        for item in locations:
+            try:
+                lat, lon = float(item.latitude), float(item.longitude)
+            except (TypeError, ValueError):
+                logger.debug("skip location without coordinate: {}", item)
+                continue
+            self.locations.append(item)
+            self.lats.append(lat)
+            self.lons.append(lon)
+
+        self._columns = math.ceil(360 / cell_size)
+        self._rows = math.ceil(180 / cell_size)
+        cells: Dict[Tuple[int, int], array.array] = collections.defaultdict(
+            lambda: array.array("I")
+        )
+        for i, (lat, lon) in enumerate(zip(self.lats, self.lons, strict=True)):
+            cells[self._cell(lat, lon)].append(i)
+        self._cells = dict(cells)
+        # 有数据的行, 扫描时跳过空行
+        self._populated_rows = {row for row, _ in self._cells}
+        self._min_row = min(self._populated_rows, default=0)
+        self._max_row = max(self._populated_rows, default=-1)
+        self._populated_columns = sorted({column for _, column in self._cells})
+
+    @classmethod
+    def from_csv(
+        cls, path: Union[Path, str], cell_size: float = 0.5
+    ) -> "NearestLocationIndex":
+        """从 CSV 创建, 需要包含 latitude, longitude 列, 其他列为 Location 字段"""
+        with Path(path).open(newline="", encoding="utf-8") as fp:
+            return cls(
+                (
+                    Location(**{k: v for k, v in row.items() if k in _FIELDS})
+                    for row in csv.DictReader(fp)
+                ),
+                cell_size=cell_size,
+            )
+
+    def __len__(self) -> int:
+        return len(self.locations)
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        row = min(int((lat + 90) // self.cell_size), self._rows - 1)
+        return row, int((lon + 180) // self.cell_size) % self._columns
+
+    def _ring(self, row: int, column: int, radius: int) -> Iterable[Tuple[int, int]]:
+        for i in range(row - radius, row + radius + 1):
+            if i not in self._populated_rows:
+                continue
+            edge = abs(i - row) == radius
+            step = 1 if edge else 2 * radius
+            for j in range(column - radius, column + radius + 1, step):
+                yield i, j % self._columns
+
+    def _lower_bound(self, lat: float, row: int, radius: int) -> float:
+        """第 radius 圈之外的点到查询点的最小距离(公里), 全部扫描完时为 inf"""
+        degrees = radius * self.cell_size
+        bound = math.inf
+        # 圈外的行: 纬度差至少为 degrees
+        if self._min_row < row - radius or self._max_row > row + radius:
+            bound = degrees * _KM_PER_DEGREE
+        # 圈内有数据的行中未扫描的列: 经度差至少为 degrees
+        low, high = max(self._min_row, row - radius), min(self._max_row, row + radius)
+        if 2 * radius + 1 < self._columns and low <= high:
+            lat_low = low * self.cell_size - 90
+            lat_high = min(90.0, (high + 1) * self.cell_size - 90)
+            gap = math.radians(max(lat_low - lat, lat - lat_high, 0))
+            cos_min = max(
+                0.0,
+                min(math.cos(math.radians(lat_low)), math.cos(math.radians(lat_high))),
+            )
+            # haversine 的两项分别取下界
+            a = (
+                math.sin(gap / 2) ** 2
+                + math.cos(math.radians(lat))
+                * cos_min
+                * math.sin(math.radians(degrees) / 2) ** 2
+            )
+            bound = min(bound, 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a))))
+        return bound
+
+    def _column_gap(self, column: int) -> int:
+        """到最近的有数据的列相差的列数(经度方向循环)"""
+        columns = self._populated_columns
+        i = bisect.bisect_left(columns, column)
+        gaps = [
+            (columns[i % len(columns)] - column) % self._columns,
+            (column - columns[i - 1]) % self._columns,
+        ]
+        return min(gaps)
+
+    def nearest_index(self, lat: float, lon: float) -> Tuple[int, float]:
+        """返回最近位置的下标和距离(公里), 索引为空时下标为 -1"""
+        best, best_distance = -1, math.inf
+        if not self.locations:
+            return best, best_distance
+        row, column = self._cell(lat, lon)
+        lats, lons = self.lats, self.lons
+        # 小于 start 的圈内没有数据, 远离数据的查询直接跳过
+        start = max(
+            self._min_row - row, row - self._max_row, self._column_gap(column), 0
+        )
+        for radius in range(start, max(self._rows, self._columns // 2 + 1)):
+            for cell in self._ring(row, column, radius):
+                for i in self._cells.get(cell, ()):
+                    distance = haversine(lat, lon, lats[i], lons[i])
+                    if distance < best_distance:
+                        best, best_distance = i, distance
+            if best >= 0 and self._lower_bound(lat, row, radius) >= best_distance:
+                break
+        return best, best_distance
+
+    def nearest(self, lat: float, lon: float) -> Tuple[Optional[Location], float]:
+        i, distance = self.nearest_index(lat, lon)
+        return (self.locations[i] if i >= 0 else None), distance
+
+    def reverse_geocode(
+        self, lats: Sequence[float], lons: Sequence[float]
+    ) -> List[Tuple[Optional[Location], float]]:
+        """批量查询坐标对应的最近位置"""
+        if len(lats) != len(lons):
+            raise ValueError("lats and lons must have the same length")
+        return [self.nearest(lat, lon) for lat, lon in zip(lats, lons, strict=True)]
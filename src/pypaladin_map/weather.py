@@ -1,12 +1,19 @@
+import asyncio
+from concurrent import futures
 import dataclasses
+from datetime import datetime
+import re
+import threading
 import time
-from functools import lru_cache
-from typing import List, Optional
+from typing import Dict, Iterable, List, Optional, Tuple
 
+import httpx
 import jwt
+from loguru import logger
 
-from pypaladin.httpclient import default_client
+from pypaladin.httpclient import shared_async_client, shared_client
 
+from pypaladin_map import cache
 from pypaladin_map import location as net_location
 
 
@@ -29,7 +36,7 @@ class Weather:
 
 class XDApi:
     def __init__(self):
-        self.client = default_client(base_url="http://u.api.xdapi.com")
+        self.client = shared_client(base_url="http://u.api.xdapi.com")
 
     def get_weather(self, location: net_location.Location) -> Weather:
         resp = self.get("/api/v2/Weather/city", params={"code": location.area_code})
@@ -59,30 +66,175 @@ MC4CAQAwBQYDK2VwBCIEIG+OSUl393SKw7d5kVdWKKp4ViL1EGMs7UCqFAWCs9CU
 """
 
 
-class HefengWeatherApi:
+HEFENG_BASE_URL = "https://ju44u937u3.re.qweatherapi.com"
+
+
+def _check_hefeng(resp: httpx.Response) -> dict:
+    """检查 HTTP 状态码和和风天气的 code, 失败时抛出异常"""
+    resp.raise_for_status()
+    data = resp.json()
+    if data.get("code") != "200":
+        raise ValueError(f"hefeng request failed, code: {data.get('code')}")
+    return data
+
+
+def _parse_hefeng_cities(data: dict) -> List[net_location.Location]:
+    return [
+        net_location.Location(
+            area_code=x.get("id"),
+            country=x.get("country"),
+            city=x.get("adm2") or x.get("adm1"),
+            district=x.get("name"),
+            latitude=x.get("lat"),
+            longitude=x.get("lon"),
+        )
+        for x in data.get("location", [])
+    ]
+
+
+def _parse_hefeng_weather(location: net_location.Location, data: dict) -> Weather:
+    value = data.get("now")
+    return Weather(
+        location=location,
+        weather=value.get("text"),
+        temperature=value.get("temp"),
+        winddirection=value.get("windDir"),
+        windpower=value.get("windScale"),
+        windspeed=value.get("windSpeed"),
+        humidity=value.get("humidity"),
+        reporttime=data.get("updateTime"),
+        link=data.get("fxLink"),
+    )
+
+
+# 和风天气实时天气大约每 10 分钟更新一次
+HEFENG_UPDATE_INTERVAL = 600
+
+
+def weather_ttl(
+    weather: Weather, interval: float = HEFENG_UPDATE_INTERVAL, min_ttl: float = 60
+) -> float:
+    """根据更新时间计算缓存时间: 缓存到下一次更新, 已过期时至少缓存 min_ttl 秒"""
+    try:
+        reported = datetime.fromisoformat(weather.reporttime)
+    except (TypeError, ValueError):
+        return min_ttl
+    return max(min_ttl, interval - (time.time() - reported.timestamp()))
+
+
+class HefengTokenManager:
+    """Cache the signed JWT and refresh it shortly before it expires
+
+    Within `refresh_margin` seconds of expiry one caller re-signs the token
+    while the others keep using the current one, which is still valid.
+    """
+
+    def __init__(
+        self,
+        project_id: str,
+        private_key: str,
+        kid: str,
+        ttl: int = 900,
+        refresh_margin: int = 60,
+    ):
+        self.project_id = project_id
+        self.private_key = private_key
+        self.kid = kid
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self._token: Optional[str] = None
+        self._expires = 0.0
+        self._lock = threading.Lock()
+
+    def _sign(self):
+        now = int(time.time())
+        payload = {"iat": now - 30, "exp": now + self.ttl, "sub": self.project_id}
+        token = jwt.encode(
+            payload, self.private_key, algorithm="EdDSA", headers={"kid": self.kid}
+        )
+        self._token, self._expires = token, now + self.ttl
+        logger.debug("hefeng token refreshed, expires at {}", self._expires)
+
+    def _valid_token(self) -> Optional[str]:
+        """返回仍然有效的 token, 不会阻塞; 已过期时返回 None"""
+        now = time.time()
+        token, expires = self._token, self._expires
+        if token and now < expires - self.refresh_margin:
+            return token
+        if token and now < expires:
+            # 即将过期: 只由一个调用方刷新, 其他调用方继续使用旧 token
+            if self._lock.acquire(blocking=False):
+                try:
+                    if self._expires == expires:
+                        self._sign()
+                finally:
+                    self._lock.release()
+            return self._token
+        return None
+
+    def get_token(self) -> str:
+        """Return a valid token
+
+        Blocking: when the token has expired the caller waits for the lock
+        and signs a new one. Async callers should use `aget_token`.
+        """
+        token = self._valid_token()
+        if token:
+            return token
+        with self._lock:
+            if self._token is None or time.time() >= self._expires:
+                self._sign()
+            return self._token  # type: ignore
+
+    async def aget_token(self) -> str:
+        """`get_token` that signs an expired token in a worker thread"""
+        token = self._valid_token()
+        if token:
+            return token
+        return await asyncio.to_thread(self.get_token)
+
+
+_token_managers: Dict[Tuple[str, str, str], HefengTokenManager] = {}
+_token_managers_lock = threading.Lock()
+
+
+def get_token_manager(project_id: str, private_key: str, kid: str):
+    with _token_managers_lock:
+        key = (project_id, private_key, kid)
+        if key not in _token_managers:
+            _token_managers[key] = HefengTokenManager(project_id, private_key, kid)
+        return _token_managers[key]
+
+
+class _HefengBase:
     def __init__(self, project_id: Optional[str]=None, private_key: Optional[str]=None,
                  kid: Optional[str]=None):  # fmt: skip
         self.project_id = project_id or DEFAULT_HEFENG_PROJECT_ID
         self.private_key = private_key or DEFAULT_HEFENG_PRIVATE_KEY
         self.kid = kid or DEFAULT_HEFENG_KID
-        self.client = default_client(base_url="https://ju44u937u3.re.qweatherapi.com")
+        self._tokens = get_token_manager(self.project_id, self.private_key, self.kid)
+
+    @property
+    def cache_identity(self) -> str:
+        return f"{HEFENG_BASE_URL}|{self.project_id}|{self.kid}"
 
-    @lru_cache()
     def _get_token(self) -> str:
-        payload = {
-            "iat": int(time.time()) - 30,
-            "exp": int(time.time()) + 900,
-            "sub": self.project_id,
-        }
-        headers = {"kid": self.kid}
-
-        # Generate JWT
-        encoded_jwt = jwt.encode(
-            payload, self.private_key, algorithm="EdDSA", headers=headers
-        )
-        return encoded_jwt
+        return self._tokens.get_token()
+
+    def _auth_headers(self) -> dict:
+        return {"Authorization": f"Bearer {self._get_token()}"}
 
-    @lru_cache
+    async def _aauth_headers(self) -> dict:
+        return {"Authorization": f"Bearer {await self._tokens.aget_token()}"}
+
+
+class HefengWeatherApi(_HefengBase):
+    def __init__(self, project_id: Optional[str]=None, private_key: Optional[str]=None,
+                 kid: Optional[str]=None):  # fmt: skip
+        super().__init__(project_id=project_id, private_key=private_key, kid=kid)
+        self.client = shared_client(base_url=HEFENG_BASE_URL)
+
+    @cache.cached("hefeng.lookup_city", ttl=86400)
     def lookup_city(
         self, location: str, adm: Optional[str] = None
     ) -> List[net_location.Location]:
@@ -90,36 +242,80 @@ class HefengWeatherApi:
         if adm:
             params["adm"] = adm
         resp = self.client.get(
-            "/geo/v2/city/lookup",
-            params=params,
-            headers={"Authorization": f"Bearer {self._get_token()}"},
+            "/geo/v2/city/lookup", params=params, headers=self._auth_headers()
         )
-        locations = resp.json().get("location", [])
-        return [
-            net_location.Location(
-                area_code=x.get("id"),
-                country=x.get("country"),
-                city=x.get("adm2") or x.get("adm1"),
-                district=x.get("name"),
-                latitude=x.get("lat"),
-                longitude=x.get("lon"),
-            )
-            for x in locations
-        ]
+        return _parse_hefeng_cities(_check_hefeng(resp))
 
+    @cache.cached("hefeng.weather", ttl=weather_ttl, key=lambda x: x.area_code)
     def get_weather(self, location: net_location.Location) -> Weather:
-        resp = self.client.get("/v7/weather/now", params={"location": location.area_code},
-                        headers={"Authorization": f"Bearer {self._get_token()}"})  # fmt: skip
-        data = resp.json()
-        value = data.get("now")
-        return Weather(
-            location=location,
-            weather=value.get("text"),
-            temperature=value.get("temp"),
-            winddirection=value.get("windDir"),
-            windpower=value.get("windScale"),
-            windspeed=value.get("windSpeed"),
-            humidity=value.get("humidity"),
-            reporttime=data.get("updateTime"),
-            link=data.get("fxLink"),
+        resp = self.client.get(
+            "/v7/weather/now",
+            params={"location": location.area_code},
+            headers=self._auth_headers(),
         )
+        return _parse_hefeng_weather(location, _check_hefeng(resp))
+
+
+class AsyncHefengWeatherApi(_HefengBase):
+    @property
+    def client(self):
+        return shared_async_client(base_url=HEFENG_BASE_URL)
+
+    @cache.cached("hefeng.lookup_city", ttl=86400)
+    async def lookup_city(
+        self, location: str, adm: Optional[str] = None
+    ) -> List[net_location.Location]:
+        params = {"location": location}
+        if adm:
+            params["adm"] = adm
+        resp = await self.client.get(
+            "/geo/v2/city/lookup", params=params, headers=await self._aauth_headers()
+        )
+        return _parse_hefeng_cities(_check_hefeng(resp))
+
+    @cache.cached("hefeng.weather", ttl=weather_ttl, key=lambda x: x.area_code)
+    async def get_weather(self, location: net_location.Location) -> Weather:
+        resp = await self.client.get(
+            "/v7/weather/now",
+            params={"location": location.area_code},
+            headers=await self._aauth_headers(),
+        )
+        return _parse_hefeng_weather(location, _check_hefeng(resp))
+
+
+def parse_city(value: str) -> Tuple[Optional[str], str]:
+    """解析 `上级行政区,城市` 或 `城市`"""
+    values = [x.strip() for x in re.split(r",|，", value) if x.strip()]
+    if not values:
+        raise ValueError(f"invalid city {value}")
+    if len(values) == 1:
+        return None, values[0]
+    return values[0], values[1]
+
+
+def get_city_weather(api: HefengWeatherApi, city: str) -> Weather:
+    adm, name = parse_city(city)
+    locations = api.lookup_city(name, adm=adm)
+    if not locations:
+        raise ValueError(f"city {city} is not found")
+    return api.get_weather(locations[0])
+
+
+def get_weathers(
+    cities: Iterable[str],
+    api: Optional[HefengWeatherApi] = None,
+    concurrency: int = 8,
+) -> List[Tuple[str, Optional[Weather], Optional[Exception]]]:
+    """并发查询多个城市的天气, 按输入顺序返回 (city, weather, error)"""
+    api = api or HefengWeatherApi()
+    cities = list(dict.fromkeys(cities))
+
+    def _get(city: str):
+        try:
+            return city, get_city_weather(api, city), None
+        except (IOError, httpx.HTTPError, ValueError) as e:
+            logger.debug("get weather of {} failed: {}", city, e)
+            return city, None, e
+
+    with futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(_get, cities))
@@ -1,12 +1,51 @@
-from typing import Any, Literal, Mapping, Optional, Sequence, Set, Type
+import collections
+import operator
+from typing import (
+    Any,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Literal,
+    Mapping,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Type,
+)
 
 from loguru import logger
-from peewee import ModelSelect, SqliteDatabase, MySQLDatabase, PostgresqlDatabase
+from peewee import (
+    AutoField,
+    BigAutoField,
+    BigIntegerField,
+    Case,
+    CharField,
+    Database,
+    DatabaseProxy,
+    DoubleField,
+    FloatField,
+    IntegerField,
+    ModelSelect,
+    MySQLDatabase,
+    PostgresqlDatabase,
+    SmallIntegerField,
+    SqliteDatabase,
+    TextField,
+    Value,
+    chunked,
+)
 from pydantic import BaseModel, Field, PrivateAttr
 
+from pypaladin_orm import session
 from pypaladin_orm.dbmodel import BaseDBModel, db_proxy, _tables
 
 
+DEFAULT_BATCH_SIZE = 1000
+
+
 class DBConfig(BaseModel):
     driver: Literal["sqlite", "mysql", "postgress"] = "sqlite"
     database: str = Field(default=":memory:", min_length=1)
@@ -29,29 +68,113 @@ class BaseObject(BaseModel):
         super().__setattr__(name, value)
         self._field_modified_.add(name)
 
+    @classmethod
+    def _where(cls, filters: Optional[Mapping[str, Any]]):
+        conditions = None
+        for k, v in (filters or {}).items():
+            condition = getattr(cls.__dbmodel__, k) == v
+            if conditions is None:
+                conditions = condition
+            else:
+                conditions &= condition
+        return conditions
+
     @classmethod
     def query(
         cls,
         filters: Optional[Mapping[str, Any]] = None,
         limit: Optional[int] = None,
         offset: Optional[int] = None,
+        validate: bool = False,
     ):
+        """查询, 默认信任数据库中的数据, validate=True 时使用 pydantic 校验
+
+        在 Session 中查询时使用会话的 identity map 和查询结果缓存。
+        """
+        current = session.get_session()
+        key = None
+        if current is not None:
+            key = session.result_key(
+                cls, tuple(sorted((filters or {}).items())), limit, offset, validate
+            )
+            cached = current.get_result(key) if key is not None else None
+            if cached is not None:
+                return cached
+
         query: ModelSelect = cls.__dbmodel__.select()
 
         if filters:
-            conditions = None
-            for k, v in filters.items():
-                condition = getattr(cls.__dbmodel__, k) == v
-                if conditions is None:
-                    conditions = condition
-                else:
-                    conditions &= condition
-            query = query.where(conditions)
+            query = query.where(cls._where(filters))
         if limit is not None:
             query = query.limit(limit)
         if offset is not None:
             query = query.offset(offset)
-        return [cls.model_validate(x, from_attributes=True) for x in query]
+        objects = cls.from_rows(_iter_tuples(query), _column_names(query), validate)
+        if current is None:
+            return list(objects)
+        objects = current.merge(objects)
+        if key is not None:
+            current.set_result(key, objects)
+        return objects
+
+    @classmethod
+    def from_rows(
+        cls,
+        rows: Iterable[Sequence[Any]],
+        columns: Sequence[str],
+        validate: bool = False,
+    ) -> Iterator["BaseObject"]:
+        """把按 columns 顺序排列的数据库行转换为对象"""
+        if validate:
+            for row in rows:
+                yield cls.model_validate(dict(zip(columns, row, strict=True)))
+        else:
+            yield from map(_get_hydrator(cls, columns), rows)
+
+    @classmethod
+    def iter_query(
+        cls,
+        filters: Optional[Mapping[str, Any]] = None,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        after_id: Optional[int] = None,
+        rows: Literal["objects", "dicts", "tuples"] = "objects",
+        validate: bool = False,
+    ) -> Iterator[Any]:
+        """按 id 顺序流式查询, 每次读取 batch_size 条
+
+        使用 id > 上一页最后一个 id 分页 (不使用 offset), 每页通过 iterator()
+        读取, 不缓存结果, 也不加入会话的 identity map。rows 为 dicts/tuples
+        时直接返回原始行。
+        """
+        id_field = getattr(cls.__dbmodel__, "id")
+        conditions = cls._where(filters)
+        query: ModelSelect = cls.__dbmodel__.select().order_by(id_field)
+        columns = _column_names(query)
+        id_index = columns.index("id")
+        while True:
+            page = query
+            if after_id is not None:
+                page = page.where(id_field > after_id)
+            if conditions is not None:
+                page = page.where(conditions)
+            page = page.limit(batch_size)
+
+            count = 0
+            if rows == "dicts":
+                for row in page.dicts().iterator():
+                    count += 1
+                    after_id = row["id"]
+                    yield row
+            else:
+                page_rows = _iter_tuples(page, batch_size)
+                if rows == "objects":
+                    page_rows = cls.from_rows(page_rows, columns, validate)
+                for row in page_rows:
+                    count += 1
+                    after_id = row.id if rows == "objects" else row[id_index]
+                    yield row
+            if count < batch_size:
+                return
 
     def _get_changes(self) -> Mapping[str, Any]:
         return {k: getattr(self, k) for k in self._field_modified_}
@@ -63,6 +186,147 @@ class BaseObject(BaseModel):
         db_model = self.__dbmodel__.create(**self.model_dump(exclude_none=True))
         self.id = db_model.id
         self._field_modified_.clear()
+        self._written([self])
+
+    @classmethod
+    def bulk_create(
+        cls, objects: Iterable["BaseObject"], batch_size: Optional[int] = None
+    ) -> int:
+        """批量创建, 在一个事务中分批执行 INSERT, 返回创建的数量
+
+        字段相同的对象合并到同一条 INSERT, 数据库支持 RETURNING 时按字段值回填 id。
+        """
+        objects = list(objects)
+        if any(obj.id is not None for obj in objects):
+            raise ValueError("Cannot create an existing object")
+        created = cls._insert_many(objects, batch_size)
+        logger.debug("created {} {} objects", created, cls.__name__)
+        return created
+
+    @classmethod
+    def upsert(
+        cls,
+        objects: Iterable["BaseObject"],
+        conflict_target: Sequence[str] = ("id",),
+        batch_size: Optional[int] = None,
+    ) -> int:
+        """批量插入, 与 conflict_target 冲突的记录改为更新其他字段
+
+        SQLite/Postgres 使用 ON CONFLICT, MySQL 使用 ON DUPLICATE KEY UPDATE
+        (冲突由表的主键和唯一索引决定, 忽略 conflict_target)。
+        """
+        count = cls._insert_many(list(objects), batch_size, conflict_target)
+        logger.debug("upserted {} {} objects", count, cls.__name__)
+        return count
+
+    @classmethod
+    def _insert_many(
+        cls,
+        objects: List["BaseObject"],
+        batch_size: Optional[int],
+        conflict_target: Optional[Sequence[str]] = None,
+    ) -> int:
+        groups: Dict[Tuple[str, ...], List[Tuple[BaseObject, dict]]] = (
+            collections.defaultdict(list)
+        )
+        for obj in objects:
+            row = obj.model_dump(exclude_none=True)
+            groups[tuple(row)].append((obj, row))
+        if not groups:
+            return 0
+
+        db = _get_database(cls.__dbmodel__)
+        returning = _supports_returning(db)
+        id_field = getattr(cls.__dbmodel__, "id")
+        count = 0
+        with db.atomic():
+            for columns, items in groups.items():
+                size = _batch_size(db, len(columns), batch_size) if columns else 1
+                for batch in chunked(items, size):
+                    if columns:
+                        query = cls.__dbmodel__.insert_many([x[1] for x in batch])
+                    else:
+                        # 没有任何字段时只能逐条 INSERT ... DEFAULT VALUES
+                        query = cls.__dbmodel__.insert()
+                    if conflict_target is not None:
+                        query = cls._on_conflict(db, query, columns, conflict_target)
+                    if returning:
+                        fields = [getattr(cls.__dbmodel__, x) for x in columns]
+                        rows = query.returning(id_field, *fields).tuples().execute()
+                        _backfill_ids(batch, columns, rows)
+                    else:
+                        query.execute()
+                    count += len(batch)
+        for obj in objects:
+            obj._field_modified_.clear()
+        cls._written(objects)
+        return count
+
+    @classmethod
+    def _on_conflict(
+        cls,
+        db: Database,
+        query,
+        columns: Sequence[str],
+        conflict_target: Sequence[str],
+    ):
+        # 没有其他字段时仍然更新冲突字段, 保证 RETURNING 返回每一行
+        preserve = [x for x in columns if x not in conflict_target] or list(columns)
+        fields = [getattr(cls.__dbmodel__, x) for x in preserve]
+        if isinstance(db, MySQLDatabase):
+            return query.on_conflict(preserve=fields)
+        return query.on_conflict(
+            conflict_target=[getattr(cls.__dbmodel__, x) for x in conflict_target],
+            preserve=fields,
+        )
+
+    @classmethod
+    def bulk_save(
+        cls, objects: Iterable["BaseObject"], batch_size: Optional[int] = None
+    ) -> int:
+        """批量保存修改, 返回更新的对象数量
+
+        修改字段相同的对象合并为一条 UPDATE ... SET f = CASE id WHEN ... END,
+        所有 UPDATE 在一个事务中执行。
+        """
+        groups: Dict[Tuple[str, ...], List[BaseObject]] = collections.defaultdict(list)
+        for obj in objects:
+            if obj.id is None:
+                raise ValueError("Cannot save a new object")
+            fields = tuple(sorted(obj._field_modified_ - {"id"}))
+            if fields:
+                groups[fields].append(obj)
+        if not groups:
+            return 0
+
+        db = _get_database(cls.__dbmodel__)
+        id_field = getattr(cls.__dbmodel__, "id")
+        count = 0
+        with db.atomic():
+            for fields, items in groups.items():
+                # 每个字段 2 个参数 (id, value), 另外 1 个参数用于 WHERE id IN
+                size = _batch_size(db, 2 * len(fields) + 1, batch_size)
+                for batch in chunked(items, size):
+                    values = {}
+                    for name in fields:
+                        field = getattr(cls.__dbmodel__, name)
+                        values[field] = Case(
+                            id_field,
+                            [
+                                (obj.id, Value(getattr(obj, name), field.db_value))
+                                for obj in batch
+                            ],
+                        )
+                    cls.__dbmodel__.update(values).where(
+                        id_field.in_([obj.id for obj in batch])
+                    ).execute()
+                    count += len(batch)
+        for items in groups.values():
+            for obj in items:
+                obj._field_modified_.clear()
+        cls._written([obj for items in groups.values() for obj in items])
+        logger.debug("saved {} {} objects", count, cls.__name__)
+        return count
 
     def save(self):
         if self.id is None:
@@ -74,6 +338,7 @@ class BaseObject(BaseModel):
             getattr(self.__dbmodel__, "id") == self.id
         ).execute()
         self._field_modified_.clear()
+        self._written([self])
 
     def delete(self):
         if self.id is None:
@@ -82,25 +347,184 @@ class BaseObject(BaseModel):
         self.__dbmodel__.delete().where(
             getattr(self.__dbmodel__, "id") == self.id
         ).execute()
+        session.invalidate(self.__dbmodel__, deleted=[self.id])
 
     @classmethod
     def delete_by_values(cls, **filters):
         if not filters:
             raise ValueError("No filters provided")
-        conditions = None
-        for k, v in filters.items():
-            condition = getattr(cls.__dbmodel__, k) == v
-            if conditions is None:
-                conditions = condition
-            else:
-                conditions &= condition
 
-        cls.__dbmodel__.delete().where(conditions)
+        cls.__dbmodel__.delete().where(cls._where(filters)).execute()
+        session.invalidate(cls.__dbmodel__, drop_all=True)
 
     @classmethod
     def delete_all(cls):
         """删除所有数据"""
         cls.__dbmodel__.delete().execute()
+        session.invalidate(cls.__dbmodel__, drop_all=True)
+
+    @classmethod
+    def _written(cls, objects: List["BaseObject"]):
+        session.invalidate(cls.__dbmodel__, changed=objects)
+        current = session.get_session()
+        if current is not None:
+            for obj in objects:
+                current.add(obj)
+
+
+class _Hydrator:
+    """预先编译列到字段的映射, 跳过 pydantic 校验直接构造对象"""
+
+    def __init__(self, cls: Type[BaseObject], columns: Sequence[str]):
+        fields = cls.model_fields
+        self.cls = cls
+        self.names = tuple(x for x in columns if x in fields)
+        # 数据库模型中多出的列直接丢弃
+        self.getter = (
+            None
+            if len(self.names) == len(columns)
+            else operator.itemgetter(*(i for i, x in enumerate(columns) if x in fields))
+        )
+        self.fields_set = frozenset(self.names)
+        self.missing = [(k, v) for k, v in fields.items() if k not in self.fields_set]
+        self.private = cls.__private_attributes__
+        # 没有自定义 model_post_init 时直接初始化私有属性, 跳过 pydantic 的逐个检查
+        post_init = getattr(cls.model_post_init, "__qualname__", "")
+        self.post_init = (
+            cls.__pydantic_post_init__ is not None
+            and post_init != "init_private_attributes"
+        )
+
+    def __call__(self, row: Sequence[Any]) -> BaseObject:
+        if self.getter is not None:
+            row = self.getter(row)
+            if len(self.names) == 1:
+                row = (row,)
+        values = dict(zip(self.names, row, strict=True))
+        for name, field in self.missing:
+            values[name] = field.get_default(call_default_factory=True)
+        obj = self.cls.__new__(self.cls)
+        _object_setattr(obj, "__dict__", values)
+        _object_setattr(obj, "__pydantic_fields_set__", set(self.fields_set))
+        _object_setattr(obj, "__pydantic_extra__", None)
+        if self.post_init:
+            obj.model_post_init(None)
+        else:
+            _object_setattr(
+                obj,
+                "__pydantic_private__",
+                {k: v.get_default() for k, v in self.private.items()} or None,
+            )
+        return obj
+
+
+_object_setattr = object.__setattr__
+_hydrators: Dict[Tuple[Type[BaseObject], Tuple[str, ...]], _Hydrator] = {}
+
+
+def _get_hydrator(cls: Type[BaseObject], columns: Sequence[str]) -> _Hydrator:
+    key = (cls, tuple(columns))
+    hydrator = _hydrators.get(key)
+    if hydrator is None:
+        hydrator = _hydrators[key] = _Hydrator(cls, columns)
+    return hydrator
+
+
+def _column_names(query: ModelSelect) -> List[str]:
+    return [x.name for x in query.selected_columns]
+
+
+# 数据库驱动已经返回正确 Python 类型的字段, 读取时不需要 python_value 转换
+_PLAIN_FIELDS = (
+    AutoField,
+    BigAutoField,
+    IntegerField,
+    BigIntegerField,
+    SmallIntegerField,
+    FloatField,
+    DoubleField,
+    CharField,
+    TextField,
+)
+
+
+def _iter_tuples(
+    query: ModelSelect, batch_size: int = DEFAULT_BATCH_SIZE
+) -> Iterator[Sequence[Any]]:
+    """直接从游标分批读取元组, 只转换需要 python_value 的列"""
+    converters = [
+        (i, x.python_value)
+        for i, x in enumerate(query.selected_columns)
+        if type(x) not in _PLAIN_FIELDS and hasattr(x, "python_value")
+    ]
+    cursor = _get_database(query.model).execute(query)
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        if not converters:
+            yield from rows
+            continue
+        for row in rows:
+            row = list(row)
+            for i, python_value in converters:
+                row[i] = python_value(row[i])
+            yield tuple(row)
+
+
+def _get_database(dbmodel: Type[BaseDBModel]) -> Database:
+    db = dbmodel._meta.database  # type: ignore
+    return db.obj if isinstance(db, DatabaseProxy) else db
+
+
+def _backfill_ids(
+    batch: Sequence[Tuple[BaseObject, dict]],
+    columns: Sequence[str],
+    rows: Iterable[Sequence[Any]],
+):
+    """按插入的字段值把 RETURNING 返回的 id 对应回对象
+
+    RETURNING 的行顺序没有保证, 不能按位置对应; 字段值相同的对象可以互换,
+    按返回顺序依次分配。
+    """
+    pending: Dict[Any, Deque[BaseObject]] = collections.defaultdict(collections.deque)
+    for obj, row in batch:
+        key = _row_key([row[x] for x in columns])
+        if key is not None:
+            pending[key].append(obj)
+    unmatched = len(batch)
+    for obj_id, *values in rows:
+        objects = pending.get(_row_key(values))
+        if objects:
+            objects.popleft().id = obj_id
+            unmatched -= 1
+    if unmatched:
+        logger.warning("can not match ids of {} inserted objects", unmatched)
+
+
+def _row_key(values: Sequence[Any]) -> Optional[tuple]:
+    key = tuple(values)
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+def _supports_returning(db: Database) -> bool:
+    if isinstance(db, PostgresqlDatabase):
+        return True
+    # SQLite 3.35 开始支持 RETURNING
+    return isinstance(db, SqliteDatabase) and db.server_version >= (3, 35, 0)
+
+
+def _batch_size(db: Database, columns: int, batch_size: Optional[int]) -> int:
+    batch_size = batch_size or DEFAULT_BATCH_SIZE
+    if isinstance(db, SqliteDatabase):
+        # SQLITE_MAX_VARIABLE_NUMBER: 3.32 之前为 999, 之后为 32766
+        limit = 32766 if db.server_version >= (3, 32, 0) else 999
+        batch_size = min(batch_size, limit // max(columns, 1))
+    return max(batch_size, 1)
 
 
 def _create_db(dbconf: DBConfig):
@@ -0,0 +1,146 @@
+"""对象会话: identity map 和查询结果缓存
+
+会话内同一条记录 (class, id) 只对应一个 Python 对象, BaseObject.query 的结果
+按过滤条件缓存。任何会话中对同一张表的写操作都会使缓存失效。
+
+    with Session(cache_size=256):
+        User.query({"name": "foo"})  # 查询数据库
+        User.query({"name": "foo"})  # 命中缓存
+"""
+
+import collections
+import contextvars
+import threading
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
+import weakref
+
+_current: contextvars.ContextVar[Optional["Session"]] = contextvars.ContextVar(
+    "pypaladin_orm_session", default=None
+)
+_sessions: "weakref.WeakSet[Session]" = weakref.WeakSet()
+_sessions_lock = threading.Lock()
+
+
+class Session:
+    """查询会话, 通过 with 语句在当前上下文中启用
+
+    Args:
+        identity_map: 是否启用 identity map
+        cache_size: 查询结果缓存的最大条数, 0 表示不缓存
+    """
+
+    def __init__(self, identity_map: bool = True, cache_size: int = 128):
+        self.identity_map = identity_map
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._identities: Dict[Tuple[type, Any], Any] = {}
+        self._results: collections.OrderedDict[Hashable, List[Any]] = (
+            collections.OrderedDict()
+        )
+        self._tokens: List[contextvars.Token] = []
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> "Session":
+        with _sessions_lock:
+            _sessions.add(self)
+        self._tokens.append(_current.set(self))
+        return self
+
+    def __exit__(self, *args):
+        _current.reset(self._tokens.pop())
+        if not self._tokens:
+            with _sessions_lock:
+                _sessions.discard(self)
+            self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._identities.clear()
+            self._results.clear()
+
+    def get_result(self, key: Hashable) -> Optional[List[Any]]:
+        with self._lock:
+            objects = self._results.get(key)
+            if objects is None:
+                self.misses += 1
+                return None
+            self._results.move_to_end(key)
+            self.hits += 1
+            return list(objects)
+
+    def set_result(self, key: Hashable, objects: List[Any]):
+        if self.cache_size <= 0:
+            return
+        with self._lock:
+            self._results[key] = list(objects)
+            self._results.move_to_end(key)
+            while len(self._results) > self.cache_size:
+                self._results.popitem(last=False)
+
+    def merge(self, objects: Iterable[Any]) -> List[Any]:
+        """用会话中已有的对象替换查询到的同一条记录"""
+        if not self.identity_map:
+            return list(objects)
+        with self._lock:
+            return [
+                self._identities.setdefault((type(obj), obj.id), obj) for obj in objects
+            ]
+
+    def add(self, obj: Any):
+        if self.identity_map and obj.id is not None:
+            with self._lock:
+                self._identities[(type(obj), obj.id)] = obj
+
+    def _invalidate(self, dbmodel: type, changed, deleted, drop_all: bool):
+        with self._lock:
+            for key in [k for k in self._results if k[0].__dbmodel__ is dbmodel]:
+                del self._results[key]
+            if not self._identities:
+                return
+            for obj in changed:
+                # 其他对象保存了同一条记录, 会话中的对象已经过期
+                key = (type(obj), obj.id)
+                if self._identities.get(key, obj) is not obj:
+                    del self._identities[key]
+            if not (drop_all or deleted):
+                return
+            for key in list(self._identities):
+                if key[0].__dbmodel__ is dbmodel and (drop_all or key[1] in deleted):
+                    del self._identities[key]
+
+
+def get_session() -> Optional[Session]:
+    return _current.get()
+
+
+def result_key(cls: type, *args) -> Optional[Hashable]:
+    """查询结果缓存的 key, 参数不可哈希时返回 None"""
+    key = (cls, *args)
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+def invalidate(
+    dbmodel: type,
+    changed: Iterable[Any] = (),
+    deleted: Iterable[Any] = (),
+    drop_all: bool = False,
+):
+    """写操作后清理所有会话中该表的查询缓存和过期对象
+
+    Args:
+        changed: 新建或修改的对象
+        deleted: 被删除记录的 id
+        drop_all: 是否移除该表的所有对象, 用于按条件删除
+    """
+    with _sessions_lock:
+        sessions = list(_sessions)
+    if not sessions:
+        return
+    changed, deleted = list(changed), set(deleted)
+    for session in sessions:
+        session._invalidate(dbmodel, changed, deleted, drop_all)
@@ -1,21 +1,26 @@
+import csv
+import dataclasses
 from datetime import datetime
 import functools
+import json
+import time
 from pathlib import Path
-import re
 import subprocess
 import sys
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 
 import httpx
 
 import click
+import humanize
 from loguru import logger
 
-from pypaladin import log
+from pypaladin import hedge, log
 from pypaladin.command.diskpart import compress_virtual_disk
 from pypaladin.conf import BaseAppConfig
 from pypaladin.httpclient import default_client
-from pypaladin.utils import strutil
+from pypaladin.table import DataTable
+from pypaladin.utils import download, strutil
 from pypaladin.utils.fileutil import move_files
 from pypaladin_map import ipinfo, location, qqmap, weather
 from pypaladin_tool import _types
@@ -63,6 +68,18 @@ def click_command_with_help(func):
     help="request method, default: GET",
 )
 @click.option("-D", "--data", help="request body")
+@click.option("--http2", is_flag=True, help="use HTTP/2 if the server supports it")
+@click.option(
+    "-o", "--output", type=click.Path(dir_okay=False), help="write body to file"
+)
+@click.option(
+    "-P",
+    "--parallel",
+    type=click.IntRange(min=1),
+    default=1,
+    help="download in parallel byte ranges if the server supports it",
+)
+@click.option("--no-resume", is_flag=True, help="do not resume an interrupted download")
 @click.option(
     "-H",
     "--header",
@@ -77,6 +94,10 @@ def curl(
     header: List[Dict] = [],
     timeout: Optional[int] = None,
     data: Optional[str] = None,
+    http2: bool = False,
+    output: Optional[str] = None,
+    parallel: int = 1,
+    no_resume: bool = False,
 ):
     """curl command
 
@@ -85,18 +106,37 @@ def curl(
         URl: 请求URL
     e.g.
         curl http://www.example.com
+        curl -o file.iso -P 4 http://www.example.com/file.iso
     """
     if not url.startswith("http://") and not url.startswith("https://"):
         raise click.UsageError(
             _error_msg(f'url "{url}" is invalid, do you mean http(s)://{url} ?')
         )
 
-    client = default_client(timeout=timeout)
+    try:
+        client = default_client(timeout=timeout, http2=http2 or None)
+    except ImportError as e:
+        raise click.UsageError(
+            _error_msg("--http2 requires h2, run: pip install pypaladin[http2]")
+        ) from e
+    headers = {k: v for h in header for k, v in h.items()}
+    if output:
+        _curl_output(
+            client,
+            url,
+            method,
+            headers,
+            data,
+            Path(output),
+            parallel=parallel,
+            resume=not no_resume,
+        )
+        return
     try:
         resp = client.request(
             method=method,
             url=url,
-            headers={k: v for h in header for k, v in h.items()},
+            headers=headers,
             content=data,
         )
     except httpx.HTTPError as e:
@@ -110,17 +150,57 @@ def curl(
 
     click.secho("========== response ==========", fg="cyan")
     click.secho(
-        f"{resp.status_code} {resp.reason_phrase}",
+        f"{resp.http_version} {resp.status_code} {resp.reason_phrase}",
         fg="red" if resp.status_code >= 400 else "green",
     )
     for k, v in resp.headers.items():
         click.echo(f"{k.title()}: {v}")
 
     click.echo("")
-    click.echo(resp.content.decode() if resp.content else "")
+    try:
+        click.echo(resp.content.decode() if resp.content else "")
+    except UnicodeDecodeError:
+        click.secho(
+            f"<binary content, {len(resp.content)} bytes, use -o/--output to save it>",
+            fg="yellow",
+        )
     click.secho(f"(Elapsed: {resp.elapsed.total_seconds()}s)", fg="bright_black")
 
 
+def _curl_output(
+    client: httpx.Client,
+    url: str,
+    method: str,
+    headers: Dict,
+    data: Optional[str],
+    output: Path,
+    parallel: int = 1,
+    resume: bool = True,
+):
+    """Stream the response body to a file"""
+    started = time.perf_counter()
+    try:
+        if method == "GET" and not data:
+            download.download(
+                client, url, output, headers=headers, parallel=parallel, resume=resume
+            )
+        else:
+            with client.stream(method, url, headers=headers, content=data) as resp:
+                resp.raise_for_status()
+                with output.open("wb") as fp:
+                    for chunk in resp.iter_bytes(download.CHUNK_SIZE):
+                        fp.write(chunk)
+    except (httpx.HTTPError, OSError) as e:
+        raise click.ClickException(_error_msg(f"{method} {url} failed: {e}")) from e
+    elapsed = time.perf_counter() - started
+    size = output.stat().st_size
+    click.secho(
+        f"saved {output} ({humanize.naturalsize(size)}, {elapsed:.2f}s, "
+        f"{humanize.naturalsize(size / max(elapsed, 1e-6))}/s)",
+        fg="green",
+    )
+
+
 @cli.group()
 def network():
     """Network tools"""
@@ -129,8 +209,52 @@ def network():
 @network.command("location")
 @click.option("--detail", is_flag=True, help="显示详情")
 @click.option("--ip", type=_types.TYPE_IPV4, help="指定IP地址")
-def _location(detail=False, ip=None):
-    """Get Local info"""
+@click.option(
+    "-f",
+    "--file",
+    "ip_file",
+    type=click.File("r"),
+    help="批量查询, 从文件读取IP, - 表示标准输入",
+)
+@click.option("--column", type=click.IntRange(min=1), help="IP 所在的列(按空白分隔)")
+@click.option(
+    "--format",
+    "output_format",
+    type=click.Choice(["jsonl", "csv"]),
+    default="jsonl",
+    help="批量查询的输出格式",
+)
+@click.option(
+    "-c", "--concurrency", type=click.IntRange(min=1), default=8, help="并发数"
+)
+@click.option(
+    "--hedge-delay",
+    type=click.FloatRange(min=0),
+    default=None,
+    help="接口超过该时间(秒)未返回时同时请求备用接口, "
+    f"默认 {hedge.DEFAULT_HEDGE_DELAY}, 批量查询(-f)时默认不启用",
+)
+def _location(
+    detail=False,
+    ip=None,
+    ip_file=None,
+    column: Optional[int] = None,
+    output_format: str = "jsonl",
+    concurrency: int = 8,
+    hedge_delay: Optional[float] = None,
+):
+    """Get Local info
+
+    \b
+    e.g.
+        network location --ip 1.1.1.1
+        awk '{print $1}' access.log | network location -f - --format csv
+    """
+    if ip_file:
+        _bulk_location(ip_file, column, output_format, concurrency, hedge_delay)
+        return
+    if hedge_delay is None:
+        hedge_delay = hedge.DEFAULT_HEDGE_DELAY
     local_info = {}
     if ip:
         is_ip, ip_type = strutil.is_valid_ip(ip)
@@ -139,12 +263,9 @@ def _location(detail=False, ip=None):
             return 1
         local_info["ip"] = ip
     else:
-        local_info["ip"] = ipinfo.get_public_ip()
+        local_info["ip"] = ipinfo.get_public_ip(hedge_delay=hedge_delay)
     try:
-        ip_location = location.Location()
-        for api in [location.IP77Api(), location.UUToolApi()]:
-            ip_location = api.get_location(local_info.get("ip"))
-            break
+        ip_location = location.get_location(local_info["ip"], hedge_delay=hedge_delay)
         if not detail:
             click.echo(f"public ip: {local_info.get('ip')}")
             click.echo(f"location : {ip_location.info()}")
@@ -158,11 +279,83 @@ def _location(detail=False, ip=None):
         raise click.ClickException(_error_msg(f"get local info failed: {e}"))
 
 
+def _bulk_location(
+    ip_file,
+    column: Optional[int],
+    output_format: str,
+    concurrency: int,
+    hedge_delay: Optional[float],
+):
+    fields = ["ip"] + [
+        f.name
+        for f in dataclasses.fields(location.Location)
+        if f.name not in ("ip", "street_history")
+    ]
+    writer = None
+    if output_format == "csv":
+        writer = csv.DictWriter(sys.stdout, fields + ["error"], extrasaction="ignore")
+        writer.writeheader()
+    total = failed = 0
+    ips = location.extract_ips(ip_file, column=column)
+    results = location.locate_many(
+        ips, concurrency=concurrency, hedge_delay=hedge_delay
+    )
+    for ip, ip_location, error in results:
+        total += 1
+        row = ip_location.to_dict() if ip_location else {}
+        row["ip"] = ip
+        if error:
+            failed += 1
+            row["error"] = str(error)
+        if writer:
+            writer.writerow(row)
+        else:
+            click.echo(json.dumps(row, ensure_ascii=False))
+    logger.info("located {} ip addresses, {} failed", total, failed)
+
+
+@network.command("ipdb")
+@click.argument("csv_file", type=click.Path(exists=True, dir_okay=False))
+@click.option("-o", "--output", default=location.DEFAULT_IPDB_PATH, help="输出文件")
+def _ipdb(csv_file: str, output: str):
+    """Compile offline IP database from CSV
+
+    \b
+    CSV 需要包含 start,end 列, 其他列为位置字段, 例如:
+        start,end,country,province,city,isp
+        1.0.1.0,1.0.3.255,中国,福建,福州,电信
+    """
+    try:
+        db = location.OfflineIPDatabase.compile_csv(csv_file, output)
+    except (OSError, KeyError, ValueError) as e:
+        raise click.ClickException(_error_msg(f"compile failed: {e}")) from e
+    click.echo(f"compiled {len(db)} ip ranges to {output}")
+
+
 @network.command("weather")
-@click.option("--city", help="指定城市(省,市,县|区),例如:北京市,东城区")
-def _weather(city: Optional[str] = None):
-    """Get weather"""
+@click.option(
+    "--city", multiple=True, help="指定城市(省,市,县|区),例如:北京市,东城区, 可指定多个"
+)
+@click.option(
+    "-f", "--file", "city_file", type=click.File("r"), help="从文件读取城市, 每行一个"
+)
+@click.option(
+    "-c", "--concurrency", type=click.IntRange(min=1), default=8, help="并发数"
+)
+def _weather(city: Tuple[str, ...] = (), city_file=None, concurrency: int = 8):
+    """Get weather
+
+    \b
+    e.g.
+        network weather --city 北京市,东城区
+        network weather --city 北京 --city 上海 -f cities.txt
+    """
     api = weather.HefengWeatherApi()
+    cities = list(city)
+    if city_file:
+        cities.extend(
+            line.strip() for line in city_file if line.strip() and line[0] != "#"
+        )
 
     def _format_weather(weather: weather.Weather) -> str:
         return WEATHER_TEMPLATE.format(
@@ -180,7 +373,7 @@ def _weather(city: Optional[str] = None):
             link=click.style(f"更多信息: {weather.link or '-'}", fg="bright_black"),
         )
 
-    if not city:
+    if not cities:
         qq_api = qqmap.QQMapAPI()
         logger.debug("get my location")
         my_location = qq_api.get_location()
@@ -188,24 +381,54 @@ def _weather(city: Optional[str] = None):
         click.echo(_format_weather(data))
         return
 
-    values = re.split(r",|，", city)
-    if not values:
-        raise ValueError("invalid city")
-    if len(values) == 1:
-        adm, location_name = None, values[0]
-    else:
-        adm, location_name = values[0], values[1]
-    logger.debug("lookup city {}", city)
+    if len(cities) > 1:
+        _weather_table(api, cities, concurrency)
+        return
+
+    logger.debug("lookup city {}", cities[0])
     try:
-        locations = api.lookup_city(location_name, adm=adm)
-    except httpx.HTTPError as e:
-        logger.error("lookup city failed: {}", e)
+        data = weather.get_city_weather(api, cities[0])
+    except (httpx.HTTPError, ValueError) as e:
+        logger.error("get weather failed: {}", e)
         return 1
-    my_location = locations[0]
-    data = api.get_weather(my_location)
     click.echo(_format_weather(data))
 
 
+def _weather_table(api: weather.HefengWeatherApi, cities: List[str], concurrency: int):
+    table = DataTable(
+        ["city", "area", "weather", "temperature", "wind", "humidity", "reporttime"],
+        title={
+            "city": "城市",
+            "area": "区域",
+            "weather": "天气",
+            "temperature": "温度",
+            "wind": "风向&风力",
+            "humidity": "湿度",
+            "reporttime": "更新时间",
+        },
+    )
+    failed = 0
+    for city, data, error in weather.get_weathers(cities, api, concurrency):
+        if data is None:
+            failed += 1
+            table.add_row([city, click.style(str(error), fg="red"), "", "", "", "", ""])
+            continue
+        table.add_row(
+            [
+                city,
+                data.location.info(),
+                data.weather,
+                f"{data.temperature}℃",
+                f"{data.winddirection} {data.windpower or '-'}",
+                data.humidity or "-",
+                data.reporttime,
+            ]
+        )
+    click.echo(table)
+    if failed:
+        logger.warning("get weather of {} cities failed", failed)
+
+
 @cli.group()
 def disk():
     """Disk tools"""
@@ -0,0 +1,70 @@
+import pytest
+
+from pypaladin_map import areacode
+
+AREAS = {
+    "110000": "北京市",
+    "110100": "市辖区",
+    "110101": "东城区",
+    "110105": "朝阳区",
+    "220000": "吉林省",
+    "220100": "长春市",
+    "220104": "朝阳区",
+    "419000": "省直辖县级行政区划",
+    "410000": "河南省",
+    "419001": "济源市",
+}
+
+
+@pytest.fixture()
+def index(tmp_path):
+    path = tmp_path / "areacode.idx"
+    areacode.AreaCodeIndex.save(AREAS, path)
+    return areacode.AreaCodeIndex.load(path)
+
+
+def test_lookup(index):
+    assert len(index) == len(AREAS)
+    assert index.get_name("110101") == "东城区"
+    assert index.get_name("110102") is None
+    assert index.get_codes("朝阳区") == ["110105", "220104"]
+    assert index.get_codes("上海市") == []
+
+
+def test_search(index):
+    assert index.search_prefix("北京") == [("110000", "北京市")]
+    assert index.search_prefix("朝") == [("110105", "朝阳区"), ("220104", "朝阳区")]
+    assert index.search_fuzzy("长春")[0] == ("220100", "长春市")
+
+
+def test_hierarchy(index):
+    assert index.get_parent("110105") == "110100"
+    assert index.get_parent("110100") == "110000"
+    assert index.get_parent("110000") is None
+    assert index.get_children("110000") == [("110100", "市辖区")]
+    assert index.get_children("110100") == [("110101", "东城区"), ("110105", "朝阳区")]
+    assert [name for _, name in index.get_path("220104")] == [
+        "吉林省",
+        "长春市",
+        "朝阳区",
+    ]
+
+
+def test_wenyisoa_api(tmp_path, monkeypatch):
+    calls = []
+
+    def get_areacode_list(self):
+        calls.append(1)
+        return AREAS
+
+    monkeypatch.setattr(areacode.WenyisoAAPI, "get_areacode_list", get_areacode_list)
+    path = tmp_path / "areacode.idx"
+    assert areacode.WenyisoAAPI(path).get_areacode("吉林省") == "220000"
+    assert areacode.WenyisoAAPI(path).get_areacodes(["长春市", "无"]) == {
+        "长春市": "220100",
+        "无": None,
+    }
+    with pytest.raises(ValueError):
+        areacode.WenyisoAAPI(path).get_areacode("上海市")
+    assert len(calls) == 1
+    assert path.exists()
@@ -0,0 +1,157 @@
+import re
+
+import httpx
+import pytest
+
+from pypaladin.utils import download
+
+PAYLOAD = bytes(range(256)) * 64
+
+
+def _range_handler(requests: list, ranges=True, etag='"v1"'):
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        matched = re.match(r"bytes=(\d+)-(\d*)", request.headers.get("Range", ""))
+        if_range = request.headers.get("If-Range")
+        if not ranges or not matched or (if_range and if_range != etag):
+            return httpx.Response(200, content=PAYLOAD, headers={"ETag": etag})
+        start = int(matched.group(1))
+        end = int(matched.group(2) or len(PAYLOAD) - 1)
+        if start >= len(PAYLOAD):
+            return httpx.Response(416)
+        return httpx.Response(
+            206,
+            content=PAYLOAD[start : end + 1],
+            headers={
+                "ETag": etag,
+                "Content-Range": f"bytes {start}-{end}/{len(PAYLOAD)}",
+            },
+        )
+
+    return handler
+
+
+def test_download(tmp_path):
+    requests = []
+    client = httpx.Client(transport=httpx.MockTransport(_range_handler(requests)))
+    output = download.download(client, "http://test/file", tmp_path / "file")
+    assert output.read_bytes() == PAYLOAD
+    assert not (tmp_path / "file.part").exists()
+    assert not (tmp_path / "file.part.json").exists()
+    assert requests[0].headers["Accept-Encoding"] == "identity"
+
+
+def test_download_resume(tmp_path):
+    requests = []
+    client = httpx.Client(transport=httpx.MockTransport(_range_handler(requests)))
+    (tmp_path / "file.part").write_bytes(PAYLOAD[:1000])
+    (tmp_path / "file.part.json").write_text(
+        '{"url": "http://test/file", "validator": "\\"v1\\""}'
+    )
+    received = []
+    download.download(
+        client, "http://test/file", tmp_path / "file", progress=received.append
+    )
+    assert (tmp_path / "file").read_bytes() == PAYLOAD
+    assert requests[0].headers["Range"] == "bytes=1000-"
+    assert requests[0].headers["If-Range"] == '"v1"'
+    assert sum(received) == len(PAYLOAD)
+
+
+def test_download_resume_changed(tmp_path):
+    requests = []
+    client = httpx.Client(
+        transport=httpx.MockTransport(_range_handler(requests, etag='"v2"'))
+    )
+    (tmp_path / "file.part").write_bytes(b"x" * 1000)
+    (tmp_path / "file.part.json").write_text(
+        '{"url": "http://test/file", "validator": "\\"v1\\""}'
+    )
+    download.download(client, "http://test/file", tmp_path / "file")
+    assert (tmp_path / "file").read_bytes() == PAYLOAD
+
+
+def test_download_resume_range_mismatch(tmp_path):
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if "Range" not in request.headers:
+            return httpx.Response(200, content=PAYLOAD)
+        # 忽略请求的起始位置, 总是从头返回
+        headers = {"Content-Range": f"bytes 0-{len(PAYLOAD) - 1}/{len(PAYLOAD)}"}
+        return httpx.Response(206, content=PAYLOAD, headers=headers)
+
+    client = httpx.Client(transport=httpx.MockTransport(handler))
+    (tmp_path / "file.part").write_bytes(PAYLOAD[:1000])
+    download.download(client, "http://test/file", tmp_path / "file")
+    assert (tmp_path / "file").read_bytes() == PAYLOAD
+    assert "Range" not in requests[1].headers
+
+
+def test_part_state_periodic_save(tmp_path, monkeypatch):
+    monkeypatch.setattr(download, "SAVE_BYTES", 100)
+    path = tmp_path / "file.part.json"
+    state = download._PartState(path, "http://test/file", 1000, None)
+    state.split(2, 100)
+    state.advance(0, 50)
+    state.advance(1, 60)
+    loaded = download._PartState(path, "http://test/file", 1000, None)
+    assert loaded.load()
+    assert loaded.parts == [[0, 499, 50], [500, 999, 60]]
+
+
+def test_download_parallel(tmp_path):
+    requests = []
+    client = httpx.Client(transport=httpx.MockTransport(_range_handler(requests)))
+    received = []
+    download.download(
+        client,
+        "http://test/file",
+        tmp_path / "file",
+        parallel=4,
+        min_part_size=1024,
+        progress=received.append,
+    )
+    assert (tmp_path / "file").read_bytes() == PAYLOAD
+    # 1 个探测请求 + 4 个分段请求
+    assert len(requests) == 5
+    assert sum(received) == len(PAYLOAD)
+
+
+def test_download_parallel_resume(tmp_path):
+    requests = []
+    client = httpx.Client(transport=httpx.MockTransport(_range_handler(requests)))
+    size = len(PAYLOAD)
+    part = tmp_path / "file.part"
+    part.write_bytes(PAYLOAD[:4096] + b"\0" * (size - 4096))
+    state = download._PartState(
+        tmp_path / "file.part.json", "http://test/file", size, '"v1"'
+    )
+    state.parts = [[0, 8191, 4096], [8192, size - 1, 0]]
+    state.save()
+    download.download(
+        client, "http://test/file", tmp_path / "file", parallel=2, min_part_size=1024
+    )
+    assert (tmp_path / "file").read_bytes() == PAYLOAD
+    ranges = sorted(r.headers["Range"] for r in requests[1:])
+    assert ranges == ["bytes=4096-8191", f"bytes=8192-{size - 1}"]
+
+
+def test_download_parallel_fallback(tmp_path):
+    requests = []
+    client = httpx.Client(
+        transport=httpx.MockTransport(_range_handler(requests, ranges=False))
+    )
+    download.download(
+        client, "http://test/file", tmp_path / "file", parallel=4, min_part_size=1024
+    )
+    assert (tmp_path / "file").read_bytes() == PAYLOAD
+    assert len(requests) == 2
+
+
+def test_download_error(tmp_path):
+    client = httpx.Client(transport=httpx.MockTransport(lambda r: httpx.Response(404)))
+    with pytest.raises(httpx.HTTPStatusError):
+        download.download(client, "http://test/file", tmp_path / "file")
+    assert not (tmp_path / "file").exists()
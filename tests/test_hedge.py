@@ -0,0 +1,109 @@
+import asyncio
+from concurrent import futures
+import threading
+import time
+
+import pytest
+
+from pypaladin import hedge
+
+
+def _slow(value, delay: float, calls: list):
+    def call():
+        calls.append(value)
+        time.sleep(delay)
+        return value
+
+    return call
+
+
+def _fail(calls: list):
+    def call():
+        calls.append("fail")
+        raise IOError("unavailable")
+
+    return call
+
+
+def test_race_primary_wins():
+    calls = []
+    result = hedge.race([_slow("a", 0, calls), _slow("b", 0, calls)], hedge_delay=0.2)
+    assert result == "a"
+    assert calls == ["a"]
+
+
+def test_race_hedged():
+    calls = []
+    started = time.monotonic()
+    result = hedge.race(
+        [_slow("a", 1, calls), _slow("b", 0.05, calls)], hedge_delay=0.05
+    )
+    assert result == "b"
+    assert calls == ["a", "b"]
+    assert time.monotonic() - started < 0.5
+
+
+def test_race_failure_starts_backup():
+    calls = []
+    started = time.monotonic()
+    assert hedge.race([_fail(calls), _slow("b", 0, calls)], hedge_delay=5) == "b"
+    assert time.monotonic() - started < 1
+
+
+def test_race_all_failed():
+    with pytest.raises(IOError, match="all 2 calls failed"):
+        hedge.race([_fail([]), _fail([])], hedge_delay=0)
+
+
+def test_race_timeout():
+    with pytest.raises(TimeoutError):
+        hedge.race([_slow("a", 1, [])], timeout=0.05)
+
+
+def test_async_race():
+    cancelled = []
+
+    async def slow():
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+        return "a"
+
+    async def fast():
+        await asyncio.sleep(0.01)
+        return "b"
+
+    async def main():
+        result = await hedge.async_race([slow, fast], hedge_delay=0.02)
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(main()) == "b"
+    assert cancelled == [True]
+
+
+def test_race_shared_executor():
+    calls = []
+    executor = hedge.get_executor()
+    for _ in range(3):
+        hedge.race([_slow("a", 0, calls), _slow("b", 0, calls)], hedge_delay=0.2)
+    assert hedge.get_executor() is executor
+    assert executor._max_workers == hedge.DEFAULT_MAX_WORKERS
+
+
+def test_race_cancels_queued_calls():
+    calls = []
+    release = threading.Event()
+    with futures.ThreadPoolExecutor(max_workers=1) as executor:
+        executor.submit(release.wait)
+        with pytest.raises(TimeoutError):
+            hedge.race(
+                [_slow("a", 0, calls), _slow("b", 0, calls)],
+                hedge_delay=0,
+                timeout=0.05,
+                executor=executor,
+            )
+        release.set()
+    assert calls == []
@@ -0,0 +1,122 @@
+import asyncio
+
+import httpx
+
+from pypaladin import httpcache
+
+
+def _counting_transport(headers: dict, calls: list):
+    def handler(request: httpx.Request):
+        calls.append(request)
+        etag = headers.get("ETag")
+        if etag and request.headers.get("If-None-Match") == etag:
+            return httpx.Response(304, headers=headers)
+        return httpx.Response(200, headers=headers, content=b"hello")
+
+    return httpx.MockTransport(handler)
+
+
+def test_cache_max_age():
+    calls = []
+    transport = httpcache.CacheTransport(
+        _counting_transport({"Cache-Control": "max-age=60"}, calls),
+        httpcache.MemoryCacheStorage(1024),
+    )
+    with httpx.Client(transport=transport) as client:
+        assert client.get("http://example.com/a").text == "hello"
+        resp = client.get("http://example.com/a")
+        assert resp.text == "hello"
+        assert resp.extensions.get("from_cache")
+        client.get("http://example.com/a", headers={"Cache-Control": "no-cache"})
+    assert len(calls) == 2
+
+
+def test_cache_revalidate_etag(tmp_path):
+    calls = []
+    transport = httpcache.CacheTransport(
+        _counting_transport({"Cache-Control": "no-cache", "ETag": '"v1"'}, calls),
+        httpcache.FileCacheStorage(str(tmp_path), 1024),
+    )
+    with httpx.Client(transport=transport) as client:
+        assert client.get("http://example.com/a").text == "hello"
+        resp = client.get("http://example.com/a")
+    assert resp.status_code == 200
+    assert resp.text == "hello"
+    assert calls[1].headers["If-None-Match"] == '"v1"'
+
+
+def test_cache_eviction_async():
+    calls = []
+    storage = httpcache.MemoryCacheStorage(8)
+    transport = httpcache.AsyncCacheTransport(
+        _counting_transport({"Cache-Control": "max-age=60"}, calls), storage
+    )
+
+    async def _run():
+        async with httpx.AsyncClient(transport=transport) as client:
+            await client.get("http://example.com/a")
+            await client.get("http://example.com/b")
+            await client.get("http://example.com/a")
+
+    asyncio.run(_run())
+    # 8 字节只能容纳一个 5 字节的响应, 写入 /b 时 /a 被淘汰
+    assert len(calls) == 3
+    assert storage.get("GET http://example.com/a") is not None
+    assert storage.get("GET http://example.com/b") is None
+
+
+class _ChunkStream(httpx.SyncByteStream):
+    def __init__(self, chunks: list):
+        self.chunks = chunks
+
+    def __iter__(self):
+        yield from self.chunks
+
+
+def test_cache_streamed_entry_size():
+    calls = []
+
+    def handler(request: httpx.Request):
+        calls.append(request)
+        chunks = [b"x" * 4] * (3 if request.url.path == "/small" else 10)
+        headers = {"Cache-Control": "max-age=60"}
+        return httpx.Response(200, headers=headers, stream=_ChunkStream(chunks))
+
+    transport = httpcache.CacheTransport(
+        httpx.MockTransport(handler),
+        httpcache.MemoryCacheStorage(1024),
+        max_entry_size=16,
+    )
+    with httpx.Client(transport=transport) as client:
+        for _ in range(2):
+            assert len(client.get("http://example.com/small").content) == 12
+            assert len(client.get("http://example.com/large").content) == 40
+    # 超过 max_entry_size 的响应不缓存, 但内容完整返回
+    assert [x.url.path for x in calls] == ["/small", "/large", "/large"]
+
+
+def test_cache_bypass_range():
+    calls = []
+    transport = httpcache.CacheTransport(
+        _counting_transport({"Cache-Control": "max-age=60"}, calls),
+        httpcache.MemoryCacheStorage(1024),
+    )
+    with httpx.Client(transport=transport) as client:
+        client.get("http://example.com/a")
+        client.get("http://example.com/a", headers={"Range": "bytes=0-1"})
+        client.get("http://example.com/a", headers={"If-Range": '"v1"'})
+        client.get("http://example.com/a")
+    assert len(calls) == 3
+
+
+def test_cache_vary_missing_header():
+    calls = []
+    transport = httpcache.CacheTransport(
+        _counting_transport({"Cache-Control": "max-age=60", "Vary": "Origin"}, calls),
+        httpcache.MemoryCacheStorage(1024),
+    )
+    with httpx.Client(transport=transport) as client:
+        for _ in range(3):
+            client.get("http://example.com/a")
+        client.get("http://example.com/a", headers={"Origin": "http://b.example"})
+    assert len(calls) == 2
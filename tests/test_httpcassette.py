@@ -0,0 +1,97 @@
+import httpx
+import pytest
+
+from pypaladin import httpcassette, httpclient
+
+
+def _handler(request: httpx.Request) -> httpx.Response:
+    if request.method == "POST":
+        return httpx.Response(200, json={"form": request.content.decode()})
+    return httpx.Response(
+        200, json={"n": _handler.calls, "path": request.url.path}, headers={"X-A": "1"}
+    )
+
+
+_handler.calls = 0
+
+
+def _record(tmp_path) -> httpcassette.Cassette:
+    _handler.calls = 0
+    cassette = httpcassette.Cassette(tmp_path / "c.jsonl.gz", ignore_params=["sig"])
+
+    def handler(request):
+        _handler.calls += 1
+        return _handler(request)
+
+    transport = httpcassette.RecordTransport(httpx.MockTransport(handler), cassette)
+    with httpx.Client(base_url="https://api.test", transport=transport) as client:
+        assert client.get("/a", params={"x": "1", "sig": "s1"}).json()["n"] == 1
+        client.get("/a", params={"x": "1", "sig": "s2"})
+        client.post("/b", content=b"ip=1.1.1.1")
+        client.post("/b", content=b"ip=2.2.2.2")
+    return cassette
+
+
+def test_record_replay(tmp_path):
+    _record(tmp_path)
+    cassette = httpcassette.Cassette.load(tmp_path / "c.jsonl.gz", ["sig"])
+    assert len(cassette) == 4
+    client = httpx.Client(
+        base_url="https://api.test", transport=httpcassette.ReplayTransport(cassette)
+    )
+    # 忽略 sig, 相同的请求按录制顺序轮流返回
+    assert client.get("/a?sig=x&x=1").json()["n"] == 1
+    assert client.get("/a?x=1").json()["n"] == 2
+    resp = client.get("/a?x=1")
+    assert resp.json()["n"] == 1
+    assert resp.headers["X-A"] == "1"
+    assert resp.extensions["from_cassette"]
+    assert client.post("/b", content=b"ip=2.2.2.2").json() == {"form": "ip=2.2.2.2"}
+    with pytest.raises(httpcassette.CassetteMissError):
+        client.get("/a?x=2")
+
+
+def test_default_client_replay(tmp_path, monkeypatch):
+    _record(tmp_path)
+    monkeypatch.setattr(
+        httpclient,
+        "_DEFAULT_CONF",
+        httpclient.HTTPClientConfig(
+            cassette=httpcassette.CassetteConfig(
+                mode="replay", path=str(tmp_path / "c.jsonl.gz")
+            )
+        ),
+    )
+    with httpclient.default_client(base_url="https://api.test") as client:
+        assert client.get("/a", params={"x": "1"}).json()["path"] == "/a"
+
+
+def test_server(tmp_path, monkeypatch):
+    _record(tmp_path)
+    cassette = httpcassette.Cassette.load(tmp_path / "c.jsonl.gz", ["sig"])
+    with httpcassette.CassetteServer(cassette, latency=0.01) as server:
+        monkeypatch.setattr(
+            httpclient,
+            "_DEFAULT_CONF",
+            httpclient.HTTPClientConfig(
+                cassette=httpcassette.CassetteConfig(mode="replay", server=server.url)
+            ),
+        )
+        with httpclient.default_client(base_url="https://api.test") as client:
+            resp = client.get("/a", params={"x": "1", "sig": "zzz"})
+            assert resp.json()["path"] == "/a"
+            assert resp.headers["X-A"] == "1"
+            resp = client.post("/b", content=b"ip=1.1.1.1")
+            assert resp.json() == {"form": "ip=1.1.1.1"}
+            assert client.get("/missing").status_code == 404
+        assert server.stats["requests"] == 3
+        assert server.stats["misses"] == 1
+
+
+def test_server_error_injection(tmp_path):
+    _record(tmp_path)
+    cassette = httpcassette.Cassette.load(tmp_path / "c.jsonl.gz")
+    with httpcassette.CassetteServer(cassette, error_rate=1) as server:
+        resp = httpx.get(f"{server.url}/a?x=1", headers={"Host": "api.test"})
+        assert resp.status_code == 503
+        assert server.stats["errors"] == 1
@@ -1,6 +1,195 @@
+import asyncio
+import sys
+
+import httpx
+from loguru import logger
+import pytest
+
 from pypaladin import httpclient
 
 
 def test_httpclient():
     client = httpclient.default_client(timeout=10, raise_for_status=True)
     client.get("https://www.baidu.com/")
+
+
+def test_async_httpclient(local_url):
+    async def _run():
+        async with httpclient.default_async_client(base_url=local_url) as client:
+            resp = await client.get("/foo")
+            assert resp.json() == {"path": "/foo"}
+
+    asyncio.run(_run())
+
+
+def test_async_httpclient_raise_for_status(local_url):
+    async def _run():
+        async with httpclient.default_async_client(
+            base_url=local_url, raise_for_status=True
+        ) as client:
+            with pytest.raises(httpx.HTTPStatusError):
+                await client.get("/status/500")
+
+    asyncio.run(_run())
+
+
+def test_shared_client():
+    client = httpclient.shared_client(base_url="http://example.invalid")
+    assert client is httpclient.shared_client(base_url="http://example.invalid")
+    assert client is not httpclient.shared_client(base_url="http://other.invalid")
+    httpclient.close_shared_clients()
+    assert client.is_closed
+    assert httpclient.shared_client(base_url="http://example.invalid") is not client
+
+
+def test_shared_client_config_change(monkeypatch):
+    client = httpclient.shared_client(base_url="http://example.invalid")
+    monkeypatch.setattr(
+        httpclient, "_DEFAULT_CONF", httpclient.HTTPClientConfig(timeout=1)
+    )
+    assert httpclient.shared_client(base_url="http://example.invalid") is not client
+
+
+def test_shared_async_client(local_url):
+    async def _run():
+        client = httpclient.shared_async_client(base_url=local_url)
+        assert client is httpclient.shared_async_client(base_url=local_url)
+        resp = await client.get("/bar")
+        assert resp.json() == {"path": "/bar"}
+        return client
+
+    client = asyncio.run(_run())
+    assert client is not asyncio.run(_run())
+
+
+def test_shared_async_client_close(local_url):
+    async def _run(close: bool):
+        client = httpclient.shared_async_client(base_url=local_url)
+        await client.get("/bar")
+        if close:
+            await httpclient.aclose_shared_clients()
+        return client
+
+    assert asyncio.run(_run(close=True)).is_closed
+    # 事件循环已结束的客户端无法关闭, 只从注册表中移除
+    registry = httpclient._REGISTRY
+    asyncio.run(_run(close=False))
+    registry.close()
+    assert not registry._async_clients
+
+
+def test_log_response_detail_preview(local_url):
+    records = []
+    handler_id = logger.add(
+        records.append,
+        level="TRACE",
+        format="{message}",
+        filter=lambda r: r["level"].name == "TRACE",
+    )
+    try:
+        with httpclient.default_client(base_url=local_url) as client:
+            with client.stream("GET", "/" + "x" * 100) as resp:
+                assert not records
+                assert resp.read()
+    finally:
+        logger.remove(handler_id)
+    assert len(records) == 1
+    assert "x" * 100 in records[0]
+
+
+def test_log_response_detail_lazy(local_url, monkeypatch):
+    calls = []
+    monkeypatch.setattr(
+        httpclient._BodyPreview, "content", lambda self: calls.append(self) or ""
+    )
+    with httpclient.default_client(base_url=local_url) as client:
+        assert client.get("/foo").json() == {"path": "/foo"}
+    # 没有接收 TRACE 的 sink 时不解码、不格式化响应内容
+    assert not calls
+
+
+def test_log_response_detail_truncated(local_url, monkeypatch):
+    monkeypatch.setattr(
+        httpclient,
+        "_DEFAULT_CONF",
+        httpclient.HTTPClientConfig(log_response_detail_max_bytes=10),
+    )
+    records = []
+    handler_id = logger.add(
+        records.append,
+        level="TRACE",
+        format="{message}",
+        filter=lambda r: r["level"].name == "TRACE",
+    )
+    try:
+        with httpclient.default_client(base_url=local_url) as client:
+            resp = client.get("/" + "x" * 100)
+    finally:
+        logger.remove(handler_id)
+    assert resp.json() == {"path": "/" + "x" * 100}
+    body = records[0].split("-.-.-.-")[-1].strip().split("\n\n", 1)[-1]
+    assert body.startswith('{"path": "')
+    assert "truncated, 113 bytes received" in body
+
+
+def test_fetch_many(local_url):
+    specs = [f"/{i}" for i in range(20)] + [{"url": "/status/500"}]
+    results = list(
+        httpclient.fetch_many(
+            specs, base_url=local_url, concurrency=4, raise_for_status=True
+        )
+    )
+    assert [x.index for x in results] == list(range(21))
+    assert [x.response.json()["path"] for x in results[:-1]] == specs[:-1]
+    assert isinstance(results[-1].error, httpx.HTTPStatusError)
+
+
+def test_gather_requests(local_url):
+    async def _run():
+        return [
+            x
+            async for x in httpclient.gather_requests(
+                [f"/{i}" for i in range(20)],
+                base_url=local_url,
+                concurrency=4,
+                ordered=False,
+            )
+        ]
+
+    results = asyncio.run(_run())
+    assert sorted(x.index for x in results) == list(range(20))
+    assert all(x.ok for x in results)
+
+
+def test_gather_requests_cancel():
+    async def _handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path != "/0":
+            await asyncio.sleep(10)
+        return httpx.Response(200)
+
+    async def _run():
+        client = httpx.AsyncClient(transport=httpx.MockTransport(_handler))
+        results = httpclient.gather_requests(
+            [f"http://test/{i}" for i in range(20)], concurrency=4, client=client
+        )
+        async for _ in results:
+            break
+        await results.aclose()
+        return asyncio.all_tasks() - {asyncio.current_task()}
+
+    # 提前结束时未完成的请求被取消并等待结束
+    assert not asyncio.run(_run())
+
+
+def test_http2_client_fallback(local_url):
+    # 明文 HTTP 无法通过 ALPN 协商 h2, 回退到 HTTP/1.1
+    with httpclient.default_client(base_url=local_url, http2=True) as client:
+        resp = client.get("/h2")
+    assert resp.http_version == "HTTP/1.1"
+    assert resp.json() == {"path": "/h2"}
+
+
+def test_http2_missing_h2(monkeypatch):
+    monkeypatch.setitem(sys.modules, "h2", None)
+    with pytest.raises(ImportError, match=r"pypaladin\[http2\]"):
+        httpclient.default_client(http2=True)
@@ -0,0 +1,81 @@
+import asyncio
+
+import httpx
+import pytest
+
+from pypaladin import httpretry
+
+_NO_WAIT = httpretry.RetryConfig(backoff_factor=0, jitter=False)
+
+
+def _sequence_transport(responses: list, calls: list):
+    def handler(request: httpx.Request):
+        calls.append(request)
+        item = responses.pop(0)
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    return httpx.MockTransport(handler)
+
+
+def test_retry_on_status_and_retry_after():
+    calls = []
+    transport = httpretry.RetryTransport(
+        _sequence_transport(
+            [
+                httpx.Response(503),
+                httpx.Response(429, headers={"Retry-After": "0"}),
+                httpx.Response(200),
+            ],
+            calls,
+        ),
+        httpretry.RetryPolicy(3, _NO_WAIT),
+    )
+    with httpx.Client(transport=transport) as client:
+        assert client.get("http://example.com/").status_code == 200
+    assert len(calls) == 3
+
+
+def test_retry_not_idempotent():
+    calls = []
+    transport = httpretry.RetryTransport(
+        _sequence_transport(
+            [httpx.ConnectError("refused"), httpx.Response(503), httpx.Response(200)],
+            calls,
+        ),
+        httpretry.RetryPolicy(3, _NO_WAIT),
+    )
+    with httpx.Client(transport=transport) as client:
+        # 连接失败可以重试, POST 的 503 不能重试
+        assert client.post("http://example.com/").status_code == 503
+    assert len(calls) == 2
+
+
+def test_retry_after_too_long():
+    policy = httpretry.RetryPolicy(3, httpretry.RetryConfig(retry_after_max=10))
+    request = httpx.Request("GET", "http://example.com/")
+    response = httpx.Response(503, headers={"Retry-After": "120"})
+    assert policy.retry_delay(request, response, 0) is None
+    assert policy.retry_delay(request, httpx.Response(503), 3) is None
+
+
+def test_circuit_breaker():
+    calls = []
+    transport = httpretry.AsyncRetryTransport(
+        _sequence_transport([httpx.Response(500), httpx.Response(500)], calls),
+        httpretry.RetryPolicy(0, _NO_WAIT),
+        httpretry.CircuitBreakerConfig(
+            enabled=True, failure_threshold=2, recovery_timeout=60
+        ),
+    )
+
+    async def _run():
+        async with httpx.AsyncClient(transport=transport) as client:
+            for _ in range(2):
+                await client.get("http://breaker.example.com/")
+            with pytest.raises(httpretry.CircuitOpenError):
+                await client.get("http://breaker.example.com/")
+
+    asyncio.run(_run())
+    assert len(calls) == 2
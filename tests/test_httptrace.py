@@ -0,0 +1,40 @@
+from pypaladin import context, httpclient, httptrace
+
+
+def test_request_timings(local_url):
+    records = []
+    httptrace.add_listener(records.append)
+    context.set_trace("trace-timings")
+    try:
+        with httpclient.default_client(base_url=local_url) as client:
+            client.get("/foo")
+            client.get("/bar")
+    finally:
+        httptrace.remove_listener(records.append)
+        context.set_trace(None)
+
+    assert len(records) == 2
+    first, second = records
+    assert first.trace == "trace-timings"
+    assert first.status_code == 200
+    assert first.http_version == "HTTP/1.1"
+    assert first.dns is None and first.connect is not None
+    assert first.ttfb is not None and first.body_read is not None
+    assert first.total >= first.ttfb
+    assert second.reused_connection
+
+
+def test_request_timings_dns(local_url, monkeypatch):
+    monkeypatch.setattr(
+        httpclient,
+        "_DEFAULT_CONF",
+        httpclient._DEFAULT_CONF.model_copy(update={"trace_dns": True}),
+    )
+    records = []
+    httptrace.add_listener(records.append)
+    try:
+        with httpclient.default_client(base_url=local_url) as client:
+            client.get("/foo")
+    finally:
+        httptrace.remove_listener(records.append)
+    assert records[0].dns is not None and records[0].connect is not None
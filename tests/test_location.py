@@ -0,0 +1,118 @@
+import httpx
+import pytest
+
+from pypaladin_map import location
+
+
+class _FakeApi:
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.calls = []
+
+    def get_location(self, ipaddr) -> location.Location:
+        self.calls.append(ipaddr)
+        if ipaddr in self.fail:
+            raise httpx.ConnectError("unreachable")
+        return location.Location(ip=ipaddr, country="中国")
+
+
+def test_extract_ips():
+    lines = [
+        '1.1.1.1 - - [17/Oct/2026] "GET / HTTP/1.1" 200',
+        '1.1.1.1 - - [17/Oct/2026] "GET /a HTTP/1.1" 200',
+        "client=2.2.2.2 upstream=10.0.0.1",
+        "999.1.1.1 invalid",
+        "no ip",
+    ]
+    assert list(location.extract_ips(lines)) == ["1.1.1.1", "2.2.2.2"]
+    assert list(location.extract_ips(["a 3.3.3.3 4.4.4.4"], column=3)) == ["4.4.4.4"]
+
+
+def test_get_location_fallback():
+    first, second = _FakeApi(fail=["1.1.1.1"]), _FakeApi()
+    assert location.get_location("1.1.1.1", [first, second]).ip == "1.1.1.1"
+    assert second.calls == ["1.1.1.1"]
+
+
+def test_locate_many():
+    first, second = _FakeApi(fail=["3.3.3.3"]), _FakeApi(fail=["3.3.3.3"])
+    ips = [f"1.1.1.{i}" for i in range(50)] + ["3.3.3.3"]
+    results = {
+        ip: (loc, error)
+        for ip, loc, error in location.locate_many(ips, [first, second], concurrency=4)
+    }
+    assert len(results) == 51
+    assert results["1.1.1.7"][0].country == "中国"
+    assert results["3.3.3.3"][0] is None
+    assert isinstance(results["3.3.3.3"][1], IOError)
+    assert len(second.calls) == 1
+
+
+def test_locate_many_error_body():
+    def handler(request: httpx.Request) -> httpx.Response:
+        ip = request.url.params["ip"]
+        if ip == "5.5.5.1":
+            return httpx.Response(429, json={"status": 0, "msg": "too many requests"})
+        if ip == "5.5.5.2":
+            return httpx.Response(200, json={"status": 0, "msg": "invalid key"})
+        return httpx.Response(200, json={"status": 1, "data": {"ip": ip}})
+
+    api = location.UUToolApi()
+    api.client = httpx.Client(
+        base_url="https://uutool.test", transport=httpx.MockTransport(handler)
+    )
+    ips = ["5.5.5.1", "5.5.5.2", "5.5.5.3"]
+    results = {ip: (loc, error) for ip, loc, error in location.locate_many(ips, [api])}
+    assert results["5.5.5.3"][0].ip == "5.5.5.3"
+    assert results["5.5.5.1"][0] is None and results["5.5.5.1"][1] is not None
+    assert results["5.5.5.2"][0] is None and results["5.5.5.2"][1] is not None
+
+
+CSV = """start,end,country,province,city,isp
+1.0.1.0,1.0.3.255,中国,福建,福州,电信
+16777216,16777471,澳大利亚,,,
+1.0.8.0,1.0.15.255,中国,广东,广州,电信
+"""
+
+
+def test_offline_db(tmp_path):
+    (tmp_path / "ip.csv").write_text(CSV, encoding="utf-8")
+    db = location.OfflineIPDatabase.compile_csv(tmp_path / "ip.csv", tmp_path / "db")
+    assert len(db) == 3
+    assert db.lookup("1.0.0.1").country == "澳大利亚"
+    found = db.lookup("1.0.2.3")
+    assert (found.ip, found.ip_int, found.city, found.isp) == (
+        "1.0.2.3",
+        16777731,
+        "福州",
+        "电信",
+    )
+    assert db.lookup("1.0.15.255").city == "广州"
+    assert db.lookup("1.0.4.0") is None
+    assert db.lookup("0.0.0.1") is None
+    assert db.lookup("8.8.8.8") is None
+
+
+def test_offline_db_fallback(tmp_path):
+    (tmp_path / "ip.csv").write_text(CSV, encoding="utf-8")
+    db = location.OfflineIPDatabase.compile_csv(tmp_path / "ip.csv", tmp_path / "db")
+    remote = _FakeApi()
+    assert location.get_location("1.0.2.3", [db, remote]).city == "福州"
+    assert location.get_location("8.8.8.8", [db, remote]).country == "中国"
+    assert remote.calls == ["8.8.8.8"]
+
+
+def test_offline_db_overlap(tmp_path):
+    rows = [
+        {"start": "1.0.0.0", "end": "1.0.0.255"},
+        {"start": "1.0.0.128", "end": "1.0.1.0"},
+    ]
+    with pytest.raises(ValueError):
+        location.OfflineIPDatabase.compile(rows, tmp_path / "db")
+
+
+def test_offline_db_without_fields(tmp_path):
+    rows = [{"start": "1.0.0.0", "end": "1.0.0.255"}]
+    db = location.OfflineIPDatabase.compile(rows, tmp_path / "db")
+    assert db.fields == []
+    assert db.lookup("1.0.0.1").ip == "1.0.0.1"
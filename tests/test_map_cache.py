@@ -0,0 +1,121 @@
+import asyncio
+
+import pytest
+
+from pypaladin_map import cache
+
+
+class _Api:
+    def __init__(self):
+        self.calls = 0
+
+    @cache.cached("test.lookup", ttl=60)
+    def lookup(self, name: str, adm=None):
+        self.calls += 1
+        return [name, adm]
+
+    @cache.cached("test.lookup", ttl=60)
+    async def async_lookup(self, name: str, adm=None):
+        self.calls += 1
+        return [name, adm]
+
+    @cache.cached("test.dynamic", ttl=lambda value: value)
+    def dynamic(self, ttl: float):
+        self.calls += 1
+        return ttl
+
+    @cache.cached("test.short", ttl=0.05, key=lambda x: x["id"])
+    def short(self, x: dict):
+        self.calls += 1
+        return x["id"]
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def map_cache(request, tmp_path):
+    cache.setup(
+        cache.MapCacheConfig(
+            backend=request.param, path=str(tmp_path / "cache.db"), max_size=2
+        )
+    )
+    yield cache.get_cache()
+    cache.setup(cache.MapCacheConfig())
+
+
+def test_cached_shared_between_instances(map_cache):
+    api1, api2 = _Api(), _Api()
+    assert api1.lookup("北京") == ["北京", None]
+    assert api2.lookup("北京") == ["北京", None]
+    assert api1.lookup("北京", adm="x") == ["北京", "x"]
+    assert (api1.calls, api2.calls) == (2, 0)
+    assert asyncio.run(api2.async_lookup("北京")) == ["北京", None]
+    assert api2.calls == 0
+    stats = cache.stats()["test.lookup"]
+    assert (stats.hits, stats.misses) == (2, 2)
+
+
+def test_cached_ttl(map_cache):
+    api = _Api()
+    assert api.short({"id": 1, "v": "a"}) == 1
+    assert api.short({"id": 1, "v": "b"}) == 1
+    assert api.calls == 1
+    asyncio.run(asyncio.sleep(0.06))
+    api.short({"id": 1})
+    assert api.calls == 2
+
+
+def test_cached_lru_eviction(map_cache):
+    api = _Api()
+    api.lookup("a")
+    api.lookup("b")
+    api.lookup("a")
+    api.lookup("c")
+    assert cache.stats()["test.lookup"].evictions == 1
+    api.lookup("a")
+    assert api.calls == 3
+    api.lookup("b")
+    assert api.calls == 4
+
+
+def test_cached_disabled(map_cache):
+    cache.setup(cache.MapCacheConfig(ttls={"test.lookup": 0}))
+    api = _Api()
+    api.lookup("a")
+    api.lookup("a")
+    assert api.calls == 2
+
+
+def test_cached_dynamic_ttl(map_cache):
+    api = _Api()
+    api.dynamic(0)
+    api.dynamic(0)
+    assert api.calls == 2
+    api.dynamic(60)
+    api.dynamic(60)
+    assert api.calls == 3
+
+
+class _AccountApi(_Api):
+    def __init__(self, account: str):
+        super().__init__()
+        self.cache_identity = account
+
+    @cache.cached("test.items", ttl=60)
+    def items(self, n: int):
+        self.calls += 1
+        return [{"n": i} for i in range(n)]
+
+
+def test_cached_per_identity(map_cache):
+    api1, api2 = _AccountApi("a"), _AccountApi("b")
+    api1.items(1)
+    api2.items(1)
+    assert (api1.calls, api2.calls) == (1, 1)
+    api1.items(0)
+    api1.items(0)
+    assert api1.calls == 3
+
+
+def test_cached_returns_copy(map_cache):
+    api = _AccountApi("a")
+    api.items(2)[0]["n"] = 100
+    assert api.items(2) == [{"n": 0}, {"n": 1}]
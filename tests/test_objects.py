@@ -1,10 +1,12 @@
 from typing import Optional
 # from sqlalchemy import Column, String
 
+import pytest
 from peewee import CharField
 
 from pypaladin_orm.objects import BaseObject
 from pypaladin_orm.dbmodel import BaseDBModel
+from pypaladin_orm.session import Session, get_session
 
 
 
@@ -41,3 +43,122 @@ def test_user():
     assert len(users) == 2
     assert users[0].name == "zzz"
     assert users[1].name == user2.name
+
+
+def test_bulk_create():
+    User.delete_all()
+
+    users = [User(name=f"user{i}") for i in range(2500)] + [User(name="")]
+    assert User.bulk_create(users, batch_size=1000) == 2501
+    assert all(user.id is not None for user in users)
+    assert not users[0]._field_modified_
+
+    queried = User.query()
+    assert len(queried) == 2501
+    assert [x.id for x in queried] == [x.id for x in users]
+    assert queried[10].name == "user10"
+
+    assert User.bulk_create([]) == 0
+    with pytest.raises(ValueError):
+        User.bulk_create([users[0]])
+
+
+def test_bulk_create_matches_ids_by_value():
+    User.delete_all()
+
+    users = [User(name=name) for name in ["b", "a", "b", "c"]]
+    User.bulk_create(users)
+    assert len({user.id for user in users}) == 4
+    names = {x.id: x.name for x in User.query()}
+    assert all(names[user.id] == user.name for user in users)
+
+
+def test_bulk_save():
+    User.delete_all()
+
+    users = [User(name=f"user{i}") for i in range(10)]
+    User.bulk_create(users)
+    for user in users[:6]:
+        user.name = f"{user.name}-new"
+    assert User.bulk_save(users, batch_size=4) == 6
+    assert not users[0]._field_modified_
+    assert User.bulk_save(users) == 0
+    assert [x.name for x in User.query()] == [
+        *[f"user{i}-new" for i in range(6)],
+        *[f"user{i}" for i in range(6, 10)],
+    ]
+
+
+def test_upsert():
+    User.delete_all()
+
+    users = [User(name=f"user{i}") for i in range(3)]
+    User.bulk_create(users)
+    users[1].name = "changed"
+    new_user = User(name="new")
+    assert User.upsert([users[1], new_user]) == 2
+    assert new_user.id is not None
+    assert [x.name for x in User.query()] == ["user0", "changed", "user2", "new"]
+
+
+def test_iter_query():
+    User.delete_all()
+
+    users = [User(name=f"user{i % 3}") for i in range(25)]
+    User.bulk_create(users)
+    queried = list(User.iter_query(batch_size=10))
+    assert [x.id for x in queried] == [x.id for x in users]
+    assert isinstance(queried[0], User)
+
+    rows = list(User.iter_query({"name": "user1"}, batch_size=3, rows="dicts"))
+    assert [x["id"] for x in rows] == [x.id for x in users[1::3]]
+    rows = list(User.iter_query(after_id=users[20].id, rows="tuples"))
+    assert rows == [(x.id, x.name) for x in users[21:]]
+
+
+class _Profile(BaseObject):
+    __dbmodel__ = UserDB
+
+    nickname: str = "anonymous"
+
+
+def test_from_rows():
+    rows = [(1, "foo"), (2, "bar")]
+    fast = list(User.from_rows(rows, ["id", "name"]))
+    assert fast == list(User.from_rows(rows, ["id", "name"], validate=True))
+    assert fast[0].model_fields_set == {"id", "name"}
+    fast[0].name = "baz"
+    assert fast[0]._get_changes() == {"name": "baz"}
+
+    profile = next(_Profile.from_rows(rows, ["id", "name"]))
+    assert (profile.id, profile.nickname) == (1, "anonymous")
+    assert not hasattr(profile, "name")
+
+
+def test_session():
+    User.delete_all()
+    User.bulk_create([User(name="foo"), User(name="bar")])
+
+    with Session(cache_size=2) as current:
+        foo = User.query({"name": "foo"})[0]
+        assert User.query({"name": "foo"})[0] is foo
+        assert User.query()[0] is foo
+        assert (current.hits, current.misses) == (1, 2)
+
+        foo.name = "zzz"
+        foo.save()
+        assert User.query({"name": "foo"}) == []
+        assert User.query({"name": "zzz"})[0] is foo
+
+        User.delete_by_values(name="bar")
+        assert [x.name for x in User.query()] == ["zzz"]
+        foo.delete()
+        assert User.query() == []
+
+        user = User(name="new")
+        user.create()
+        assert User.query() == [user]
+        assert User.query()[0] is user
+
+    assert get_session() is None
+    assert User.query()[0] is not user
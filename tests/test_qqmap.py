@@ -0,0 +1,77 @@
+import asyncio
+import hashlib
+from urllib import parse
+
+import httpx
+
+from pypaladin_map import location, qqmap
+
+
+def _verify(request: httpx.Request, secret: str = "secret") -> bool:
+    query = [(k, v) for k, v in request.url.params.multi_items() if k != "sig"]
+    raw = f"{request.url.path}?{parse.urlencode(query)}{secret}"
+    return request.url.params["sig"] == hashlib.md5(raw.encode()).hexdigest()
+
+
+def test_sign():
+    signer = qqmap.QQMapSigner("KEY", "secret")
+    params = {"type": "now", "adcode": 110101, "empty": None}
+    signed = signer.sign(qqmap.WEATHER_PATH, params)
+    assert list(signed) == ["adcode", "key", "type", "sig"]
+    raw = "/ws/weather/v1?adcode=110101&key=KEY&type=now" + "secret"
+    assert signed["sig"] == hashlib.md5(raw.encode()).hexdigest()
+    assert params == {"type": "now", "adcode": 110101, "empty": None}
+    assert signer.sign_many(qqmap.WEATHER_PATH, [params, params]) == [signed] * 2
+
+
+def _handler(request: httpx.Request) -> httpx.Response:
+    if not _verify(request):
+        return httpx.Response(200, json={"status": 111, "message": "签名验证失败"})
+    if request.url.path == qqmap.LOCATION_PATH:
+        ip = request.url.params["ip"]
+        if ip == "0.0.0.0":
+            return httpx.Response(500)
+        return httpx.Response(
+            200, json={"status": 0, "result": {"ip": ip, "ad_info": {"adcode": 1}}}
+        )
+    infos = {"weather": "晴", "temperature": 20}
+    realtime = [{"infos": infos, "update_time": ""}]
+    return httpx.Response(200, json={"status": 0, "result": {"realtime": realtime}})
+
+
+def _api(api_class):
+    api = api_class(key="KEY", signature="secret")
+    api.client = httpx.Client(
+        base_url=qqmap.BASE_URL,
+        transport=httpx.MockTransport(_handler),
+        event_hooks={"response": [lambda r: r.raise_for_status()]},
+    )
+    return api
+
+
+def test_get_location():
+    api = _api(qqmap.QQMapAPI)
+    assert api.get_location("1.1.1.1").ip == "1.1.1.1"
+    path, params = api._location_req("1.1.1.1")
+    assert "?" not in path and params["ip"] == "1.1.1.1"
+
+
+def test_get_locations():
+    api = _api(qqmap.QQMapAPI)
+    results = api.get_locations(["1.1.1.1", "0.0.0.0", "2.2.2.2"], concurrency=2)
+    assert [x[0] for x in results] == ["1.1.1.1", "0.0.0.0", "2.2.2.2"]
+    assert results[0][1].ip == "1.1.1.1"
+    assert isinstance(results[1][2], httpx.HTTPStatusError)
+    assert results[2][1].area_code == 1
+
+
+def test_async_get_weathers(monkeypatch):
+    api = qqmap.AsyncQQMapAPI(key="KEY", signature="secret")
+    client = httpx.AsyncClient(
+        base_url=qqmap.BASE_URL, transport=httpx.MockTransport(_handler)
+    )
+    cities = [location.Location(area_code=str(i)) for i in range(5)]
+    monkeypatch.setattr(qqmap.AsyncQQMapAPI, "client", client)
+    results = asyncio.run(api.get_weathers(cities, concurrency=2))
+    assert [x[0] for x in results] == cities
+    assert all(x[1].weather == "晴" for x in results)
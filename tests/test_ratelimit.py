@@ -0,0 +1,37 @@
+import asyncio
+import time
+
+import httpx
+
+from pypaladin import ratelimit
+
+
+def test_token_bucket():
+    bucket = ratelimit.TokenBucket(rate=20, burst=2)
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert 0.04 < bucket.reserve() <= 0.05
+    assert 0.09 < bucket.reserve() <= 0.1
+
+
+def test_rate_limit_transport_shared_by_host():
+    limits = {"https://api.example.com": ratelimit.RateLimitConfig(rate=20, burst=1)}
+    transport = httpx.MockTransport(lambda request: httpx.Response(200))
+    sync_client = httpx.Client(
+        transport=ratelimit.RateLimitTransport(transport, limits)
+    )
+    async_client = httpx.AsyncClient(
+        transport=ratelimit.AsyncRateLimitTransport(transport, limits)
+    )
+
+    async def _run():
+        for _ in range(2):
+            await async_client.get("https://api.example.com/")
+
+    started = time.monotonic()
+    for _ in range(2):
+        sync_client.get("https://api.example.com/")
+        sync_client.get("https://other.example.com/")
+    asyncio.run(_run())
+    # 4 个请求共享同一个令牌桶, 至少等待 3 * 50ms
+    assert time.monotonic() - started >= 0.14
@@ -0,0 +1,72 @@
+import random
+
+from pypaladin_map import location, spatial
+
+DISTRICTS = """area_code,province,city,district,latitude,longitude
+110101,北京市,北京市,东城区,39.928353,116.416357
+310101,上海市,上海市,黄浦区,31.231706,121.484443
+440106,广东省,广州市,天河区,23.124680,113.361200
+650102,新疆维吾尔自治区,乌鲁木齐市,天山区,43.793301,87.631676
+000000,,,,,
+"""
+
+
+def test_nearest(tmp_path):
+    (tmp_path / "districts.csv").write_text(DISTRICTS, encoding="utf-8")
+    index = spatial.NearestLocationIndex.from_csv(tmp_path / "districts.csv")
+    assert len(index) == 4
+    found, distance = index.nearest(39.9, 116.4)
+    assert found.district == "东城区"
+    assert distance < 5
+    found, _ = index.nearest(45.0, 90.0)
+    assert found.area_code == "650102"
+    results = index.reverse_geocode([31.2, 23.1], [121.5, 113.3])
+    assert [x.district for x, _ in results] == ["黄浦区", "天河区"]
+
+
+def test_nearest_matches_brute_force():
+    rand = random.Random(1)
+    locations = [
+        location.Location(
+            area_code=str(i),
+            latitude=str(rand.uniform(-89, 89)),
+            longitude=str(rand.uniform(-180, 180)),
+        )
+        for i in range(500)
+    ]
+    index = spatial.NearestLocationIndex(locations, cell_size=2)
+    for _ in range(200):
+        lat, lon = rand.uniform(-89, 89), rand.uniform(-180, 180)
+        i, distance = index.nearest_index(lat, lon)
+        expected = min(
+            spatial.haversine(lat, lon, float(x.latitude), float(x.longitude))
+            for x in locations
+        )
+        assert abs(distance - expected) < 1e-6
+
+
+def test_nearest_empty():
+    index = spatial.NearestLocationIndex([])
+    assert index.nearest(0, 0)[0] is None
+
+
+def test_nearest_far_from_data():
+    rand = random.Random(2)
+    locations = [
+        location.Location(
+            area_code=str(i),
+            latitude=str(rand.uniform(20, 50)),
+            longitude=str(rand.uniform(75, 135)),
+        )
+        for i in range(300)
+    ]
+    index = spatial.NearestLocationIndex(locations, cell_size=0.5)
+    queries = [(89.9, 0), (-89.9, 10), (-60, -120), (0, -70), (89.9, 116)]
+    queries += [(rand.uniform(-90, 90), rand.uniform(-180, 180)) for _ in range(50)]
+    for lat, lon in queries:
+        _, distance = index.nearest_index(lat, lon)
+        expected = min(
+            spatial.haversine(lat, lon, float(x.latitude), float(x.longitude))
+            for x in locations
+        )
+        assert abs(distance - expected) < 1e-6
@@ -0,0 +1,162 @@
+import asyncio
+from concurrent import futures
+from datetime import datetime, timedelta, timezone
+import time
+
+import httpx
+import jwt
+import pytest
+
+from pypaladin_map import cache, location, weather
+
+
+def _manager(**kwargs) -> weather.HefengTokenManager:
+    return weather.HefengTokenManager(
+        weather.DEFAULT_HEFENG_PROJECT_ID,
+        weather.DEFAULT_HEFENG_PRIVATE_KEY,
+        weather.DEFAULT_HEFENG_KID,
+        **kwargs,
+    )
+
+
+def test_token_cached():
+    manager = _manager()
+    token = manager.get_token()
+    assert manager.get_token() is token
+    payload = jwt.decode(token, options={"verify_signature": False})
+    assert payload["sub"] == weather.DEFAULT_HEFENG_PROJECT_ID
+    assert payload["exp"] - time.time() > 800
+
+
+def test_token_refresh_before_expiry(monkeypatch):
+    manager = _manager(ttl=100, refresh_margin=10)
+    token = manager.get_token()
+    now = time.time()
+    # 进入刷新窗口, 仍然有效
+    monkeypatch.setattr(time, "time", lambda: now + 95)
+    refreshed = manager.get_token()
+    assert refreshed != token
+    assert manager.get_token() is refreshed
+
+
+def test_token_refresh_does_not_block(monkeypatch):
+    manager = _manager(ttl=100, refresh_margin=10)
+    token = manager.get_token()
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 95)
+    # 其他线程正在刷新时直接返回仍然有效的旧 token
+    with manager._lock:
+        with futures.ThreadPoolExecutor(4) as executor:
+            tokens = list(executor.map(lambda _: manager.get_token(), range(4)))
+    assert tokens == [token] * 4
+
+
+def test_token_expired(monkeypatch):
+    manager = _manager(ttl=100, refresh_margin=10)
+    token = manager.get_token()
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 200)
+    assert manager.get_token() != token
+
+
+def test_async_token_expired_does_not_block_loop(monkeypatch):
+    manager = _manager(ttl=100, refresh_margin=10)
+    token = manager.get_token()
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 200)
+
+    async def _run():
+        task = asyncio.ensure_future(manager.aget_token())
+        # 其他线程正在签名时, 事件循环仍然可以运行其他协程
+        await asyncio.sleep(0.05)
+        assert not task.done()
+        manager._lock.release()
+        return await task
+
+    manager._lock.acquire()
+    assert asyncio.run(_run()) != token
+
+
+def test_token_manager_shared():
+    api1 = weather.HefengWeatherApi()
+    api2 = weather.AsyncHefengWeatherApi()
+    assert api1._tokens is api2._tokens
+
+
+def _weather(reporttime: str) -> weather.Weather:
+    return weather.Weather(
+        location=location.Location(area_code="101010100"),
+        weather="晴",
+        temperature=20,
+        winddirection="北风",
+        reporttime=reporttime,
+    )
+
+
+def test_weather_ttl():
+    now = datetime.now(timezone.utc)
+    assert 590 < weather.weather_ttl(_weather(now.isoformat())) <= 600
+    stale = (now - timedelta(minutes=30)).isoformat()
+    assert weather.weather_ttl(_weather(stale)) == 60
+    assert weather.weather_ttl(_weather("")) == 60
+
+
+def test_parse_city():
+    assert weather.parse_city("东城区") == (None, "东城区")
+    assert weather.parse_city("北京市，东城区") == ("北京市", "东城区")
+    with pytest.raises(ValueError):
+        weather.parse_city(" , ")
+
+
+class _FakeHefengApi:
+    def __init__(self):
+        self.calls = []
+
+    def lookup_city(self, name, adm=None):
+        self.calls.append(name)
+        time.sleep(0.05)
+        if name == "无":
+            return []
+        return [location.Location(area_code=name, district=name)]
+
+    def get_weather(self, loc):
+        return _weather(datetime.now(timezone.utc).isoformat())
+
+
+def test_get_weathers():
+    api = _FakeHefengApi()
+    cities = [f"city{i}" for i in range(20)] + ["无", "city0"]
+    started = time.monotonic()
+    results = weather.get_weathers(cities, api, concurrency=10)
+    assert time.monotonic() - started < 0.5
+    assert [x[0] for x in results] == cities[:-1]
+    assert results[0][1].weather == "晴"
+    assert results[-1][1] is None
+    assert isinstance(results[-1][2], ValueError)
+    assert len(api.calls) == 21
+
+
+def test_hefeng_error_not_cached():
+    cache.setup(cache.MapCacheConfig())
+    requests = []
+
+    def _handler(request: httpx.Request):
+        requests.append(request)
+        if len(requests) == 1:
+            return httpx.Response(401, json={"code": "401"})
+        if len(requests) == 2:
+            return httpx.Response(200, json={"code": "429"})
+        city = {"id": "101010100", "name": "北京"}
+        return httpx.Response(200, json={"code": "200", "location": [city]})
+
+    api = weather.HefengWeatherApi(project_id="test-error")
+    api.client = httpx.Client(
+        base_url=weather.HEFENG_BASE_URL, transport=httpx.MockTransport(_handler)
+    )
+    with pytest.raises(httpx.HTTPStatusError):
+        api.lookup_city("北京")
+    with pytest.raises(ValueError):
+        api.lookup_city("北京")
+    assert api.lookup_city("北京")[0].area_code == "101010100"
+    assert api.lookup_city("北京")[0].area_code == "101010100"
+    assert len(requests) == 3